@@ -0,0 +1,83 @@
+## Python script: This script measures the speedup of the multi-core flow accumulation (DEM_Flow_Tiled.py) against one worker.
+## Every number of workers solves the same tiles (those of the largest number of workers), so only the size of the process pool changes between the runs.
+## The flow direction is read from a .npy/GeoTIFF file, or created from a synthetic DEM when no file is given. The accumulation with every number of workers is checked against the run with one worker.
+## Inputs: number of workers to test (e.g. 1;2;4;8;16;32), flow direction (optional), size of the synthetic DEM in cells (optional), memory ceiling in MB (optional)
+## Usage (without ArcGIS): python DEM_Flow_Benchmark.py <workers e.g. 1;2;4;8> [flow_dir.npy|flow_dir.tif|-] [size] [memory ceiling in MB]
+## Last edited: Oct 18, 2026
+#-----------------------------------------------------------------------------------------------#
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import numpy as np
+import DEM_Flow_Engine as fe
+import DEM_Flow_Tiled as ft
+
+
+def synthetic_flow_direction(size, seed=0):
+    # flow direction of a rough tilted surface with valleys, so that the flow paths cross many tiles
+    rng = np.random.RandomState(seed)
+    rows, cols = np.mgrid[0:size, 0:size].astype(np.float64)
+    dem = rows * 0.5 + 20.0 * np.sin(cols / 40.0) + rng.rand(size, size) * 5.0
+    filled, flood_dir = fe.priority_flood_fill(dem)
+    return fe.d8_flow_direction(filled, flood_dir)
+
+
+def benchmark(flow_dir_npy, worker_counts, memory_mb=1024):
+    # time the tiled flow accumulation for each number of workers on the same tiles and return (workers, seconds, speedup) rows
+    shape = np.load(flow_dir_npy, mmap_mode="r").shape
+    windows = ft.worker_windows(shape, memory_mb, max(worker_counts))
+    folder = tempfile.mkdtemp()
+    try:
+        results = []
+        reference = None
+        base_time = None
+        for workers in worker_counts:
+            accum_npy = os.path.join(folder, "flow_accum_" + str(workers) + ".npy")
+            start = time.time()
+            ft.tiled_flow_accumulation(flow_dir_npy, accum_npy, memory_mb, workers, windows)
+            seconds = time.time() - start
+            acc = np.load(accum_npy, mmap_mode="r")
+            if reference is None:
+                reference = np.array(acc)
+                base_time = seconds
+            elif not np.array_equal(np.isnan(acc), np.isnan(reference)) or np.nanmax(np.abs(acc - reference)) != 0:
+                raise ValueError("Flow accumulation with " + str(workers) + " workers differs from the run with " + str(worker_counts[0]) + " worker(s).")
+            results.append((workers, seconds, base_time / seconds))
+        return results
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python DEM_Flow_Benchmark.py <workers e.g. 1;2;4;8> [flow_dir.npy|flow_dir.tif|-] [size] [memory ceiling in MB]")
+        sys.exit(1)
+
+    # speedup is measured against the first number of workers, so one worker is always run first
+    worker_counts = sorted(set([1] + [int(w) for w in sys.argv[1].split(";")]))
+    flow_dir_path = sys.argv[2] if len(sys.argv) > 2 else "-"
+    size = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+    memory_mb = float(sys.argv[4]) if len(sys.argv) > 4 else 1024
+
+    temp_folder = None
+    if flow_dir_path == "-":
+        temp_folder = tempfile.mkdtemp()
+        flow_dir_path = os.path.join(temp_folder, "flow_dir.npy")
+        print("Creating synthetic flow direction of " + str(size) + " x " + str(size) + " cells.")
+        np.save(flow_dir_path, synthetic_flow_direction(size))
+    elif not flow_dir_path.lower().endswith(".npy"):
+        temp_folder = tempfile.mkdtemp()
+        npy_path = os.path.join(temp_folder, "flow_dir.npy")
+        ft.raster_to_npy(flow_dir_path, npy_path)
+        flow_dir_path = npy_path
+
+    try:
+        print("workers   seconds   speedup")
+        for workers, seconds, speedup in benchmark(flow_dir_path, worker_counts, memory_mb):
+            print(str(workers).rjust(7) + str(round(seconds, 2)).rjust(10) + str(round(speedup, 2)).rjust(10))
+    finally:
+        if temp_folder is not None:
+            shutil.rmtree(temp_folder, ignore_errors=True)
@@ -0,0 +1,237 @@
+## Python script: This script fills the depressions in a DEM, finds the flow direction of every cell and accumulates the flow with NumPy arrays. It replaces the Fill, FlowDirection and FlowAccumulation tools
+## of Spatial Analyst so that the stream network can be delineated in-process (or on a machine without an ArcGIS license) and produces the same flow_fill, flow_dir and flow_accum grids.
+## 1) Depressions are filled with a priority-flood from the edge of the DEM, 2) the D8 direction of steepest descent is found for all cells at once and 3) the flow is accumulated in topological order.
+## Flow direction uses the Spatial Analyst codes (1=E, 2=SE, 4=S, 8=SW, 16=W, 32=NW, 64=N, 128=NE). Cells on flats (after filling) drain along the path of the priority-flood towards the outlet.
+## Inputs: DEM (e.g. EDEM_30m.tif), output folder
+## Usage (without ArcGIS): python DEM_Flow_Engine.py <dem.tif> <output folder>
+## Last edited: Oct 18, 2026
+#-----------------------------------------------------------------------------------------------#
+
+import os
+import sys
+import math
+import heapq
+from collections import deque
+import numpy as np
+
+# D8 codes and the row/column offset of the neighbouring cell in each direction
+D8_CODES = np.array([1, 2, 4, 8, 16, 32, 64, 128], dtype=np.uint8)
+D8_DROW = np.array([0, 1, 1, 1, 0, -1, -1, -1])
+D8_DCOL = np.array([1, 1, 0, -1, -1, -1, 0, 1])
+D8_DIST = np.array([1.0, math.sqrt(2.0), 1.0, math.sqrt(2.0), 1.0, math.sqrt(2.0), 1.0, math.sqrt(2.0)])
+
+# lookup table from a D8 code to its direction index (-1 for no data, sinks and undefined codes)
+D8_INDEX = np.full(256, -1, dtype=np.int8)
+D8_INDEX[D8_CODES] = np.arange(8)
+
+# nodata values used when the grids are written to disk
+FILL_NODATA = -9999.0
+DIR_NODATA = 0
+ACCUM_NODATA = -1.0
+
+
+#-----------------------------------------------------------------------------------------------
+# Read and write rasters
+
+def read_dem(dem_path):
+    # read the first band of a GeoTIFF as float64 with nan for no data. The raster profile is returned to write the results on the same grid.
+    import rasterio
+    with rasterio.open(dem_path) as src:
+        dem = src.read(1, masked=True).astype(np.float64).filled(np.nan)
+        profile = src.profile.copy()
+    return dem, profile
+
+
+def write_raster(out_path, array, profile, nodata):
+    # write an array on the grid of the input DEM
+    import rasterio
+    out_profile = profile.copy()
+    out_profile.update(dtype=array.dtype.name, count=1, nodata=nodata, compress="lzw")
+    with rasterio.open(out_path, "w", **out_profile) as dst:
+        dst.write(array, 1)
+
+
+def arcgis_raster_to_array(raster_path):
+    # read an ArcGIS raster as float64 with nan for no data and keep its extent, cell size and spatial reference
+    import arcpy
+    ras = arcpy.Raster(raster_path)
+    array = arcpy.RasterToNumPyArray(ras).astype(np.float64)
+    if ras.noDataValue is not None:
+        array[array == ras.noDataValue] = np.nan
+    ref = {"lower_left": arcpy.Point(ras.extent.XMin, ras.extent.YMin),
+           "cell_x": ras.meanCellWidth,
+           "cell_y": ras.meanCellHeight,
+           "spatial_reference": ras.spatialReference}
+    return array, ref
+
+
+def array_to_arcgis_raster(array, ref, nodata):
+    # convert an array back to an ArcGIS raster on the grid it was read from
+    import arcpy
+    ras = arcpy.NumPyArrayToRaster(array, ref["lower_left"], ref["cell_x"], ref["cell_y"], nodata)
+    arcpy.DefineProjection_management(ras, ref["spatial_reference"])
+    return ras
+
+
+#-----------------------------------------------------------------------------------------------
+# Fill depressions
+
+def priority_flood_fill(dem):
+    # Fill the depressions of the DEM with a priority-flood (Barnes et al. 2014, with a FIFO queue for cells inside depressions).
+    # Cells on the edge of the DEM or next to no data are the seeds. Cells are flooded from the lowest open cell and every cell is raised to the spill elevation of its depression.
+    # Returns the filled DEM and the direction from each cell to the cell that flooded it, which is used to route flow across flats.
+    nrow, ncol = dem.shape
+    width = ncol + 2
+
+    # pad the DEM with a ring of no data so that the neighbours of every cell are inside the array
+    pad = np.full((nrow + 2, ncol + 2), np.nan)
+    pad[1:-1, 1:-1] = dem
+    nodata = np.isnan(pad)
+
+    # seeds are the cells with no data in one of their neighbours, they drain out of the DEM
+    seed_dir = np.zeros(pad.shape, dtype=np.uint8)
+    for k in range(8):
+        dr, dc = D8_DROW[k], D8_DCOL[k]
+        nb_nodata = np.zeros(pad.shape, dtype=bool)
+        nb_nodata[1:-1, 1:-1] = nodata[1 + dr:nrow + 1 + dr, 1 + dc:ncol + 1 + dc]
+        seed_dir[(seed_dir == 0) & nb_nodata & ~nodata] = D8_CODES[k]
+
+    z = pad.ravel().tolist()
+    flood_dir = bytearray(seed_dir.ravel().tobytes())
+    closed = bytearray(nodata.ravel().astype(np.uint8).tobytes())
+    offsets = [int(D8_DROW[k] * width + D8_DCOL[k]) for k in range(8)]
+    # code of the direction pointing back to the cell that floods a neighbour
+    back_codes = [int(D8_CODES[(k + 4) % 8]) for k in range(8)]
+
+    seeds = np.flatnonzero(seed_dir.ravel())
+    heap = [(z[i], i) for i in seeds.tolist()]
+    heapq.heapify(heap)
+    for i in seeds.tolist():
+        closed[i] = 1
+    pit = deque()
+
+    while heap or pit:
+        if pit:
+            c = pit.popleft()
+        else:
+            c = heapq.heappop(heap)[1]
+        zc = z[c]
+        for k in range(8):
+            n = c + offsets[k]
+            if closed[n]:
+                continue
+            closed[n] = 1
+            flood_dir[n] = back_codes[k]
+            if z[n] <= zc:
+                # cell is inside a depression or on a flat: raise it to the spill elevation
+                z[n] = zc
+                pit.append(n)
+            else:
+                heapq.heappush(heap, (z[n], n))
+
+    filled = np.array(z).reshape(pad.shape)[1:-1, 1:-1]
+    flood_dir = np.frombuffer(bytes(flood_dir), dtype=np.uint8).reshape(pad.shape)[1:-1, 1:-1].copy()
+    return filled, flood_dir
+
+
+#-----------------------------------------------------------------------------------------------
+# Flow direction
+
+def d8_flow_direction(filled, flood_dir=None):
+    # Find the direction of steepest descent (D8) for all cells at once. Cells without a lower neighbour (flats and edge cells draining out of the DEM)
+    # take the direction of the priority-flood when it is given, otherwise they are left as 0.
+    nrow, ncol = filled.shape
+    pad = np.full((nrow + 2, ncol + 2), np.nan)
+    pad[1:-1, 1:-1] = filled
+
+    max_drop = np.zeros(filled.shape)
+    fdir = np.zeros(filled.shape, dtype=np.uint8)
+    for k in range(8):
+        dr, dc = D8_DROW[k], D8_DCOL[k]
+        drop = (filled - pad[1 + dr:nrow + 1 + dr, 1 + dc:ncol + 1 + dc]) / D8_DIST[k]
+        steeper = drop > max_drop
+        max_drop[steeper] = drop[steeper]
+        fdir[steeper] = D8_CODES[k]
+
+    if flood_dir is not None:
+        flat = fdir == 0
+        fdir[flat] = flood_dir[flat]
+    fdir[np.isnan(filled)] = DIR_NODATA
+    return fdir
+
+
+def flow_receivers(flow_dir):
+    # get the flat index of the cell each cell drains into (-1 when the flow leaves the DEM, reaches no data or the cell has no direction)
+    nrow, ncol = flow_dir.shape
+    k = D8_INDEX[flow_dir.ravel()]
+    rows, cols = np.divmod(np.arange(flow_dir.size), ncol)
+    has_dir = k >= 0
+    r = rows + np.where(has_dir, D8_DROW[k], 0)
+    c = cols + np.where(has_dir, D8_DCOL[k], 0)
+    inside = has_dir & (r >= 0) & (r < nrow) & (c >= 0) & (c < ncol)
+    recv = np.full(flow_dir.size, -1, dtype=np.int64)
+    recv[inside] = r[inside] * ncol + c[inside]
+    # flow into a cell with no data leaves the DEM
+    recv[inside] = np.where(flow_dir.ravel()[recv[inside]] == DIR_NODATA, -1, recv[inside])
+    return recv
+
+
+#-----------------------------------------------------------------------------------------------
+# Flow accumulation
+
+def accumulate(recv, valid, weights=None, inflow=None):
+    # Accumulate the flow along the receivers in topological order (Kahn's algorithm, one level of cells at a time).
+    # The accumulation of a cell is the sum of the weights of all cells upstream of it (not including itself), plus any inflow from outside the grid entering it or its upstream cells.
+    n = recv.size
+    w = np.ones(n) if weights is None else np.asarray(weights, dtype=np.float64).ravel()
+    acc = np.zeros(n) if inflow is None else np.asarray(inflow, dtype=np.float64).ravel().copy()
+
+    has_recv = recv >= 0
+    indeg = np.bincount(recv[has_recv], minlength=n)
+    frontier = np.flatnonzero((indeg == 0) & valid)
+    while frontier.size:
+        frontier = frontier[has_recv[frontier]]
+        down = recv[frontier]
+        np.add.at(acc, down, acc[frontier] + w[frontier])
+        np.subtract.at(indeg, down, 1)
+        down = np.unique(down)
+        frontier = down[indeg[down] == 0]
+    return acc
+
+
+def flow_accumulation(flow_dir, weights=None):
+    # find the number of cells (or the sum of weights) flowing into each cell, no data is nan
+    recv = flow_receivers(flow_dir)
+    valid = flow_dir.ravel() != DIR_NODATA
+    acc = accumulate(recv, valid, weights).reshape(flow_dir.shape)
+    acc[flow_dir == DIR_NODATA] = np.nan
+    return acc
+
+
+#-----------------------------------------------------------------------------------------------
+# Run all three steps
+
+def flow_grids(dem):
+    # fill, flow direction and flow accumulation of a DEM array
+    filled, flood_dir = priority_flood_fill(dem)
+    fdir = d8_flow_direction(filled, flood_dir)
+    acc = flow_accumulation(fdir)
+    return filled, fdir, acc
+
+
+def run_flow_engine(dem_path, out_folder):
+    # create flow_fill.tif, flow_dir.tif and flow_accum.tif from a GeoTIFF DEM
+    dem, profile = read_dem(dem_path)
+    filled, fdir, acc = flow_grids(dem)
+    write_raster(os.path.join(out_folder, "flow_fill.tif"), np.where(np.isnan(filled), FILL_NODATA, filled).astype(np.float32), profile, FILL_NODATA)
+    write_raster(os.path.join(out_folder, "flow_dir.tif"), fdir, profile, DIR_NODATA)
+    write_raster(os.path.join(out_folder, "flow_accum.tif"), np.where(np.isnan(acc), ACCUM_NODATA, acc).astype(np.float32), profile, ACCUM_NODATA)
+    return filled, fdir, acc
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python DEM_Flow_Engine.py <dem.tif> <output folder>")
+        sys.exit(1)
+    run_flow_engine(sys.argv[1], sys.argv[2])
+    print("Created flow_fill.tif, flow_dir.tif and flow_accum.tif in " + str(sys.argv[2]))
@@ -0,0 +1,387 @@
+## Python script: This script accumulates flow for flow direction rasters which are larger than the memory. The flow direction raster is read in tiles (windows) from a memory-mapped array,
+## the flow is accumulated in each tile and the tiles are stitched together with a small graph of the cells where flow crosses the edge of a tile. The result is identical to a single pass of DEM_Flow_Engine.py.
+## 1) Pass 1: accumulate flow in each tile and find, for every cell on the edge of the tile, the cell where its flow leaves the tile (exit cell).
+## 2) Stitch: solve the accumulation of the exit cells in topological order to get the inflow into every tile from its neighbours.
+## 3) Pass 2: accumulate flow in each tile again with the inflow from its neighbours and write the tile to the memory-mapped flow accumulation array.
+## The tiles of each pass do not depend on each other, so they can be solved on a process pool which shares the memory-mapped arrays (multi-core flow accumulation).
+## Inputs: flow direction (.npy or GeoTIFF with Spatial Analyst codes), output flow accumulation (.npy), memory ceiling in MB, number of workers
+## Usage (without ArcGIS): python DEM_Flow_Tiled.py <flow_dir.npy|flow_dir.tif> <flow_accum.npy> [memory ceiling in MB] [workers]
+## With more than one worker inside ArcGIS (ArcMap / ArcGIS Pro script tools), the process pool cannot be started from the tool: the workers would start the ArcGIS application
+## (sys.executable) or import the tool again. The tools run this script as a separate python.exe of the ArcGIS Python install instead (run_subprocess), where the pool starts
+## under the __main__ guard below.
+## Last edited: Oct 18, 2026
+#-----------------------------------------------------------------------------------------------#
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import numpy as np
+import DEM_Flow_Engine as fe
+
+# approximate number of bytes used for each cell of a tile while it is solved (flow direction, receivers, accumulation and indices)
+BYTES_PER_CELL = 96
+
+# number of rows copied at a time when a raster is converted to a memory-mapped array
+BLOCK_ROWS = 1024
+
+
+#-----------------------------------------------------------------------------------------------
+# Memory-mapped rasters
+
+def raster_to_npy(raster_path, npy_path, block_rows=BLOCK_ROWS):
+    # copy the first band of a GeoTIFF to a .npy file one block of rows at a time so that it can be memory-mapped
+    import rasterio
+    from rasterio.windows import Window
+    with rasterio.open(raster_path) as src:
+        out = np.lib.format.open_memmap(npy_path, mode="w+", dtype=src.dtypes[0], shape=(src.height, src.width))
+        for r0 in range(0, src.height, block_rows):
+            nr = min(block_rows, src.height - r0)
+            out[r0:r0 + nr] = src.read(1, window=Window(0, r0, src.width, nr))
+        out.flush()
+        del out
+
+
+def arcgis_raster_to_npy(raster_path, npy_path, block_rows=BLOCK_ROWS):
+    # copy an ArcGIS raster to a .npy file one block of rows at a time (no data is written as 0)
+    import arcpy
+    ras = arcpy.Raster(raster_path)
+    out = np.lib.format.open_memmap(npy_path, mode="w+", dtype=np.uint8, shape=(ras.height, ras.width))
+    for r0 in range(0, ras.height, block_rows):
+        nr = min(block_rows, ras.height - r0)
+        # the lower left corner of the block counts from the bottom of the raster
+        lower_left = arcpy.Point(ras.extent.XMin, ras.extent.YMax - (r0 + nr) * ras.meanCellHeight)
+        out[r0:r0 + nr] = arcpy.RasterToNumPyArray(ras, lower_left, ras.width, nr, 0)
+    out.flush()
+    del out
+
+
+def npy_to_arcgis_raster(npy_path, reference_raster, out_folder, out_name, nodata, block_rows=BLOCK_ROWS):
+    # write a memory-mapped array as an ArcGIS raster on the grid of a reference raster, one block of rows at a time
+    import arcpy
+    ref = arcpy.Raster(reference_raster)
+    array = np.load(npy_path, mmap_mode="r")
+    blocks = []
+    for r0 in range(0, array.shape[0], block_rows):
+        nr = min(block_rows, array.shape[0] - r0)
+        lower_left = arcpy.Point(ref.extent.XMin, ref.extent.YMax - (r0 + nr) * ref.meanCellHeight)
+        block = np.array(array[r0:r0 + nr], dtype=np.float64)
+        block[np.isnan(block)] = nodata
+        block_ras = arcpy.NumPyArrayToRaster(block, lower_left, ref.meanCellWidth, ref.meanCellHeight, nodata)
+        block_path = os.path.join(arcpy.env.scratchFolder, out_name + "_blk" + str(len(blocks)) + ".tif")
+        block_ras.save(block_path)
+        blocks.append(block_path)
+    arcpy.MosaicToNewRaster_management(blocks, out_folder, out_name, ref.spatialReference, "32_BIT_FLOAT", ref.meanCellWidth, 1)
+    for block_path in blocks:
+        arcpy.Delete_management(block_path)
+
+
+def open_flow_direction(flow_dir_path, scratch_folder=None):
+    # memory-map the flow direction; a GeoTIFF is first copied to flow_dir.npy in scratch_folder (the folder of the input is not written)
+    if not str(flow_dir_path).lower().endswith(".npy"):
+        if scratch_folder is None:
+            raise ValueError("A scratch folder is needed to copy the flow direction " + str(flow_dir_path) + " to a .npy file.")
+        npy_path = os.path.join(str(scratch_folder), "flow_dir.npy")
+        raster_to_npy(flow_dir_path, npy_path)
+        flow_dir_path = npy_path
+    return np.load(flow_dir_path, mmap_mode="r")
+
+
+def tile_windows(shape, memory_mb, min_tiles=1):
+    # split the raster into square tiles which fit in the memory ceiling, as (first row, first column, rows, columns).
+    # The tiles are made smaller when needed to get at least min_tiles tiles (to keep all the workers of a process pool busy).
+    tile = int(np.sqrt(float(memory_mb) * 1024 * 1024 / BYTES_PER_CELL))
+    if min_tiles > 1:
+        tile = min(tile, int(np.ceil(np.sqrt(float(shape[0]) * shape[1] / min_tiles))))
+    tile = max(tile, 2)
+    windows = []
+    for r0 in range(0, shape[0], tile):
+        for c0 in range(0, shape[1], tile):
+            windows.append((r0, c0, min(tile, shape[0] - r0), min(tile, shape[1] - c0)))
+    return windows
+
+
+def peak_rss_mb():
+    # peak resident memory of this process and of its finished workers in MB (None where the resource module is not available, e.g. on Windows)
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    if sys.platform == "darwin":
+        return rss / (1024.0 * 1024.0)
+    return rss / 1024.0
+
+
+#-----------------------------------------------------------------------------------------------
+# Solve one tile
+
+def tile_receivers(fdir_tile, r0, c0, shape):
+    # receivers of the cells of a tile as local indices (-1 when the flow leaves the tile) and as global indices (-1 when the flow leaves the raster)
+    nr, nc = fdir_tile.shape
+    k = fe.D8_INDEX[fdir_tile.ravel()]
+    rows, cols = np.divmod(np.arange(fdir_tile.size), nc)
+    has_dir = k >= 0
+    r = rows + np.where(has_dir, fe.D8_DROW[k], 0)
+    c = cols + np.where(has_dir, fe.D8_DCOL[k], 0)
+
+    in_tile = has_dir & (r >= 0) & (r < nr) & (c >= 0) & (c < nc)
+    local = np.full(fdir_tile.size, -1, dtype=np.int64)
+    local[in_tile] = r[in_tile] * nc + c[in_tile]
+    # flow into a cell with no data leaves the raster
+    local[in_tile] = np.where(fdir_tile.ravel()[local[in_tile]] == fe.DIR_NODATA, -1, local[in_tile])
+
+    gr = r + r0
+    gc = c + c0
+    in_raster = has_dir & ~in_tile & (gr >= 0) & (gr < shape[0]) & (gc >= 0) & (gc < shape[1])
+    glob = np.full(fdir_tile.size, -1, dtype=np.int64)
+    glob[in_raster] = gr[in_raster] * shape[1] + gc[in_raster]
+    return local, glob
+
+
+def edge_cells(nr, nc):
+    # local indices of the cells on the edge of a tile
+    edge = np.zeros((nr, nc), dtype=bool)
+    edge[0, :] = True
+    edge[-1, :] = True
+    edge[:, 0] = True
+    edge[:, -1] = True
+    return np.flatnonzero(edge)
+
+
+def solve_tile(fdir, window, inflow=None):
+    # Accumulate the flow in one tile. Without inflow (pass 1) the summary of the tile for the boundary graph is returned:
+    # the global ids of the exit cells, their local accumulation and their global receiver, and for each edge cell the exit cell its flow leaves the tile through.
+    # With the inflow from the neighbouring tiles (pass 2) the final accumulation of the tile is returned.
+    r0, c0, nr, nc = window
+    shape = fdir.shape
+    fdir_tile = np.array(fdir[r0:r0 + nr, c0:c0 + nc])
+    local, glob = tile_receivers(fdir_tile, r0, c0, shape)
+    valid = fdir_tile.ravel() != fe.DIR_NODATA
+    acc = fe.accumulate(local, valid, inflow=inflow)
+
+    if inflow is not None:
+        acc = acc.reshape(nr, nc)
+        acc[fdir_tile == fe.DIR_NODATA] = np.nan
+        return acc
+
+    # follow the local receivers to the last cell in the tile (pointer jumping)
+    terminal = np.where(local >= 0, local, np.arange(local.size))
+    while True:
+        nxt = terminal[terminal]
+        if np.array_equal(nxt, terminal):
+            break
+        terminal = nxt
+
+    rows, cols = np.divmod(np.arange(local.size), nc)
+    to_global = (rows + r0) * shape[1] + (cols + c0)
+
+    exits = np.flatnonzero(valid & (glob >= 0))
+    edges = edge_cells(nr, nc)
+    edges = edges[valid[edges]]
+    edge_terminal = terminal[edges]
+    edge_exit = np.where(glob[edge_terminal] >= 0, to_global[edge_terminal], -1)
+    return {"exit_id": to_global[exits], "exit_acc": acc[exits], "exit_recv": glob[exits],
+            "edge_id": to_global[edges], "edge_exit": edge_exit}
+
+
+#-----------------------------------------------------------------------------------------------
+# Stitch the tiles
+
+def solve_boundary_graph(summaries):
+    # Solve the accumulation of the exit cells of all tiles. The flow of exit cell e enters the neighbouring tile at its receiver and leaves that tile through
+    # the exit cell of the receiver, so the exit cells form a small directed acyclic graph. Returns the inflow into every cell which receives flow from another tile.
+    exit_id = np.concatenate([s["exit_id"] for s in summaries])
+    exit_acc = np.concatenate([s["exit_acc"] for s in summaries])
+    exit_recv = np.concatenate([s["exit_recv"] for s in summaries])
+    edge_id = np.concatenate([s["edge_id"] for s in summaries])
+    edge_exit = np.concatenate([s["edge_exit"] for s in summaries])
+    if exit_id.size == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    # look up the exit cell of each receiver with a sorted join (receivers with no data are not edge cells and drain out of the raster)
+    order = np.argsort(edge_id)
+    edge_id = edge_id[order]
+    edge_exit = edge_exit[order]
+    pos = np.searchsorted(edge_id, exit_recv)
+    pos[pos == edge_id.size] = 0
+    recv_valid = edge_id[pos] == exit_recv
+    next_exit = np.where(recv_valid, edge_exit[pos], -1)
+
+    # convert the downstream exit cell to a position in the exit arrays and accumulate the exit cells with the same topological sweep as the grid
+    exit_order = np.argsort(exit_id)
+    pos = np.searchsorted(exit_id[exit_order], next_exit)
+    pos[pos == exit_id.size] = 0
+    down = np.where(next_exit >= 0, exit_order[pos], -1)
+    final = fe.accumulate(down, np.ones(exit_id.size, dtype=bool), inflow=exit_acc)
+
+    # inflow into the receiving cells (each exit cell passes on its accumulation and itself)
+    keep = recv_valid
+    cells, index = np.unique(exit_recv[keep], return_inverse=True)
+    inflow = np.bincount(index, weights=final[keep] + 1.0, minlength=cells.size)
+    return cells, inflow
+
+
+def split_inflow(windows, shape, cells, inflow):
+    # split the inflow between the tiles, as the local index and the inflow of the receiving cells of each tile
+    rows, cols = np.divmod(cells, shape[1])
+    parts = []
+    for r0, c0, nr, nc in windows:
+        inside = (rows >= r0) & (rows < r0 + nr) & (cols >= c0) & (cols < c0 + nc)
+        parts.append(((rows[inside] - r0) * nc + (cols[inside] - c0), inflow[inside]))
+    return parts
+
+
+def tile_inflow(window, local_cells, local_inflow):
+    # inflow into the cells of one tile as a flat array of the tile
+    tile_in = np.zeros(window[2] * window[3])
+    tile_in[local_cells] = local_inflow
+    return tile_in
+
+
+#-----------------------------------------------------------------------------------------------
+# Process pool. The workers share the flow direction and flow accumulation through memory-mapped files, so only the tile windows and the summaries are sent between processes.
+
+_worker = {}
+
+
+def _init_worker(flow_dir_npy, out_path):
+    _worker["fdir"] = np.load(flow_dir_npy, mmap_mode="r")
+    _worker["out"] = np.load(out_path, mmap_mode="r+")
+
+
+def _pass1(window):
+    return solve_tile(_worker["fdir"], window)
+
+
+def _pass2(args):
+    window, local_cells, local_inflow = args
+    r0, c0, nr, nc = window
+    _worker["out"][r0:r0 + nr, c0:c0 + nc] = solve_tile(_worker["fdir"], window, tile_inflow(window, local_cells, local_inflow))
+    _worker["out"].flush()
+
+
+def python_executable():
+    # Python interpreter to start worker processes: sys.executable, or python.exe of the Python install when the script runs inside an application (e.g. ArcGISPro.exe, ArcMap.exe)
+    name = os.path.basename(sys.executable).lower()
+    if name.startswith("python"):
+        return sys.executable
+    for folder in (sys.exec_prefix, os.path.join(sys.exec_prefix, "bin")):
+        for exe in ("python.exe", "python"):
+            path = os.path.join(folder, exe)
+            if os.path.isfile(path):
+                return path
+    return sys.executable
+
+
+#-----------------------------------------------------------------------------------------------
+# Tiled flow accumulation
+
+def worker_windows(shape, memory_mb=1024, workers=1):
+    # tiles of the tiled flow accumulation with a number of workers: the memory ceiling is shared between the workers, with at least 4 tiles per worker
+    workers = max(int(workers), 1)
+    return tile_windows(shape, float(memory_mb) / workers, 4 * workers if workers > 1 else 1)
+
+
+def tiled_flow_accumulation(flow_dir_path, out_path, memory_mb=1024, workers=1, windows=None, scratch_folder=None):
+    # Accumulate the flow of a memory-mapped flow direction raster tile by tile and write the result to a memory-mapped .npy file.
+    # With more than one worker the tiles of each pass are solved on a process pool; the memory ceiling is shared between the workers (worker_windows).
+    # windows: tiles to use instead of those of worker_windows (e.g. the same tiles for every number of workers in DEM_Flow_Benchmark.py).
+    # A GeoTIFF flow direction is copied to a temporary folder in scratch_folder (the temporary folder of the system by default), deleted at the end.
+    if str(flow_dir_path).lower().endswith(".npy"):
+        return _accumulate(open_flow_direction(flow_dir_path), out_path, memory_mb, workers, windows)
+    folder = tempfile.mkdtemp(dir=scratch_folder)
+    try:
+        return _accumulate(open_flow_direction(flow_dir_path, folder), out_path, memory_mb, workers, windows)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def _accumulate(fdir, out_path, memory_mb, workers, windows):
+    workers = max(int(workers), 1)
+    if windows is None:
+        windows = worker_windows(fdir.shape, memory_mb, workers)
+    out = np.lib.format.open_memmap(out_path, mode="w+", dtype=np.float64, shape=fdir.shape)
+
+    if workers == 1:
+        # pass 1: summary of each tile for the boundary graph
+        summaries = [solve_tile(fdir, window) for window in windows]
+
+        # stitch the tiles through the exit cells
+        cells, inflow = solve_boundary_graph(summaries)
+        del summaries
+
+        # pass 2: final accumulation of each tile
+        for window, (local_cells, local_inflow) in zip(windows, split_inflow(windows, fdir.shape, cells, inflow)):
+            r0, c0, nr, nc = window
+            out[r0:r0 + nr, c0:c0 + nc] = solve_tile(fdir, window, tile_inflow(window, local_cells, local_inflow))
+        out.flush()
+        del out
+    else:
+        import multiprocessing
+        out.flush()
+        del out
+        # workers start the Python interpreter, not the application which runs the script (the caller must still be under a __main__ guard, see run_subprocess)
+        multiprocessing.set_executable(python_executable())
+        pool = multiprocessing.Pool(workers, _init_worker, (fdir.filename, out_path))
+        try:
+            summaries = pool.map(_pass1, windows, chunksize=1)
+            cells, inflow = solve_boundary_graph(summaries)
+            del summaries
+            parts = split_inflow(windows, fdir.shape, cells, inflow)
+            pool.map(_pass2, [(window, part[0], part[1]) for window, part in zip(windows, parts)], chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    return len(windows), peak_rss_mb()
+
+
+def run_subprocess(flow_dir_path, out_path, memory_mb=1024, workers=1):
+    # Run tiled_flow_accumulation in a separate Python process through the command line of this script (under its __main__ guard), so that the process pool can start
+    # from ArcGIS script tools. Returns the number of tiles and the peak resident memory in MB (None when not known).
+    script = os.path.abspath(__file__)
+    if script.endswith((".pyc", ".pyo")):
+        script = script[:-1]
+    command = [python_executable(), script, str(flow_dir_path), str(out_path), str(memory_mb), str(int(workers))]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=os.path.dirname(script))
+    output = process.communicate()[0]
+    if not isinstance(output, str):
+        output = output.decode("utf-8", "replace")
+    if process.returncode != 0:
+        raise RuntimeError("Tiled flow accumulation failed:\n" + output)
+    n_tiles = None
+    rss = None
+    for line in output.splitlines():
+        if line.startswith("Accumulated flow in "):
+            n_tiles = int(line.split()[3])
+        elif line.startswith("Peak resident memory: "):
+            rss = float(line.split()[3])
+    return n_tiles, rss
+
+
+def flow_accumulation_parallel(flow_dir, workers, memory_mb=1024, scratch_folder=None):
+    # accumulate the flow of an in-memory flow direction array on a process pool (in a separate Python process, run_subprocess), the array is shared with the workers
+    # through a temporary .npy file
+    folder = tempfile.mkdtemp(dir=scratch_folder)
+    try:
+        fdir_npy = os.path.join(folder, "flow_dir.npy")
+        accum_npy = os.path.join(folder, "flow_accum.npy")
+        np.save(fdir_npy, np.ascontiguousarray(flow_dir, dtype=np.uint8))
+        run_subprocess(fdir_npy, accum_npy, memory_mb, workers)
+        acc = np.array(np.load(accum_npy, mmap_mode="r"))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    return acc
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4, 5):
+        print("Usage: python DEM_Flow_Tiled.py <flow_dir.npy|flow_dir.tif> <flow_accum.npy> [memory ceiling in MB] [workers]")
+        sys.exit(1)
+    memory_mb = float(sys.argv[3]) if len(sys.argv) >= 4 else 1024
+    workers = int(sys.argv[4]) if len(sys.argv) == 5 else 1
+    n_tiles, rss = tiled_flow_accumulation(sys.argv[1], sys.argv[2], memory_mb, workers)
+    print("Accumulated flow in " + str(n_tiles) + " tiles on " + str(workers) + " worker(s) with a memory ceiling of " + str(memory_mb) + " MB.")
+    if rss is not None:
+        print("Peak resident memory: " + str(round(rss, 1)) + " MB")
@@ -1,4 +1,5 @@
-## Python Script: This script creates a point feature to represent the pourpoint/outlet of the stream network. The flow accumulation raster is converted to a point feature class and the point with the maximum value is selected as the pourpoint location.
+## Python Script: This script creates a point feature to represent the pourpoint/outlet of the stream network. The flow accumulation raster is read as an array and the cell with the maximum value is selected as the pourpoint location.
+## When the flow direction raster is given, every outlet on the edge of the raster and every internal sink with a flow accumulation above a minimum is also added. The points are snapped to the end of the stream network.
 ## Written by Kimisha Ghunowa, River Hydraulics Research Group, University of Waterloo.
 ## Last edited on Sept 9, 2019
 #---------------------------------------------------------------------------------------#
@@ -8,6 +9,28 @@ import arcpy
 from arcpy import *
 from arcpy.sa import *
 import arceditor
+import numpy as np
+import DEM_Flow_Engine as fe
+
+
+def find_pour_points(flow_dir, flow_accum, min_accum=0):
+    # Find the outlets of the DEM from the arrays: cells whose flow leaves the raster (edge of the raster or next to no data) and internal sinks (cells with no or an undefined flow direction).
+    # Only pour points with a flow accumulation >= min_accum are kept. The cell with the maximum flow accumulation (argmax) is always the first pour point.
+    # Returns the flat cell indices, their flow accumulation and whether each one is an internal sink, sorted by decreasing flow accumulation.
+    acc = flow_accum.ravel()
+    recv = fe.flow_receivers(flow_dir)
+    valid = (flow_dir.ravel() != fe.DIR_NODATA) & ~np.isnan(acc)
+    terminal = np.flatnonzero(valid & (recv < 0))
+    sink = fe.D8_INDEX[flow_dir.ravel()[terminal]] < 0
+
+    keep = acc[terminal] >= float(min_accum)
+    main = np.nanargmax(np.where(valid, acc, -np.inf))
+    keep |= terminal == main
+    terminal = terminal[keep]
+    sink = sink[keep]
+
+    order = np.argsort(-acc[terminal], kind="mergesort")
+    return terminal[order], acc[terminal[order]], sink[order]
 
 
 #Set workspace folder
@@ -19,45 +42,53 @@ arcpy.env.overwriteOutput = True
 
 #Import flow accumulation raster
 f_accum = GetParameterAsText(1)
-flow_accum = Raster(f_accum)
-
-# Process: Convert raster into point and Save as acc_points.shp
-arcpy.RasterToPoint_conversion(flow_accum, "acc_points")
-
-# Process: Find maximum point and Save as table
-accum_points_path= str(workspace_folder) + "\\acc_points.shp"
-arcpy.Statistics_analysis(accum_points_path,"maxaccum_value", [["GRID_CODE", "MAX"]])
-AddMessage("Finding maximum flow accumulation.")
 
-# Process: Use maximum point as variable
-maxaccum_tbl= str(workspace_folder) + "\\maxaccum_value"
-
-#Select maxaccumulation value from table
-cursor=arcpy.da.SearchCursor(maxaccum_tbl, ["MAX_GRID_CODE"])
-for row in cursor:
-	maxaccum= "{0}".format(row[0])
-	maxaccum_flt= str(maxaccum)
-
-#Save maxaccumumulation point as point feature
-
-expression= "GRID_CODE =" + str(maxaccum_flt)
+#Import cell size (snapping distance) and stream network to snap the pour points to
+cell_size = GetParameterAsText(2)
+strmnet= GetParameterAsText(3)
 
-arcpy.MakeFeatureLayer_management (accum_points_path, "pourpoint")
-arcpy.gp.SelectLayerByAttribute_management("pourpoint","NEW_SELECTION",expression)
-arcpy.CopyFeatures_management("pourpoint", "pour_point")
+#Import flow direction raster and minimum flow accumulation of the other outlets and internal sinks (optional, without them only the point with the maximum flow accumulation is created)
+f_dir = GetParameterAsText(4)
+min_outlet = GetParameterAsText(5)
+
+# Process: Read flow accumulation as an array and find the maximum flow accumulation (argmax), the outlets on the edge of the raster and the internal sinks
+accum_array, accum_ref = fe.arcgis_raster_to_array(f_accum)
+if f_dir != "":
+    fdir_array = np.nan_to_num(fe.arcgis_raster_to_array(f_dir)[0]).astype(np.uint8)
+    if min_outlet == "":
+        min_outlet = np.nanmax(accum_array)
+    pour_cells, pour_accum, pour_sink = find_pour_points(fdir_array, accum_array, float(min_outlet))
+else:
+    pour_cells = np.array([np.nanargmax(accum_array)])
+    pour_accum = accum_array.ravel()[pour_cells]
+    pour_sink = np.array([False])
+AddMessage("Finding maximum flow accumulation and " + str(len(pour_cells) - 1) + " other outlets.")
+
+# Process: Save pour points at the centre of their cells as point feature (no points are created for the other cells)
+pourpt= str(workspace_folder) + "\\pour_point.shp"
+arcpy.CreateFeatureclass_management(str(workspace_folder), "pour_point.shp", "POINT", "", "", "", accum_ref["spatial_reference"])
+arcpy.AddField_management(pourpt, "POINTID", "LONG")
+arcpy.AddField_management(pourpt, "GRID_CODE", "DOUBLE")
+arcpy.AddField_management(pourpt, "OUTLET", "TEXT")
+
+pour_rows, pour_cols = np.divmod(pour_cells, accum_array.shape[1])
+pour_x = accum_ref["lower_left"].X + (pour_cols + 0.5) * accum_ref["cell_x"]
+pour_y = accum_ref["lower_left"].Y + (accum_array.shape[0] - pour_rows - 0.5) * accum_ref["cell_y"]
+
+cursor = arcpy.da.InsertCursor(pourpt, ["SHAPE@XY", "POINTID", "GRID_CODE", "OUTLET"])
+for i in range(len(pour_cells)):
+    if i == 0:
+        outlet_type = "MAX"
+    elif pour_sink[i]:
+        outlet_type = "SINK"
+    else:
+        outlet_type = "EDGE"
+    cursor.insertRow(((float(pour_x[i]), float(pour_y[i])), i + 1, float(pour_accum[i]), outlet_type))
+del cursor
 
 # Process: Snap
-pourpt= str(workspace_folder) + "\\pour_point.shp"
-cell_size = GetParameterAsText(2)
-strmnet= GetParameterAsText(3)
 cell_info = str(cell_size) + " Meters"
 vertex_type= "END"
 strmnet_info = [str(strmnet), str(vertex_type), str(cell_info)]
 arcpy.Snap_edit(pourpt, [strmnet_info])
 AddMessage("Creating final pourpoint point called pour_point.shp.")
-
-
-
-
-
-
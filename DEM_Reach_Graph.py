@@ -0,0 +1,312 @@
+## Python script: This script extracts the stream network from the flow direction and flow accumulation arrays as an in-memory reach graph. It replaces Con, StreamLink and StreamToFeature
+## for the stages which only need the connectivity of the network, so that DEM_Segmentation.py does not need to rebuild it from the FROM_NODE/TO_NODE fields of strm_net.shp.
+## 1) Cells with a flow accumulation >= threshold belong to the stream, 2) a new link (branch) starts at every source and every confluence (Stream Link), 3) the cells of each link are ordered from upstream to downstream.
+## The graph stores the cells of all links as one array of flat cell indices with offsets (link_ptr), the link ids, the downstream link of each link and the elevation and flow accumulation of every cell (node).
+## The graph also gives the cell-to-cell reaches used by DEM_Segmentation.py (one reach per step from a stream cell to the next cell downstream) without RasterToPoint, Integrate and SplitLine.
+## Inputs: flow direction, flow accumulation, threshold, filled DEM (optional)
+## Last edited: Oct 18, 2026
+#-----------------------------------------------------------------------------------------------#
+
+import os
+import numpy as np
+import DEM_Flow_Engine as fe
+
+
+#-----------------------------------------------------------------------------------------------
+# Position of the grid
+
+def grid_from_profile(profile):
+    # grid position of a raster read with rasterio (DEM_Flow_Engine.read_dem)
+    transform = profile["transform"]
+    crs = profile.get("crs")
+    return {"x_min": transform.c, "y_max": transform.f, "cell_x": transform.a, "cell_y": -transform.e,
+            "spatial_reference": crs.to_wkt() if crs is not None else ""}
+
+
+def grid_from_arcgis(ref, nrow):
+    # grid position of a raster read with DEM_Flow_Engine.arcgis_raster_to_array
+    return {"x_min": ref["lower_left"].X, "y_max": ref["lower_left"].Y + nrow * ref["cell_y"], "cell_x": ref["cell_x"], "cell_y": ref["cell_y"],
+            "spatial_reference": ref["spatial_reference"].exportToString()}
+
+
+#-----------------------------------------------------------------------------------------------
+# Reach graph
+
+class ReachGraph(object):
+    # Links of the stream network with their cells as index arrays. The cells of link i are cells[link_ptr[i]:link_ptr[i+1]], ordered from upstream to downstream,
+    # and elev/acc hold the elevation and flow accumulation of those cells. down_link is the index of the downstream link (-1 at an outlet).
+    # Per-link attributes added by later stages (e.g. stream order) are kept in link_fields.
+
+    def __init__(self, shape, link_ptr, cells, down_link, elev, acc, grid=None, link_fields=None):
+        self.shape = tuple(int(v) for v in shape)
+        self.link_ptr = link_ptr
+        self.cells = cells
+        self.down_link = down_link
+        self.elev = elev
+        self.acc = acc
+        self.grid = grid
+        self.link_fields = {} if link_fields is None else link_fields
+
+    @property
+    def n_links(self):
+        return self.down_link.size
+
+    @property
+    def link_id(self):
+        # link ids start at 1 as in the Stream Link raster
+        return np.arange(1, self.n_links + 1)
+
+    def link_cells(self, i):
+        return self.cells[self.link_ptr[i]:self.link_ptr[i + 1]]
+
+    def link_of_cell(self):
+        # index of the link of every cell of the graph
+        return np.repeat(np.arange(self.n_links), np.diff(self.link_ptr))
+
+    def nodes(self):
+        # FROM_NODE and TO_NODE of each link as in StreamToFeature: links meet at the node of the first cell of the downstream link and each outlet gets its own node
+        from_node = np.arange(1, self.n_links + 1)
+        to_node = np.where(self.down_link >= 0, self.down_link + 1, 0)
+        outlets = np.flatnonzero(self.down_link < 0)
+        to_node[outlets] = self.n_links + 1 + np.arange(outlets.size)
+        return from_node, to_node
+
+    def xy(self, cells):
+        # coordinates of the centre of cells
+        rows, cols = np.divmod(cells, self.shape[1])
+        x = self.grid["x_min"] + (cols + 0.5) * self.grid["cell_x"]
+        y = self.grid["y_max"] - (rows + 0.5) * self.grid["cell_y"]
+        return x, y
+
+    def link_vertices(self, i):
+        # vertices of the polyline of a link, which ends at the first cell of the downstream link so that the lines are connected
+        cells = self.link_cells(i)
+        if self.down_link[i] >= 0:
+            cells = np.append(cells, self.cells[self.link_ptr[self.down_link[i]]])
+        return self.xy(cells)
+
+    def save(self, path):
+        # save the graph as a .npz file
+        arrays = {"shape": np.array(self.shape), "link_ptr": self.link_ptr, "cells": self.cells, "down_link": self.down_link,
+                  "elev": self.elev, "acc": self.acc}
+        if self.grid is not None:
+            arrays["grid"] = np.array([self.grid["x_min"], self.grid["y_max"], self.grid["cell_x"], self.grid["cell_y"]])
+            arrays["spatial_reference"] = np.array(self.grid["spatial_reference"])
+        for name, values in self.link_fields.items():
+            arrays["link_" + name] = values
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        grid = None
+        if "grid" in data.files:
+            g = data["grid"]
+            grid = {"x_min": float(g[0]), "y_max": float(g[1]), "cell_x": float(g[2]), "cell_y": float(g[3]),
+                    "spatial_reference": str(data["spatial_reference"])}
+        link_fields = dict((name[5:], data[name]) for name in data.files if name.startswith("link_") and name != "link_ptr")
+        return cls(data["shape"], data["link_ptr"], data["cells"], data["down_link"], data["elev"], data["acc"], grid, link_fields)
+
+
+#-----------------------------------------------------------------------------------------------
+# Extract the stream network
+
+def stream_cells(flow_dir, flow_accum, threshold, elev=None):
+    # Stream cells (flow accumulation >= threshold) sorted by flow accumulation, with the position of their downstream stream cell in the same order (-1 at an outlet).
+    # Because the accumulation always increases downstream, the stream cells of any higher threshold are the end (suffix) of these arrays.
+    n = flow_dir.size
+    acc = flow_accum.ravel()
+    recv = fe.flow_receivers(flow_dir)
+    stream = (flow_dir.ravel() != fe.DIR_NODATA) & (acc >= float(threshold))
+    cells = np.flatnonzero(stream)
+    cells = cells[np.argsort(acc[cells], kind="mergesort")]
+
+    # receiver of each stream cell when it is also a stream cell, as a position in cells
+    down = recv[cells]
+    down_in_stream = down >= 0
+    down_in_stream[down_in_stream] = stream[down[down_in_stream]]
+    pos = np.full(n, -1, dtype=np.int64)
+    pos[cells] = np.arange(cells.size)
+    down_pos = np.where(down_in_stream, pos[np.where(down >= 0, down, 0)], -1)
+
+    elev_nodes = elev.ravel()[cells] if elev is not None else np.full(cells.size, np.nan)
+    return {"cells": cells, "acc": acc[cells], "down_pos": down_pos, "elev": elev_nodes}
+
+
+def graph_from_stream_cells(shape, cells, acc, down_pos, elev, grid=None):
+    # Build the reach graph from stream cells sorted by accumulation. All steps are array operations over the stream cells:
+    # links start where the number of upstream stream cells is not 1, every cell finds the start of its link by pointer jumping and the cells are grouped by link.
+    down_in_stream = down_pos >= 0
+
+    # a link starts at a source (no upstream stream cell) or a confluence (2 or more)
+    n_up = np.bincount(down_pos[down_in_stream], minlength=cells.size)
+    head = n_up != 1
+
+    # upstream stream cell of the cells within a link, then the start of the link of every cell by pointer jumping
+    up = np.arange(cells.size)
+    single = down_in_stream & ~head[np.where(down_in_stream, down_pos, 0)]
+    up[down_pos[single]] = np.flatnonzero(single)
+    up[head] = np.flatnonzero(head)
+    while True:
+        nxt = up[up]
+        if np.array_equal(nxt, up):
+            break
+        up = nxt
+
+    # links are numbered by the position of their first cell in the raster (row by row)
+    heads = np.flatnonzero(head)
+    heads = heads[np.argsort(cells[heads])]
+    link_of_head = np.full(cells.size, -1, dtype=np.int64)
+    link_of_head[heads] = np.arange(heads.size)
+    link = link_of_head[up]
+
+    # cells of each link from upstream to downstream (the cells are already sorted by accumulation, which always increases downstream)
+    order = np.argsort(link, kind="mergesort")
+    link_ptr = np.concatenate(([0], np.cumsum(np.bincount(link, minlength=heads.size))))
+
+    # downstream link of the last cell of each link
+    last = order[link_ptr[1:] - 1]
+    down_link = np.where(down_in_stream[last], link[np.where(down_in_stream[last], down_pos[last], 0)], -1)
+    return ReachGraph(shape, link_ptr, cells[order], down_link, elev[order], acc[order], grid)
+
+
+def extract_reach_graph(flow_dir, flow_accum, threshold, elev=None, grid=None):
+    # Build the reach graph of all cells with flow accumulation >= threshold
+    s = stream_cells(flow_dir, flow_accum, threshold, elev)
+    return graph_from_stream_cells(flow_dir.shape, s["cells"], s["acc"], s["down_pos"], s["elev"], grid)
+
+
+def sweep_thresholds(flow_dir, flow_accum, thresholds, elev=None, grid=None):
+    # Build the reach graphs of several thresholds from one flow accumulation grid. The stream cells, their receivers and elevations are found once for the lowest threshold;
+    # the network of every higher threshold is nested in it and is the end of the same sorted arrays, so each threshold only slices the shared arrays and finds its links.
+    # Returns a list of (threshold, graph) in the order of the thresholds.
+    thresholds = [float(t) for t in thresholds]
+    s = stream_cells(flow_dir, flow_accum, min(thresholds), elev)
+    graphs = []
+    for t in thresholds:
+        start = np.searchsorted(s["acc"], t, side="left")
+        down_pos = s["down_pos"][start:]
+        down_pos = np.where(down_pos >= 0, down_pos - start, -1)
+        graphs.append((t, graph_from_stream_cells(flow_dir.shape, s["cells"][start:], s["acc"][start:], down_pos, s["elev"][start:], grid)))
+    return graphs
+
+
+#-----------------------------------------------------------------------------------------------
+# Stream order
+
+def stream_order(graph):
+    # Shreve and Strahler order of every link in one topological pass over the links (one level of links at a time, from the sources downstream).
+    # Shreve: sources are 1 and a link is the sum of the links flowing into it. Strahler: sources are 1 and a link takes the highest order flowing into it, plus 1 when two or more links share that order.
+    # The orders are stored in graph.link_fields as "shreve" and "strahler" and returned.
+    n = graph.n_links
+    down = graph.down_link
+    has_down = down >= 0
+    indeg = np.bincount(down[has_down], minlength=n)
+    source = indeg == 0
+
+    shreve = np.zeros(n, dtype=np.int64)
+    strahler = np.zeros(n, dtype=np.int64)
+    up_max = np.zeros(n, dtype=np.int64)
+    up_max_count = np.zeros(n, dtype=np.int64)
+
+    frontier = np.flatnonzero(source)
+    while frontier.size:
+        # all links flowing into the frontier are done, so the order of the frontier is final
+        shreve[frontier] = np.where(source[frontier], 1, shreve[frontier])
+        strahler[frontier] = np.where(source[frontier], 1, up_max[frontier] + (up_max_count[frontier] >= 2))
+
+        frontier = frontier[has_down[frontier]]
+        d = down[frontier]
+        np.add.at(shreve, d, shreve[frontier])
+
+        # keep the highest upstream Strahler order and how many links have it
+        old_max = up_max[d]
+        np.maximum.at(up_max, d, strahler[frontier])
+        raised = d[up_max[d] > old_max]
+        up_max_count[raised] = 0
+        at_max = strahler[frontier] == up_max[d]
+        np.add.at(up_max_count, d[at_max], 1)
+
+        np.subtract.at(indeg, d, 1)
+        d = np.unique(d)
+        frontier = d[indeg[d] == 0]
+
+    graph.link_fields["shreve"] = shreve
+    graph.link_fields["strahler"] = strahler
+    return shreve, strahler
+
+
+#-----------------------------------------------------------------------------------------------
+# Cell-to-cell reaches
+
+def cell_reaches(graph):
+    # One reach per step from a stream cell to the next cell downstream, taken from the ordered cells of every link; the last cell of a link steps to the first cell of the downstream link
+    # and the last cell of an outlet link has no reach. Returns a dict of columns: start and end (positions in graph.cells), link, upelev, downelev, flow_accum and drainarea_km2
+    # of the start cell, lengthr_m (distance between the cell centres, i.e. the cell size or the diagonal) and down (the reach which starts at the end cell, -1 at an outlet).
+    # The graph needs its grid (cell size and position) for the lengths and drainage areas.
+    if graph.grid is None:
+        raise ValueError("The reach graph has no grid: build it with the grid of the DEM (grid_from_arcgis) to get its cell reaches.")
+    n = graph.cells.size
+    start = np.arange(n)
+    end = start + 1
+    last = graph.link_ptr[1:] - 1
+    has_down = graph.down_link >= 0
+    end[last] = np.where(has_down, graph.link_ptr[:-1][np.where(has_down, graph.down_link, 0)], -1)
+    keep = end >= 0
+    start = start[keep]
+    end = end[keep]
+
+    x, y = graph.xy(graph.cells)
+    reach_of_start = np.full(n, -1, dtype=np.int64)
+    reach_of_start[start] = np.arange(start.size)
+    cell_area = graph.grid["cell_x"] * graph.grid["cell_y"]
+    return {"start": start, "end": end, "link": graph.link_of_cell()[start],
+            "upelev": graph.elev[start], "downelev": graph.elev[end],
+            "flow_accum": graph.acc[start], "drainarea_km2": graph.acc[start] * cell_area / 1000000.0,
+            "lengthr_m": np.hypot(x[end] - x[start], y[end] - y[start]), "down": reach_of_start[end]}
+
+
+def _field_value(value):
+    # Python value of an array element for an insert cursor, None for NaN
+    value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+def _new_feature_class(out_fc, shape_type, grid, fields):
+    import arcpy
+    sr = arcpy.SpatialReference()
+    sr.loadFromString(grid["spatial_reference"])
+    arcpy.Delete_management(out_fc)
+    folder, name = os.path.split(out_fc)
+    arcpy.CreateFeatureclass_management(folder, name, shape_type, "", "DISABLED", "DISABLED", sr)
+    for field, field_type, values in fields:
+        arcpy.AddField_management(out_fc, field, field_type)
+    return sr
+
+
+def write_reach_features(out_fc, graph, reaches, fields, order=None):
+    # Save the reaches as a polyline feature class, one line from the centre of the start cell to the centre of the end cell per reach, in the given order (default: reach order).
+    # fields is a list of (name, AddField type, array with one value per reach).
+    import arcpy
+    sr = _new_feature_class(out_fc, "POLYLINE", graph.grid, fields)
+    x, y = graph.xy(graph.cells)
+    start = reaches["start"]
+    end = reaches["end"]
+    if order is None:
+        order = np.arange(start.size)
+    with arcpy.da.InsertCursor(out_fc, ["SHAPE@"] + [f[0] for f in fields]) as cursor:
+        for r in order:
+            line = arcpy.Polyline(arcpy.Array([arcpy.Point(x[start[r]], y[start[r]]), arcpy.Point(x[end[r]], y[end[r]])]), sr)
+            cursor.insertRow([line] + [_field_value(f[2][r]) for f in fields])
+
+
+def write_cell_points(out_fc, graph, fields):
+    # Save the stream cells of the graph as points at the centre of the cells. fields is a list of (name, AddField type, array with one value per cell of graph.cells).
+    import arcpy
+    _new_feature_class(out_fc, "POINT", graph.grid, fields)
+    x, y = graph.xy(graph.cells)
+    with arcpy.da.InsertCursor(out_fc, ["SHAPE@XY"] + [f[0] for f in fields]) as cursor:
+        for i in range(x.size):
+            cursor.insertRow([(float(x[i]), float(y[i]))] + [_field_value(f[2][i]) for f in fields])
@@ -14,6 +14,10 @@ import sys
 import math
 import pandas as pd
 import numpy as np
+import SPIN_Nodes as nd
+import SPIN_Reach_Store as rs
+import SPIN_Network as sn
+import SPIN_Segments as sg
 
 #Allow overwrite of results
 arcpy.env.overwriteOutput = True
@@ -26,6 +30,18 @@ arcpy.env.overwriteOutput = True
 tbl = GetParameterAsText(0)
 faccell = int(GetParameterAsText(1))
 
+# Reach store of the segments (segments.reaches from the Segmentation tool, optional). The slope and smoothed slope are added to it as columns.
+reach_store = GetParameterAsText(2)
+
+# Smoothing distances in m along the stream (optional, e.g. "500" or "250;500;1000"). When empty, the window is a number of reaches (500 m / cell size upstream and downstream).
+# The window of each reach holds the reaches whose middle is within the distance of its middle, from the cumulative lengthr_m of the segment. Kernel (optional): boxcar (default), triangular or gaussian.
+smooth_distance = GetParameterAsText(3)
+smooth_kernel = GetParameterAsText(4)
+
+# Smoothing statistic (optional): mean (default), median or trimmed mean. The median and trimmed mean (10% cut from each end of the window) are robust to spikes in the slope
+# (e.g. DEM artefacts at culverts and bridges). The kernel only weights the mean.
+smooth_statistic = GetParameterAsText(5)
+
 # Add Field to calculate slope
 arcpy.AddField_management(tbl,"S_mperm", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
 expressionslope= "(!downelev!-!upelev!)/!lengthr_m!"
@@ -45,24 +61,17 @@ SAvg_length = int(((math.ceil(500/faccell))*2) + 1)
 # new field name for average
 savg = raw_value + str("_SAVG")
 
+# smoothing distances: the first one gives savg, and with several distances each one is also saved in its own field (e.g. S_mperm_SAVG_1000m)
+distance_list = [float(d) for d in smooth_distance.split(";") if d.strip() != ""]
+kernel = smooth_kernel if smooth_kernel != "" else "boxcar"
+statistic = smooth_statistic if smooth_statistic != "" else "mean"
+distance_fields = [savg]
+if len(distance_list) > 1:
+    distance_fields = distance_fields + [savg + "_" + ("%g" % d).replace(".", "_") + "m" for d in distance_list]
+
 #add new fields to store results
 fields_list = [field.name for field in arcpy.ListFields(tbl)]
-new_fields_list = ["xstartSAVG", "ystartSAVG", "xendSAVG", "yendSAVG"]
-new_fields_list2 = ["x_ystartSAVG", "x_yendSAVG"]
-new_fields_list3 =["delta_DA","SAvg_ID","SAvg_Reaches", savg]
-
-for new_field in new_fields_list:
-    if new_field in fields_list:
-        #print new_field + " exists: deleted"
-       arcpy.DeleteField_management(tbl, new_field)
-    arcpy.AddField_management(tbl, new_field,"DOUBLE")
-    AddMessage("Add field:")
-
-for new_field2 in new_fields_list2:
-    if new_field2 in fields_list:
-        #print new_field2 + " exists: deleted"
-       arcpy.DeleteField_management(tbl, new_field2)
-    arcpy.AddField_management(tbl, new_field2 ,"TEXT")
+new_fields_list3 =["delta_DA","SAvg_ID","SAvg_Reaches"] + distance_fields
 
 for new_field3 in new_fields_list3:
     if new_field3 in fields_list:
@@ -71,144 +80,59 @@ for new_field3 in new_fields_list3:
     arcpy.AddField_management(tbl, new_field3 ,"DOUBLE") 
 
 
-# add start and end xy coordinates in new fields
-arcpy.CalculateField_management(tbl, "xstartSAVG", "!SHAPE.firstPoint.X!", "PYTHON_9.3", "")
-arcpy.CalculateField_management(tbl, "ystartSAVG", "!SHAPE.firstPoint.Y!", "PYTHON_9.3", "")
-arcpy.CalculateField_management(tbl, "x_ystartSAVG", "str(float(!xstartSAVG!))+\",\"+ str(float(!ystartSAVG!))",  "PYTHON_9.3", "")
-       
-arcpy.CalculateField_management(tbl, "xendSAVG", "!SHAPE.lastPoint.X!", "PYTHON_9.3", "")
-arcpy.CalculateField_management(tbl, "yendSAVG", "!SHAPE.lastPoint.Y!", "PYTHON_9.3", "")
-arcpy.CalculateField_management(tbl, "x_yendSAVG", "str(float(!xendSAVG!))+\",\"+ str(float(!yendSAVG!))",  "PYTHON_9.3", "")
+# add integer node ids of the start and end points of the reaches in new fields (points within the tolerance share one id)
+nd.add_node_fields(tbl, nd.NodeIndex(), "nodestartSAVG", "nodeendSAVG")
 
 #----------------------------------------------------------------------------------------------------------------------------------------
 # Create segments
 
-# create list with all elevation values and sort in descending order.
-elev_list = set()
-cursor1 = arcpy.SearchCursor(tbl)
-
-for row in cursor1:
-    elev_v = row.getValue(down_elev)
-    elev_id = row.getValue(unique_id)
-    pair = (elev_id, elev_v)
-    elev_list.add(pair)
-del row, cursor1
-
-elev_list_sorted = sorted(elev_list, key = lambda x: x[0])
-elev_list_sorted = sorted(elev_list_sorted, key = lambda x: x[1], reverse= True)
-#print len(elev_list_sorted)
+# read the id, elevation at the ending node, drainage area and start and end nodes of all reaches in one pass
+rid_list = []
+elev_list = []
+da_list = []
+startnode_list = []
+endnode_list = []
+with arcpy.da.SearchCursor(tbl, [unique_id, down_elev, da, "nodestartSAVG", "nodeendSAVG"]) as cursor:
+    for row in cursor:
+        rid_list.append(row[0])
+        elev_list.append(np.nan if row[1] is None else row[1])
+        da_list.append(np.nan if row[2] is None else row[2])
+        startnode_list.append(row[3])
+        endnode_list.append(row[4])
 
 #start from the reach with highest elevation, assign the same segment id while tracing downstream of the reach until the difference ratio in drainage area is >=0.1.
-seg_id = 0
-elev_list_count = elev_list_sorted
-
-while len(elev_list_count) != 0:
-    cursor2 = arcpy.UpdateCursor(tbl)
-    max_elev = elev_list_count[0][1]
-    max_id = elev_list_count[0][0]
-    #print max_elev, max_id
-    seg_id = seg_id + 1
-    del elev_list_count[0]
-    #print "max elev " + str(max_elev)
-    for row in cursor2:
-        r_elev = row.getValue(down_elev)
-        r_id = row.getValue(unique_id)
-        if max_elev == r_elev and max_id == r_id:  
-            #print "r_elev " + str(r_elev)
-            #print "r_id" + str(r_id)
-            seg_r_id = 0
-            start_endxy = row.getValue("x_yendSAVG")
-            start_da =  row.getValue(da)
-            #print "start da: " + str(start_da)
-            row.setValue("SAvg_ID", seg_id)
-            row.setValue("SAvg_Reaches", seg_r_id)
-            cursor2.updateRow(row) 
-            break
-    del row, cursor2
-
-    if start_da == None or start_da == 0:
-        start_da = 0.0
-
-    cursor3 = arcpy.UpdateCursor(tbl)
-    for row in cursor3:
-        r_startxy = row.getValue("x_ystartSAVG")
-        if r_startxy == start_endxy:
-            r_da = row.getValue(da)
-            #print r_da
-            r_seg_id = row.getValue("SAvg_ID")
-            if r_da == 0 or r_da == None:
-                delta_da = 0.0
-            else:
-                diff_da = r_da - start_da
-                delta_da = (diff_da)/ r_da
-            #print delta_da
-            if delta_da <0.1 and r_seg_id == None:
-                seg_r_id = seg_r_id + 1
-                #print seg_r_id
-                row.setValue("SAvg_ID", seg_id)
-                row.setValue("SAvg_Reaches", seg_r_id)
-                row.setValue("delta_DA", delta_da)
-                start_endxy = row.getValue("x_yendSAVG")
-                cursor3.updateRow(row)
-                #delete pair in list if exist
-                r_elev = row.getValue(down_elev)
-                r_id = row.getValue(unique_id)
-                pair = (r_id,r_elev)
-                #print pair
-                if pair in elev_list_count:
-                    elev_list_count.remove(pair)
-    del row, cursor3
+# Each reach points to the reach which starts at its end node and reaches with a segment id are skipped, so every reach is visited once.
+down_arr = sn.downstream_rows(startnode_list, endnode_list)
+seg_arr, seg_pos_arr, delta_arr = sg.build_segments(down_arr, sg.seed_order(elev_list, rid_list), da_list)
+
+# write the segment id, position in the segment and difference ratio of every reach in one pass
+seg_values = {}
+for i in range(len(rid_list)):
+    seg_values[rid_list[i]] = [float(seg_arr[i]), float(seg_pos_arr[i]), None if np.isnan(delta_arr[i]) else float(delta_arr[i])]
+with arcpy.da.UpdateCursor(tbl, [unique_id, "SAvg_ID", "SAvg_Reaches", "delta_DA"]) as cursor:
+    for row in cursor:
+        cursor.updateRow([row[0]] + seg_values[row[0]])
 
 #-------------------------------------------------------------------------------------
 # Calculate rolling mean of segment using 25 reaches upstream and 25 reaches downstream in a segment
-# get unique segment ids and their reaches as lists
-
-import pandas as pd
-
-seg_id_l = []
-cursor4 = arcpy.SearchCursor(tbl)
-
-for row in cursor4:
-    seg_id = row.getValue("SAvg_ID")
-    seg_id_l.append(seg_id)
-del row, cursor4
-
-seg_id_l_c = set(seg_id_l)
-seg_id_l_unique = list(seg_id_l_c)
-
-#loop through table and collect reachids
-avg_window = {}
-
-for seg_id in seg_id_l_unique:
-    cursor5 = arcpy.SearchCursor(tbl)
-    
-    for row in cursor5:
-        seg_id_row = row.getValue("SAvg_ID")
-        if seg_id == seg_id_row: #change to seg_id
-            #print seg_id_row
-            seg_r_id = row.getValue("SAvg_Reaches")
-            strm_pow = row.getValue(raw_value)
-            avg_window[seg_r_id] = strm_pow
-    del row, cursor5
-
-    #print avg_window
-    avg_window_df = pd.Series(avg_window)
-    #avg_window_df = avg_window_df[~((avg_window_df-avg_window_df.mean()).abs() > 3*avg_window_df.std())] # remove outliers within 3 stds
-    roll_avg_df = pd.rolling_mean(avg_window_df, window = SAvg_length , min_periods = 1, center = True)
-    #print roll_avg_df
-
-    # loop through set and calculate rolling mean
-    for i, j in roll_avg_df.iteritems():
-        seg_r_id_avg = i
-        avg_value = j
-        cursor6 = arcpy.UpdateCursor(tbl)
-        for row in cursor6:
-            seg_r_id = row.getValue("SAvg_Reaches")
-            seg_id_c = row.getValue("SAvg_ID")
-            if seg_id_c == seg_id and seg_r_id_avg == seg_r_id:
-                row.setValue(savg, avg_value)
-                cursor6.updateRow(row)
-        del row, cursor6
+# all segments are averaged at once from one read of the table (centered window of SAvg_length reaches, at least 1 value) and the results are written in one pass
+if len(distance_list) == 0:
+    sg.smooth_table(tbl, "SAvg_ID", "SAvg_Reaches", raw_value, savg, SAvg_length, 1, statistic)
+else:
+    # window in m along the stream: the reaches are sorted once and every distance is averaged from the same arrays
+    oid_arr, seg_arr, pos_arr, columns = sg.read_segments(tbl, "SAvg_ID", "SAvg_Reaches", [raw_value, "lengthr_m"])
+    if statistic == "mean":
+        means = sg.distance_mean(seg_arr, pos_arr, columns[raw_value], columns["lengthr_m"], distance_list, kernel, 1)
+    else:
+        means = sg.distance_statistic(seg_arr, pos_arr, columns[raw_value], columns["lengthr_m"], distance_list, statistic)
+    if len(distance_list) > 1:
+        means = [means[0]] + means
+    sg.write_columns(tbl, oid_arr, distance_fields, means)
 
 AddMessage("The calculated smoothed slope is saved in final_segments.")
+
+# add the slope and smoothed slope to the reach store (the rows of the store are the rows of final_segments)
+if reach_store != "":
+    rs.append_from_table(rs.ReachStore(reach_store), tbl, [raw_value, "delta_DA", "SAvg_ID", "SAvg_Reaches"] + distance_fields)
+    AddMessage("The calculated smoothed slope is saved in the reach store.")
 #------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
@@ -1,5 +1,7 @@
 ##Python script: This script delineates the stream network from a DEM by 1) filling errors in the DEM, 2) creating a flow direction raster, 3) creating a flow accumulation raster, 4) applying a drainage area threshold to the raster to extract the cells which belong to the stream network and 5) convert the cells which belong to the stream network into a linear feature.
-##Inputs: DEM, Drainage Area Threshold
+##Inputs: DEM, Drainage Area Threshold, option to use the NumPy flow engine (DEM_Flow_Engine.py) for steps 1) to 3), memory ceiling for tiled flow accumulation (DEM_Flow_Tiled.py), number of workers for the flow accumulation
+##With more than 1 worker, the flow accumulation runs DEM_Flow_Tiled.py as a separate python.exe of the ArcGIS Python install (found from sys.exec_prefix), which must be present
+##next to the ArcGIS application; the process pool cannot start inside ArcMap / ArcGIS Pro.
 ##Written by Kimisha Ghunowa, River Hydraulics Research Group, University of Waterloo. 
 # Last edited: Sept 5, 2019.
 #-----------------------------------------------------------------------------------------------#
@@ -27,41 +29,126 @@ out_folder_path = workspace_folder
 # Importing DEM as a parameter
 dem=GetParameterAsText(1)
 
-# Import drainage threshold as parameter
+# Import drainage threshold as parameter. Several thresholds separated by ";" run a threshold sweep on the same flow accumulation; the first threshold is used for the stream rasters and strm_net.shp.
 thres=GetParameterAsText(2)
+thres_list = [t.strip() for t in thres.split(";") if t.strip() != ""]
+thres = thres_list[0]
 
-# Process: Fill the depressions and shave the peaks in the DEM to represent continuous flow downstream and Save 
-dem_fill=Fill(dem)
-dem_fill.save(str(out_folder_path) +"\\flow_fill")
-AddMessage("Creating fill raster where holes/sinks in the DEM are corrected.")
+# Import option to run Fill, Flow Direction and Flow Accumulation with the NumPy flow engine instead of Spatial Analyst
+numpy_engine = GetParameterAsText(3)
 
-# Process: Find the direction of steepest descent (Flow Direction) from cell to cell and Save
-dem_flow_direction= FlowDirection(dem_fill)
-dem_flow_direction.save(str(out_folder_path) + "\\flow_dir")
-AddMessage("Creating flow direction raster to define direction of flow to steepest downslope cell") 
+# Import memory ceiling in MB to accumulate flow tile by tile (optional, leave empty to accumulate the whole DEM at once)
+tiled_memory_mb = GetParameterAsText(4)
 
-# Process: Find the cumulative number of cells which flow into each cell (Flow Accumulation) and Save
-dem_accum = FlowAccumulation(dem_flow_direction)
-dem_accum.save(str(out_folder_path) + "\\flow_accum")
-AddMessage("Creating flow accumulation raster to define the accumulated flow in each cell.")
+# Import number of worker processes for the flow accumulation (optional, 1 by default). More than 1 worker runs DEM_Flow_Tiled.py in a separate python.exe (see above).
+workers = GetParameterAsText(5)
+if workers == "":
+    workers = 1
+workers = int(workers)
+
+if numpy_engine == "true":
+    # Process: Fill, Flow Direction and Flow Accumulation in memory with the NumPy flow engine (DEM_Flow_Engine.py) and Save
+    import numpy as np
+    import DEM_Flow_Engine as fe
+    dem_array, dem_ref = fe.arcgis_raster_to_array(dem)
+    if workers > 1 or tiled_memory_mb != "":
+        # accumulate the flow tile by tile within the memory ceiling, on a process pool with more than one worker (DEM_Flow_Tiled.py)
+        import DEM_Flow_Tiled as ft
+        if tiled_memory_mb != "":
+            AddWarning("The NumPy flow engine fills the DEM and finds the flow direction of the whole DEM in memory; the memory ceiling of " + str(tiled_memory_mb) + " MB only applies to the flow accumulation.")
+        fill_array, flood_dir = fe.priority_flood_fill(dem_array)
+        fdir_array = fe.d8_flow_direction(fill_array, flood_dir)
+        accum_array = ft.flow_accumulation_parallel(fdir_array, workers, float(tiled_memory_mb) if tiled_memory_mb != "" else 1024, scratch_folder=arcpy.env.scratchFolder)
+    else:
+        fill_array, fdir_array, accum_array = fe.flow_grids(dem_array)
+
+    dem_fill = fe.array_to_arcgis_raster(np.where(np.isnan(fill_array), fe.FILL_NODATA, fill_array), dem_ref, fe.FILL_NODATA)
+    dem_fill.save(str(out_folder_path) +"\\flow_fill")
+    AddMessage("Creating fill raster where holes/sinks in the DEM are corrected.")
+
+    dem_flow_direction = fe.array_to_arcgis_raster(fdir_array.astype(np.int32), dem_ref, fe.DIR_NODATA)
+    dem_flow_direction.save(str(out_folder_path) + "\\flow_dir")
+    AddMessage("Creating flow direction raster to define direction of flow to steepest downslope cell")
+
+    dem_accum = fe.array_to_arcgis_raster(np.where(np.isnan(accum_array), fe.ACCUM_NODATA, accum_array), dem_ref, fe.ACCUM_NODATA)
+    dem_accum.save(str(out_folder_path) + "\\flow_accum")
+    AddMessage("Creating flow accumulation raster to define the accumulated flow in each cell.")
+
+else:
+    # Process: Fill the depressions and shave the peaks in the DEM to represent continuous flow downstream and Save 
+    dem_fill=Fill(dem)
+    dem_fill.save(str(out_folder_path) +"\\flow_fill")
+    AddMessage("Creating fill raster where holes/sinks in the DEM are corrected.")
+
+    # Process: Find the direction of steepest descent (Flow Direction) from cell to cell and Save
+    dem_flow_direction= FlowDirection(dem_fill)
+    dem_flow_direction.save(str(out_folder_path) + "\\flow_dir")
+    AddMessage("Creating flow direction raster to define direction of flow to steepest downslope cell") 
+
+    if tiled_memory_mb != "":
+        # Process: Find the cumulative number of cells which flow into each cell tile by tile (DEM_Flow_Tiled.py) for DEMs larger than the memory and Save
+        import DEM_Flow_Tiled as ft
+        fdir_npy = str(out_folder_path) + "\\flow_dir.npy"
+        accum_npy = str(out_folder_path) + "\\flow_accum.npy"
+        ft.arcgis_raster_to_npy(str(out_folder_path) + "\\flow_dir", fdir_npy)
+        if workers > 1:
+            # the process pool starts in a separate python.exe (DEM_Flow_Tiled.py command line)
+            n_tiles, peak_rss = ft.run_subprocess(fdir_npy, accum_npy, float(tiled_memory_mb), workers)
+        else:
+            n_tiles, peak_rss = ft.tiled_flow_accumulation(fdir_npy, accum_npy, float(tiled_memory_mb), workers)
+        ft.npy_to_arcgis_raster(accum_npy, str(out_folder_path) + "\\flow_dir", str(out_folder_path), "flow_accum", -1.0)
+        AddMessage("Creating flow accumulation raster in " + str(n_tiles) + " tiles with a memory ceiling of " + str(tiled_memory_mb) + " MB.")
+        if peak_rss is not None:
+            AddMessage("Peak resident memory of the tiled flow accumulation: " + str(round(peak_rss, 1)) + " MB.")
+    else:
+        # Process: Find the cumulative number of cells which flow into each cell (Flow Accumulation) and Save
+        dem_accum = FlowAccumulation(dem_flow_direction)
+        dem_accum.save(str(out_folder_path) + "\\flow_accum")
+        AddMessage("Creating flow accumulation raster to define the accumulated flow in each cell.")
 
 # Process: Extract cells which belong to the Stream by applying a Drainage Threshold and Save
-thres=GetParameterAsText(2)
 accum_path= str(out_folder_path) + "\\flow_accum"
 expression= "Value >=" + str(thres)
 strm_thres = Con(accum_path, 1 , "", expression)
 strm_thres.save(str(out_folder_path) + "\\strm_thres")
 AddMessage("Creating flow accumulation raster to define the stream by a threshold accumulated flow." + str(expression) + "in m^2.")
 
+if numpy_engine == "true":
+    # Process: Extract the stream cells, links and their connections from the flow direction and flow accumulation arrays as a reach graph (DEM_Reach_Graph.py) and Save for the later stages
+    import DEM_Reach_Graph as rg
+    strm_graph = rg.extract_reach_graph(fdir_array, accum_array, float(thres), fill_array, rg.grid_from_arcgis(dem_ref, dem_array.shape[0]))
+
+    # Process: Assign each link its Shreve and Strahler order in one pass over the reach graph. The orders are saved as columns of the graph instead of a stream order raster.
+    rg.stream_order(strm_graph)
+    strm_graph.save(str(out_folder_path) + "\\strm_graph.npz")
+    AddMessage("Creating reach graph of the stream network called strm_graph.npz with " + str(strm_graph.n_links) + " links and their Shreve and Strahler order.")
+
+if len(thres_list) > 1:
+    # Process: Threshold sweep - extract the reach graph of every threshold from the same flow accumulation (the networks of higher thresholds are nested in the lower ones and share their cells) and Save
+    import numpy as np
+    import DEM_Flow_Engine as fe
+    import DEM_Reach_Graph as rg
+    if numpy_engine != "true":
+        fdir_array, dem_ref = fe.arcgis_raster_to_array(str(out_folder_path) + "\\flow_dir")
+        fdir_array = np.nan_to_num(fdir_array).astype(np.uint8)
+        accum_array = fe.arcgis_raster_to_array(str(out_folder_path) + "\\flow_accum")[0]
+        fill_array = fe.arcgis_raster_to_array(str(out_folder_path) + "\\flow_fill")[0]
+    sweep_grid = rg.grid_from_arcgis(dem_ref, fdir_array.shape[0])
+    for sweep_thres, (t, sweep_graph) in zip(thres_list, rg.sweep_thresholds(fdir_array, accum_array, thres_list, fill_array, sweep_grid)):
+        rg.stream_order(sweep_graph)
+        sweep_graph.save(str(out_folder_path) + "\\strm_graph_" + str(sweep_thres) + ".npz")
+        AddMessage("Threshold " + str(sweep_thres) + ": " + str(sweep_graph.n_links) + " links and " + str(sweep_graph.cells.size) + " stream cells saved in strm_graph_" + str(sweep_thres) + ".npz.")
+
 # Process: Assign a unique identifier to the cells which belong to the same branch in the stream network (Stream Link). The longest branch is assigned the unique identifier 1 and is considered the main branch of the network. All tributaries connected to the main branch are assigned their own identifiers and Save
 strm_link= StreamLink(strm_thres, dem_flow_direction)
 strm_link.save(str(out_folder_path) + "\\strm_link")
 AddMessage("Creating stream network raster with values assigned to each tributary.")
 
-#Process: Assign each branch an order number according to the Shreve’s method (Stream Order) and save
-strm_order = StreamOrder(strm_thres, dem_flow_direction, "SHREVE")
-strm_order.save(str(out_folder_path) + "\\strm_order")
-AddMessage("Creating stream order raster with values assigned to each tributary.")
+#Process: Assign each branch an order number according to the Shreve’s method (Stream Order) and save (with the NumPy flow engine the order is saved in the reach graph instead)
+if numpy_engine != "true":
+    strm_order = StreamOrder(strm_thres, dem_flow_direction, "SHREVE")
+    strm_order.save(str(out_folder_path) + "\\strm_order")
+    AddMessage("Creating stream order raster with values assigned to each tributary.")
 
 # Process: Convert cells belonging to the stream (Raster Stream) to Polyline feature
 strm_network=StreamToFeature(strm_thres, dem_flow_direction, "strm_net.shp", "NO_SIMPLIFY")
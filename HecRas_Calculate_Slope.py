@@ -13,6 +13,7 @@ import sys
 import math
 import pandas as pd
 import numpy as np
+import SPIN_Network as sn
 
 #Allow overwrite of results
 arcpy.env.overwriteOutput = True
@@ -29,6 +30,9 @@ unique_id = "OBJECTID" # reach id
 dist = "SHAPE_LENGTH"
 slope_name = GetParameterAsText(2)
 
+# Number of reaches upstream and downstream for a least-squares slope (optional). When empty, the slope of a reach is the elevation difference with the reach upstream over its length.
+n_neighbours = GetParameterAsText(3)
+
 
 #add fields to store results
 fields_list = [field.name for field in arcpy.ListFields(tbl)]
@@ -39,50 +43,35 @@ for new_field in new_fields_list:
         arcpy.DeleteField_management(tbl, new_field)
     arcpy.AddField_management(tbl, new_field,"DOUBLE")
     
-# get the start of each reach
-rid_list = []
-cursor = arcpy.SearchCursor(tbl)
-for row in cursor:
-    r_id = row.getValue(unique_id)
-    rid_list.append(r_id)
-del row, cursor
+# read the elevation, length and start and end nodes of all reaches in one pass
+oid_list = []
+elev_list = []
+dist_list = []
+startnode_list = []
+endnode_list = []
+with arcpy.da.SearchCursor(tbl, ["OID@", raw_elev, dist, "nodestartINTP", "nodeendINTP"]) as cursor:
+    for row in cursor:
+        oid_list.append(row[0])
+        elev_list.append(np.nan if row[1] is None else row[1])
+        dist_list.append(np.nan if row[2] is None else row[2])
+        startnode_list.append(row[3])
+        endnode_list.append(row[4])
 
-while len(rid_list) !=0: 
-    start_rid = rid_list[0]
-    print start_rid
-    rid_list.remove(start_rid)
-    cursor1 = arcpy.SearchCursor(tbl)
-    for row in cursor1:
-        rid = row.getValue(unique_id)
-        if start_rid == rid:
-            up_elev = row.getValue(raw_elev)
-            print up_elev
-            start_endxy = row.getValue("x_yendINTP") # get end of reach
-            break
-    del row, cursor1
+# each reach points to the reach which starts at its end node. The slope of a reach is (elev - elev of the reach upstream) / length, with the reach upstream on the
+# trace from the first reach in the order of the table, for all reaches at once. An upstream reach without an elevation is skipped for the next upstream reach (in the same
+# order) with one, as the old loop overwrote the slope with the later reach; the slope is null at the start of the network, when the reach has no elevation or no upstream
+# reach has one.
+down_arr = sn.downstream_rows(startnode_list, endnode_list)
+if n_neighbours == "":
+    slope_arr = sn.reach_slope(down_arr, elev_list, dist_list)
+else:
+    # least-squares slope of the elevation over the distance along the stream of the reach and n_neighbours reaches upstream and downstream
+    slope_arr = sn.least_squares_slope(down_arr, elev_list, dist_list, int(n_neighbours))
 
-    cursor2 = arcpy.UpdateCursor(tbl)
-    for row in cursor2:
-        r_startxy = row.getValue("x_ystartINTP")
-        if r_startxy == start_endxy:
-            down_elev = row.getValue(raw_elev) # get the elev
-            distance = row.getValue(dist)
-            slope_tbl = row.getValue(slope_name)
-            if slope_tbl == None:
-                if down_elev == None or up_elev == None:
-                    slope = None
-                    row.setValue(slope_name, slope)
-                    cursor2.updateRow(row)
-                else:
-                    diff = down_elev-up_elev
-                    slope = diff/distance
-                    row.setValue(slope_name, slope)  
-                    cursor2.updateRow(row)
-            # delete id if exists
-            rid = row.getValue(unique_id)
-            if rid in rid_list:
-                rid_list.remove(rid)
-            # next reach
-            start_endxy = row.getValue("x_yendINTP")
-            up_elev = down_elev
-    del row, cursor2
\ No newline at end of file
+# write the slopes in one pass
+slope_values = {}
+for i in range(len(oid_list)):
+    slope_values[oid_list[i]] = None if np.isnan(slope_arr[i]) else float(slope_arr[i])
+with arcpy.da.UpdateCursor(tbl, ["OID@", slope_name]) as cursor:
+    for row in cursor:
+        cursor.updateRow([row[0], slope_values[row[0]]])
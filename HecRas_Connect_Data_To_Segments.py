@@ -14,6 +14,8 @@ from arcpy import env
 from arcpy.sa import *
 import pandas as pd
 import numpy as np
+import SPIN_HecRas as hr
+import SPIN_Snap as sp
 
 #Enable the Spatial Analyst Extension license
 arcpy.CheckOutExtension("Spatial")
@@ -28,60 +30,29 @@ env.workspace= workspace_folder
 # Import the points shapefile of the river stations
 hec_pts = GetParameterAsText(1)
 
-# Import the hecras results (.csv)
+# Import the hecras results (.csv export, or the plan results file .hdf)
 hec_csv = GetParameterAsText(2)
 
 # Import the stream segment
 strm_reach = GetParameterAsText(3)
 
-# Import the hecras bridge results (.csv)
+# Import the hecras bridge results (.csv export, or the plan results file .hdf)
 bridge_analysis = GetParameterAsText(4)
 bridge_hec_csv = GetParameterAsText(5)
 
 #------------------------------------------------------------------
 ## Transform hecrasfile for flood events (.csv) into compatible format
 
-# read file as dataframe (df) by skipping 9 rows and specify column headers 
-df = pd.read_csv(hec_csv, header=[0,1])
+# read the file in chunks: the two header rows give the field names (e.g. Q_Channel_m3pers), blank rows and bridge description rows are skipped and
+# the profiles (i.e. storm events) become columns (e.g. Q_Channel_m3pers_2yr_Fut), one row per river station. The first column (reach) is not read.
+# A results file (.hdf) is read directly into the same table. Parsed tables are kept in the workspace (hecras_cache) and reused while the file does not change.
+hec_cache = os.path.join(str(workspace_folder), "hecras_cache")
+hec_key = hr.results_key(hec_csv, True)
+df_piv = hr.cached_results(hec_csv, hec_cache, True, key=hec_key)
 
-# remove unnamed cells in column names
-for i, col in enumerate(df.columns.levels):
-    columns = np.where(col.str.contains('Unnamed'), '', col)
-    df.columns.set_levels(columns, level=i, inplace=True)
-
-# combine both rows as headers
-col_raw = df.columns
-col_raw.tolist()
-new_col = pd.Index([e[0] + e[1] for e in col_raw.tolist()])
-df.columns = new_col
-
-# transform field name by replace space and symbols with underscore
-df.columns = df.columns.str.replace(' ', '_')
-df.columns = df.columns.str.replace('(', '_')
-df.columns = df.columns.str.replace(')', '')
-df.columns = df.columns.str.replace('/', 'per')
-df.columns = df.columns.str.replace('.', '_')
-
-# Replace all space in df
-df_c = df.replace(' ', '_', regex=True)
-
-#drop rows with none
-df_c = df_c.dropna(axis=0, how = 'all')
-
-# drop columns before profile id
-df_c1 = df_c.drop(df_c.columns[[0]], axis =1)
-
-df_c1 = df_c1.dropna(axis=0, subset=['Profile'])
-
-# pivot table by making the profile (i.e. storm event) data into columns
-df_piv = pd.pivot_table(df_c1, index='River_Sta', columns = 'Profile')
-
-# group stacked columns
-df_piv.columns = df_piv.columns.map('_'.join)
-
-#save transformed hec ras file 
+#save transformed hec ras file (not rewritten while the file does not change)
 hec_csv_f = str(workspace_folder)+ "\\hecras_csv_formatted.csv"
-df_piv.to_csv(hec_csv_f)
+hr.write_csv(df_piv, hec_csv_f, hec_key)
 
 #------------------------------------------------------------------------------
 ## Connect river station points to transformed hecras data
@@ -97,8 +68,8 @@ pts_base = str(os.path.basename(hec_pts))
 pts_name = os.path.splitext(pts_base)[0]
 pts_gdb = str(gdb_name)+ "\\" + str(pts_name)
 
-#convert .csv to gdb table
-hec_csv_gdb= arcpy.TableToTable_conversion(hec_csv_f, gdb_name, "hec_data_formatted")
+#write the transformed data to a gdb table from the arrays of the table (without reading the .csv)
+hec_csv_gdb= hr.to_gdb_table(df_piv, gdb_name + "\\hec_data_formatted")
 
 # Join transformed hecras data to hec points shapefile
 pts_joined_table = arcpy.JoinField_management(pts_gdb, "RIVER_STA", hec_csv_gdb, "River_Sta")
@@ -110,15 +81,21 @@ arcpy.CopyFeatures_management(pts_joined_table, hec_pts_gdb)
 #---------------------------------------------------------------------
 ## Connect river station points with hecras data to stream reach
 
-# snap points to edge of reach 
+# copy the stream reaches to join the hecras data
+hec_strm = os.path.join(gdb_name, "hecras_data_connected")
+arcpy.CopyFeatures_management(strm_reach, hec_strm)
+strm_oid = arcpy.Describe(hec_strm).OIDFieldName
+
+# find the nearest reach within 45m of every river station (all stations at once with a grid index of the reach segments). The reach id, snap distance and position along
+# the reach are saved in the points; stations further than 45m from a reach are reported.
 hec_pts_gdb_c = str(gdb_name) + "\\hec_2points_connected_c"
 arcpy.CopyFeatures_management(hec_pts_gdb, hec_pts_gdb_c)
-snapenv = [strm_reach, "EDGE", "45 Meters"]
-arcpy.Snap_edit(hec_pts_gdb_c, [snapenv])
+outside = sp.snap_points(hec_pts_gdb_c, hec_strm, 45.0, "RIVER_STA")
+if len(outside) != 0:
+    AddWarning(str(len(outside)) + " river stations are more than 45m from a reach and are not connected: " + ", ".join(str(sta) for sta in outside))
 
-# Join the points which are snapped to the stream reach data
-hec_strm = os.path.join(gdb_name, "hecras_data_connected")
-arcpy.SpatialJoin_analysis(strm_reach, hec_pts_gdb_c, hec_strm, "", "", "", "INTERSECT")
+# Join the points to the stream reach data on the id of the nearest reach
+arcpy.JoinField_management(hec_strm, strm_oid, hec_pts_gdb_c, sp.REACH_FIELD)
 
 
 ###########################################################################
@@ -127,184 +104,30 @@ arcpy.SpatialJoin_analysis(strm_reach, hec_pts_gdb_c, hec_strm, "", "", "", "INT
 if bridge_analysis == "true":
 
     # Transform hec csv into compatible format
-    # read file as dataframe by skipping 9 rows and specify column headers
-    df_b = pd.read_csv(bridge_hec_csv, header=[0,1])
-
-    # remove unnamed cells in column names
-    for i, col in enumerate(df_b.columns.levels):
-        columns = np.where(col.str.contains('Unnamed'), '', col)
-        df_b.columns.set_levels(columns, level=i, inplace=True)
-
-    #combine both headers
-    col_raw = df_b.columns
-    col_raw.tolist()
-    new_col = pd.Index([e[0] + e[1] for e in col_raw.tolist()])
-    df_b.columns = new_col
-
-    # replace space and symbols in column names with underscore
-    df_b.columns = df_b.columns.str.replace(' ', '_')
-    df_b.columns = df_b.columns.str.replace('(', '_')
-    df_b.columns = df_b.columns.str.replace(')', '')
-    df_b.columns = df_b.columns.str.replace('/', 'per')
-    df_b.columns = df_b.columns.str.replace('.', '_')
-
-    # replace space in dataframe with underscore
-    df_bc = df_b.replace(' ', '_', regex=True)
-
-    # drop rows with none
-    df_bc = df_bc.dropna(axis=0, how = 'all')
-
-    # pivot table to transform profile from row wise to column wise
-    df_piv_b = pd.pivot_table(df_bc, index='River_Sta', columns = 'Profile')
-
-    #group stacked columns
-    df_piv_b.columns = df_piv_b.columns.map('_'.join)
-
-    # add new columns to calculate bridge scour
-    df_piv_b["Scour_Ratio_2_y_Ex"] = ""
-    df_piv_b["Scour_Ratio_5_y_Ex"] = ""
-    df_piv_b["Scour_Ratio_10_y_Ex"] = ""
-    df_piv_b["Scour_Ratio_25_y_Ex"] = ""
-    df_piv_b["Scour_Ratio_50_y_Ex"] = ""
-    df_piv_b["Scour_Ratio_100_y_Ex"] = ""
-    df_piv_b["Overtop_Ratio_2_y_Ex"] = ""
-    df_piv_b["Overtop_Ratio_5_y_Ex"] = ""
-    df_piv_b["Overtop_Ratio_10_y_Ex"] = ""
-    df_piv_b["Overtop_Ratio_25_y_Ex"] = ""
-    df_piv_b["Overtop_Ratio_50_y_Ex"] = ""
-    df_piv_b["Overtop_Ratio_100_y_Ex"] = ""
-
-    #save transformed data with new fields
+    # read the file in chunks and make the profiles (i.e. storm events) columns, one row per river station
+    bridge_key = hr.results_key(bridge_hec_csv, variables=hr.HDF_BRIDGE_VARIABLES)
+    df_piv_b = hr.cached_results(bridge_hec_csv, hec_cache, variables=hr.HDF_BRIDGE_VARIABLES, key=bridge_key)
+
+    # calculate bridge scour and overtopping for every profile in the file. Every station at a bridge (with a bridge discharge or deck width) is joined to the station
+    # sorted just before it (station above the bridge); the ratios of a bridge are null when a discharge or width of any profile of the pair is missing.
+    ratio_fields = hr.bridge_ratios(df_piv_b)
+    scour_fields = [f for f in ratio_fields if f.startswith(hr.SCOUR_FIELD)]
+
+    #save transformed data with new fields (not rewritten while the file does not change)
     hec_csv_bf = str(workspace_folder)+ "\\hecras_bridge_formatted.csv"
-    df_piv_b.to_csv(hec_csv_bf)
+    hr.write_csv(df_piv_b, hec_csv_bf, bridge_key)
+
+    # save the stations with a scour ratio (i.e. the stations at bridges) in a second file
+    df_piv_b_r = df_piv_b.dropna(axis=0, how="all", subset=scour_fields)
+    hec_csv_bf_r = str(workspace_folder)+ "\\hecras_bridge_ratios_only.csv"
+    hr.write_csv(df_piv_b_r, hec_csv_bf_r, bridge_key)
 
     #-----------------------------------------------------------------------------
-    ## Connect transformed bridge data to gdb table. To calculate bridge scour and bridge overtopping, the data for the upstream river station and at the bridge are required.
-
-    # convert csv to gdb table
-    bhec_csv_gdb= arcpy.TableToTable_conversion(hec_csv_bf, gdb_name, "hec_bridge_data_formatted")
-
-    # loop through table, find river station at bridge,  extract upstream river station data and perform scour and overtopping calculations at bridge
-    # get river stations list
-    rid_list = []
-    cursor = arcpy.SearchCursor(bhec_csv_gdb)
-    for row in cursor:
-        rid = row.getValue("River_Sta")
-        rid_list.append(rid)
-    del row, cursor
-
-    # sort river station list in ascending order
-    rid_list.sort()
-
-    # loop through river station id, get data for first river station to calculate data for following river station.
-
-    while len(rid_list) != 0:
-        rid_br = rid_list[1] # station at bridge
-        rid_up = rid_list[0] # station above bridge
-        rid_list.remove(rid_br)
-        rid_list.remove(rid_up)
-
-        cursor = arcpy.SearchCursor(bhec_csv_gdb)
-        for row in cursor:
-            rid_tbl = row.getValue("River_Sta")
-            if rid_tbl == rid_up:
-                q_up_2 = row.getValue("Q_Channel_m3pers_2_y_Ex")
-                q_up_5 = row.getValue("Q_Channel_m3pers_5_y_Ex")
-                q_up_10 = row.getValue("Q_Channel_m3pers_10_y_Ex")
-                q_up_25 = row.getValue("Q_Channel_m3pers_25_y_Ex")
-                q_up_50 = row.getValue("Q_Channel_m3pers_50_y_Ex")
-                q_up_100 = row.getValue("Q_Channel_m3pers_100_y_Ex")
-                w_up_2 = row.getValue("Top_W_Chnl_m_2_y_Ex")
-                w_up_5 = row.getValue("Top_W_Chnl_m_5_y_Ex")
-                w_up_10 = row.getValue("Top_W_Chnl_m_10_y_Ex")
-                w_up_25 = row.getValue("Top_W_Chnl_m_25_y_Ex")
-                w_up_50 = row.getValue("Top_W_Chnl_m_50_y_Ex")
-                w_up_100 = row.getValue("Top_W_Chnl_m_100_y_Ex")
-                break
-        del row, cursor
-
-        cursor = arcpy.UpdateCursor(bhec_csv_gdb)
-        for row in cursor:
-            rid_tbl = row.getValue("River_Sta")
-            if rid_tbl == rid_br:
-                q_b_2 = row.getValue("Q_Bridge_m3pers_2_y_Ex")
-                q_b_5 = row.getValue("Q_Bridge_m3pers_5_y_Ex")
-                q_b_10 = row.getValue("Q_Bridge_m3pers_10_y_Ex")
-                q_b_25 = row.getValue("Q_Bridge_m3pers_25_y_Ex")
-                q_b_50 = row.getValue("Q_Bridge_m3pers_50_y_Ex")
-                q_b_100 = row.getValue("Q_Bridge_m3pers_100_y_Ex")
-                w_b_2 = row.getValue("Deck_Width_m_2_y_Ex")
-                w_b_5 = row.getValue("Deck_Width_m_5_y_Ex")
-                w_b_10 = row.getValue("Deck_Width_m_10_y_Ex")
-                w_b_25 = row.getValue("Deck_Width_m_25_y_Ex")
-                w_b_50 = row.getValue("Deck_Width_m_50_y_Ex")
-                w_b_100 = row.getValue("Deck_Width_m_100_y_Ex")
-
-                q_t_2 = row.getValue("Q_Total_m3pers_2_y_Ex")
-                q_t_5 = row.getValue("Q_Total_m3pers_5_y_Ex")
-                q_t_10 = row.getValue("Q_Total_m3pers_10_y_Ex")
-                q_t_25 = row.getValue("Q_Total_m3pers_25_y_Ex")
-                q_t_50 = row.getValue("Q_Total_m3pers_50_y_Ex")
-                q_t_100 = row.getValue("Q_Total_m3pers_100_y_Ex")
-
-                if q_up_2 == None or q_up_5 == None or q_up_10 == None or q_up_25 == None or q_up_50 == None or q_up_100 == None or q_b_2 == None or q_b_5 == None or q_b_10 == None or q_b_25 == None or q_b_50 == None or q_b_100 == None or w_up_2 == None or w_up_5 == None or w_up_10 == None or w_up_25 == None or w_up_50 == None or w_up_100 == None or w_b_2 == None or w_b_5 == None or w_b_10 == None or w_b_25 == None or w_b_50 == None or w_b_100 == None:
-                    row.setValue("Scour_Ratio_2_y_Ex", None)
-                    row.setValue("Scour_Ratio_5_y_Ex", None)
-                    row.setValue("Scour_Ratio_10_y_Ex", None)
-                    row.setValue("Scour_Ratio_25_y_Ex", None)
-                    row.setValue("Scour_Ratio_50_y_Ex", None)
-                    row.setValue("Scour_Ratio_100_y_Ex", None)
-                    row.setValue("Overtop_Ratio_2_y_Ex", None)
-                    row.setValue("Overtop_Ratio_5_y_Ex", None)
-                    row.setValue("Overtop_Ratio_10_y_Ex", None)
-                    row.setValue("Overtop_Ratio_25_y_Ex", None)
-                    row.setValue("Overtop_Ratio_50_y_Ex", None)
-                    row.setValue("Overtop_Ratio_100_y_Ex", None)
-                    cursor.updateRow(row)
-                else:
-                    scour_2 = ((q_b_2/q_up_2)**0.857)*((w_up_2/w_b_2)**0.59)
-                    scour_5 = ((q_b_5/q_up_5)**0.857)*((w_up_5/w_b_5)**0.59)
-                    scour_10 = ((q_b_10/q_up_10)**0.857)*((w_up_10/w_b_10)**0.59)
-                    scour_25 = ((q_b_25/q_up_25)**0.857)*((w_up_25/w_b_25)**0.59)
-                    scour_50 = ((q_b_50/q_up_50)**0.857)*((w_up_50/w_b_50)**0.59)
-                    scour_100 = ((q_b_100/q_up_100)**0.857)*((w_up_100/w_b_100)**0.59)
-                    overtop_2 = q_t_2/q_b_2
-                    overtop_5 = q_t_5/q_b_5
-                    overtop_10 = q_t_10/q_b_10
-                    overtop_25 = q_t_25/q_b_25
-                    overtop_50 = q_t_50/q_b_50
-                    overtop_100 = q_t_100/q_b_100
-                    row.setValue("Scour_Ratio_2_y_Ex", scour_2)
-                    row.setValue("Scour_Ratio_5_y_Ex", scour_5)
-                    row.setValue("Scour_Ratio_10_y_Ex", scour_10)
-                    row.setValue("Scour_Ratio_25_y_Ex", scour_25)
-                    row.setValue("Scour_Ratio_50_y_Ex", scour_50)
-                    row.setValue("Scour_Ratio_100_y_Ex", scour_100)
-                    row.setValue("Overtop_Ratio_2_y_Ex", overtop_2)
-                    row.setValue("Overtop_Ratio_5_y_Ex", overtop_5)
-                    row.setValue("Overtop_Ratio_10_y_Ex", overtop_10)
-                    row.setValue("Overtop_Ratio_25_y_Ex", overtop_25)
-                    row.setValue("Overtop_Ratio_50_y_Ex", overtop_50)
-                    row.setValue("Overtop_Ratio_100_y_Ex", overtop_100)
-                    cursor.updateRow(row)
-        del row, cursor
-
-    # create a copy of table
-    bhec_csv_gdb_c = gdb_name + "\\bridge_scour_overtop_ratios_only"
-    arcpy.Copy_management(bhec_csv_gdb, bhec_csv_gdb_c)
-
-    # delete empty rows from final table where all the calculations are null
-    cursor =  arcpy.UpdateCursor(bhec_csv_gdb_c)
-    for row in cursor:
-        s_2 = row.getValue("Scour_Ratio_2_y_Ex")
-        s_5 = row.getValue("Scour_Ratio_5_y_Ex")
-        s_10 = row.getValue("Scour_Ratio_10_y_Ex")
-        s_25 = row.getValue("Scour_Ratio_25_y_Ex")
-        s_50 = row.getValue("Scour_Ratio_50_y_Ex")
-        s_100 = row.getValue("Scour_Ratio_100_y_Ex")
-        if s_2 == None and s_5 == None and s_10 == None and s_25 == None and s_50 == None and s_100 == None:
-            cursor.deleteRow(row)
-    del row, cursor
+    ## Connect transformed bridge data to gdb tables
+
+    # write the tables to gdb tables from their arrays (without reading the .csv files)
+    bhec_csv_gdb= hr.to_gdb_table(df_piv_b, gdb_name + "\\hec_bridge_data_formatted")
+    bhec_csv_gdb_c = hr.to_gdb_table(df_piv_b_r, gdb_name + "\\bridge_scour_overtop_ratios_only")
 
     #---------------------------------------------------------------------------
     ## Connect bridge calculations to a copy of river stations points file 
@@ -319,17 +142,14 @@ if bridge_analysis == "true":
     #-----------------------------------------------------------------------------------------------------------------------
     #Connect points to stream reach
 
-    # snap points to edge of reach 
+    # find the nearest reach within 45m of every bridge station and report the stations outside the tolerance
     b_pts_joined_c = str(gdb_name) + "\\bridge_2points_c"
     arcpy.CopyFeatures_management(b_pts_joined, b_pts_joined_c)
-    snapenv = [strm_reach, "EDGE", "45 Meters"]
-    arcpy.Snap_edit(b_pts_joined_c, [snapenv])
-
-    # Join the points to the stream reach
-    bridge_strm = os.path.join(gdb_name, "bridge_2strm_connected")
-    arcpy.SpatialJoin_analysis(strm_reach, b_pts_joined_c, bridge_strm, "", "", "", "INTERSECT")
+    outside_b = sp.snap_points(b_pts_joined_c, hec_strm, 45.0, "RIVER_STA")
+    if len(outside_b) != 0:
+        AddWarning(str(len(outside_b)) + " bridge stations are more than 45m from a reach and are not connected: " + ", ".join(str(sta) for sta in outside_b))
 
-    # join fields of bridge calculations to strm reach 
-    arcpy.JoinField_management(hec_strm, "OBJECTID" , bridge_strm, "OBJECTID", ["Scour_Ratio_2_y_Ex","Scour_Ratio_5_y_Ex","Scour_Ratio_10_y_Ex","Scour_Ratio_25_y_Ex","Scour_Ratio_50_y_Ex", "Scour_Ratio_100_y_Ex", "Overtop_Ratio_2_y_Ex", "Overtop_Ratio_5_y_Ex", "Overtop_Ratio_10_y_Ex", "Overtop_Ratio_25_y_Ex", "Overtop_Ratio_50_y_Ex", "Overtop_Ratio_100_y_Ex"])
+    # join fields of bridge calculations to strm reach on the id of the nearest reach
+    arcpy.JoinField_management(hec_strm, strm_oid, b_pts_joined_c, sp.REACH_FIELD, ratio_fields)
 
 #---------------------------------------------------------------------------------------------------------------------------------------
\ No newline at end of file
@@ -14,6 +14,8 @@ import sys
 import math
 import pandas as pd
 import numpy as np
+import SPIN_Nodes as nd
+import SPIN_Network as sn
 
 #Allow overwrite of results
 arcpy.env.overwriteOutput = True
@@ -31,154 +33,59 @@ dist_value = GetParameterAsText(4) # stream length
 
 #add fields to store results
 fields_list = [field.name for field in arcpy.ListFields(tbl)]
-new_fields_list = ["xstartINTP", "ystartINTP", "xendINTP", "yendINTP"]
-new_fields_list2 = ["x_ystartINTP", "x_yendINTP"]
 
-for new_field in new_fields_list:
-    if new_field in fields_list:
-        arcpy.DeleteField_management(tbl, new_field)
-    arcpy.AddField_management(tbl, new_field,"DOUBLE")
-        
-for new_field2 in new_fields_list2:
-    if new_field2 in fields_list:
-        arcpy.DeleteField_management(tbl, new_field2)
-    arcpy.AddField_management(tbl, new_field2 ,"TEXT")
-
-#add start and end xy coordinates of reaches
-arcpy.CalculateField_management(tbl, "xstartINTP", "!SHAPE.firstPoint.X!", "PYTHON_9.3", "")
-arcpy.CalculateField_management(tbl, "ystartINTP", "!SHAPE.firstPoint.Y!", "PYTHON_9.3", "")
-arcpy.CalculateField_management(tbl, "x_ystartINTP", "str(float(!xstartINTP!))+\",\"+ str(float(!ystartINTP!))",  "PYTHON_9.3", "")
-arcpy.CalculateField_management(tbl, "xendINTP", "!SHAPE.lastPoint.X!", "PYTHON_9.3", "")
-arcpy.CalculateField_management(tbl, "yendINTP", "!SHAPE.lastPoint.Y!", "PYTHON_9.3", "")
-arcpy.CalculateField_management(tbl, "x_yendINTP", "str(float(!xendINTP!))+\",\"+ str(float(!yendINTP!))",  "PYTHON_9.3", "")
-
-# loop through each field for interpolation and create new field names
-raw_value_split = raw_value.split(';')
-
-for r in raw_value_split:
-    raw_value = str(r)
-    calc_name = str("INTP_") + str(r)
-    if calc_name in fields_list:
-        arcpy.DeleteField_management(tbl, calc_name)
-        arcpy.AddField_management(tbl, calc_name, "DOUBLE")
-    else:
-        arcpy.AddField_management(tbl, calc_name, "DOUBLE")
-
-    # add field to identify reaches that will be interpolated between two selected river stations
-    new_fields_list3 = ["INTP_ID", "INTP_LENGTH"]
-
-    for new_field in new_fields_list3:
-        if new_field in fields_list:
-            arcpy.DeleteField_management(tbl, new_field)
-        arcpy.AddField_management(tbl, new_field, "DOUBLE")
+#add integer node ids of the start and end points of reaches (points within the tolerance share one id)
+nd.add_node_fields(tbl, nd.NodeIndex(), "nodestartINTP", "nodeendINTP")
 
-    # create list with all river station ids where data exists.
-    sta_list = []
-    cursor1 = arcpy.SearchCursor(tbl)
-    for row in cursor1:
-        r_sta = row.getValue(river_sta_id)
-        r_id = row.getValue(unique_id)
-        raw_v = row.getValue(raw_value)
-        if raw_v is not None:
-            pair = (r_id, r_sta)
-            sta_list.append(pair)
-    del row, cursor1
+# create new field names for each field for interpolation
+raw_value_split = [str(r) for r in raw_value.split(';')]
+calc_names = [str("INTP_") + r for r in raw_value_split]
 
-    # loop through table, get first station in list of station with existing data, assign a cumulative length (intp_length) of 0 to the first station, save the value for the field
-    # to be interpolated in y_list and save the cumulative distance in the x_list.
-    sta_list_c = sta_list
-    y_list = []
-    x_list = []
-    x_intp_list = []
+# add field to identify reaches that will be interpolated between two selected river stations
+new_fields_list3 = ["INTP_ID", "INTP_LENGTH"]
 
-    intp_id = 0
-
-    while len(sta_list_c) != 0:
-        x_list=[]
-        y_list=[]
-        x_intp_list = []
-
-        cursor2 = arcpy.UpdateCursor(tbl)
-        first_sta = sta_list_c[0][1]
-        first_rid = sta_list_c[0][0]
-        print first_sta, first_rid
-        intp_id = intp_id + 1
-        del sta_list_c[0]
-        print "processing station " + str(first_sta)
-        for row in cursor2:
-            r_sta = row.getValue(river_sta_id)
-            r_id = row.getValue(unique_id)
-            if first_sta == r_sta and first_rid == r_id:
-                print "r_sta " + str(r_sta)
-                print "r_id " + str(r_id)
-                dist_sum = 0
-                y_start = 0
-                start_endxy = row.getValue("x_yendINTP") # get end of reach
-                first_rawv = row.getValue(raw_value) # get the value to average
-                x_list.append(y_start)     # add first x=0 to x list    
-                y_list.append(first_rawv) # add first elev to y list
-                row.setValue(calc_name, first_rawv)
-                row.setValue("INTP_ID", intp_id)
-                row.setValue("INTP_LENGTH", dist_sum)
-                cursor2.updateRow(row) 
-                break
-        del row, cursor2
-
-        # trace downstream using end xy coordinates of first reach to find start xy coordinates of subsequent reach
-        # if both raw value field (field to be interpolated) and interpolated field (calc_name)are none, then update
-        # the reach's cumulength length (INTP_Length), identifier (INTP_ID) and save the reach id. If raw value exists, break loop.
-        # e.g. let's interpolate elevation values
-        # reach id = [1,2,3,4]  stations 2 and 3 are located between 1 and 4. 1 and 4 have hecras data.
-        # intp_length = [0,10,20,30]
-        # intp_id = [1,1,1,1]
-        # raw value = [120, na, na, 30]
-        # x_list = [0,10,20,30] # same as cumulative length
-        # y_list = [120, na, na, 30]
-        # interpolated raw value = [120, 90, 60,30]
-
-        cursor3 = arcpy.UpdateCursor(tbl)
-        for row in cursor3:
-            r_startxy = row.getValue("x_ystartINTP")
-            if r_startxy == start_endxy:
-                distv = row.getValue(dist_value) # get the distance
-                rawv = row.getValue(raw_value) # get the elev
-                intp_v = row.getValue(calc_name)
-                print distv
-                print rawv
-                print intp_v
-                if rawv == None and intp_v == None:
-                    dist_sum = dist_sum + distv
-                    print "sum distance " + str(dist_sum)
-                    x_intp_list.append(dist_sum)
-                    row.setValue("INTP_LENGTH", dist_sum)
-                    row.setValue("INTP_ID", intp_id)
-                    start_endxy = row.getValue("x_yendINTP")
-                    cursor3.updateRow(row)
-                    #delete pair in list if exist
-                    r_sta = row.getValue(river_sta_id)
-                    r_id = row.getValue(unique_id)
-                    pair = (r_id,r_sta)
-                    #print pair
-                    if pair in sta_list_c:
-                        sta_list_c.remove(pair)
-                elif rawv is not None:
-                    dist_sum = dist_sum + distv
-                    y_list.append(rawv)
-                    x_list.append(dist_sum)
-                    break      
-        del row, cursor3
-        
-        # Use x_list (cumulative length) and y_list (raw values)
-        cursor4 = arcpy.UpdateCursor(tbl)
-        for row in cursor4:
-            intp_id_tbl = row.getValue("INTP_ID")    
-            y_sum_tbl = row.getValue("INTP_LENGTH")
-            rawv_tbl = row.getValue(calc_name)
-            if intp_id == intp_id_tbl and rawv_tbl == None:
-                intp_rawv = np.interp(y_sum_tbl, x_list, y_list)
-                if len(x_list) == 1:                       #### must check this. if difference is too small, min elev may stay the same.
-                    row.setValue(calc_name, None)
-                else:
-                    row.setValue(calc_name, intp_rawv)
-                    cursor4.updateRow(row)
-        del row, cursor4
\ No newline at end of file
+for new_field in calc_names + new_fields_list3:
+    if new_field in fields_list:
+        arcpy.DeleteField_management(tbl, new_field)
+    arcpy.AddField_management(tbl, new_field, "DOUBLE")
+
+# read the values of all fields, length and start and end nodes of all reaches in one pass. Reaches with a value are the river stations (of that field),
+# taken in the order of the table.
+oid_list = []
+rawv_list = []
+dist_list = []
+startnode_list = []
+endnode_list = []
+n_fields = len(raw_value_split)
+with arcpy.da.SearchCursor(tbl, ["OID@", dist_value, "nodestartINTP", "nodeendINTP"] + raw_value_split) as cursor:
+    for row in cursor:
+        oid_list.append(row[0])
+        dist_list.append(np.nan if row[1] is None else row[1])
+        startnode_list.append(row[2])
+        endnode_list.append(row[3])
+        rawv_list.append([np.nan if v is None else v for v in row[4:]])
+rawv_arr = np.array(rawv_list, dtype=np.float64).reshape(len(oid_list), n_fields)
+
+# trace downstream from every river station through the reaches without a value (each reach points to the reach which starts at its end node) until a reach with a value.
+# The cumulative length from the end of the station (INTP_LENGTH) gives the x of the interpolation and the station and the next reach with a value give the y.
+# e.g. let's interpolate elevation values
+# reach id = [1,2,3,4]  stations 2 and 3 are located between 1 and 4. 1 and 4 have hecras data.
+# intp_length = [0,10,20,30]
+# intp_id = [1,1,1,1]
+# raw value = [120, na, na, 30]
+# interpolated raw value = [120, 90, 60,30]
+# A reach is traced from the first station which reaches it; the reaches of a trace which ends without a reach with a value are not interpolated (null).
+# All reaches and fields are interpolated at once: the network is traced once and each field (column) has its own stations and reaches without a value.
+down_arr = sn.downstream_rows(startnode_list, endnode_list)
+intp_arr, intp_id_arr, intp_length_arr = sn.interpolate_gaps(down_arr, dist_list, rawv_arr)
+
+# write the results in one pass (INTP_ID and INTP_LENGTH of the last field)
+intp_values = {}
+for i in range(len(oid_list)):
+    values = [None if np.isnan(v) else float(v) for v in intp_arr[i]]
+    values.append(None if intp_id_arr[i, -1] == 0 else float(intp_id_arr[i, -1]))
+    values.append(None if np.isnan(intp_length_arr[i, -1]) else float(intp_length_arr[i, -1]))
+    intp_values[oid_list[i]] = values
+with arcpy.da.UpdateCursor(tbl, ["OID@"] + calc_names + new_fields_list3) as cursor:
+    for row in cursor:
+        cursor.updateRow([row[0]] + intp_values[row[0]])
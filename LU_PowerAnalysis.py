@@ -11,6 +11,7 @@ from arcpy.sa import *
 import os
 import arceditor
 import arcinfo
+import SPIN_Nodes as nd
 
 #Set workspace folder
 workspace_folder = GetParameterAsText(0)
@@ -179,16 +180,6 @@ arcpy.AddField_management(disch_ptgdb, "Q_m3pers", "DOUBLE", "", "", "", "", "NU
 expressionuq= "!urban_c!*(!drainarea_km2!**!urban_x!)*(!totalimp_percnt!**!urban_b!)"
 arcpy.CalculateField_management(disch_ptgdb,"Q_m3pers",str(expressionuq),"PYTHON_9.3","#")
 
-# Add field to discharge points to obtain the x,y coordinates of the points
-arcpy.AddField_management(disch_ptgdb,"xp", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-arcpy.AddField_management(disch_ptgdb,"yp","DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-arcpy.AddField_management(disch_ptgdb,"x_yp", "TEXT")
-
-arcpy.CalculateField_management(disch_ptgdb, "xp", "!SHAPE.CENTROID.X!", "PYTHON_9.3", "")
-arcpy.CalculateField_management(disch_ptgdb, "yp", "!SHAPE.CENTROID.Y!", "PYTHON_9.3", "")
-
-arcpy.CalculateField_management(disch_ptgdb, "x_yp", "str(float(!xp!))+\",\"+ str(float(!yp!))",  "PYTHON_9.3", "")
-
 ##-------------------------------------------------------------------------------------------------
 ## Joining discharge to segments 
 
@@ -196,16 +187,13 @@ arcpy.CalculateField_management(disch_ptgdb, "x_yp", "str(float(!xp!))+\",\"+ st
 disch_reachesgdb = str(gdb_name) + "\\LU_Pow"
 arcpy.CopyFeatures_management(disch_reach, disch_reachesgdb)
 
-# Add Fields to discharge_reaches to obtain the first x,y coordinates.
-arcpy.AddField_management(disch_reachesgdb,"xstartr", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-arcpy.AddField_management(disch_reachesgdb,"ystartr","DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-arcpy.AddField_management(disch_reachesgdb,"x_ystartr", "TEXT")
+# Add integer node ids of the discharge points and of the first and last point of the reaches (points within the tolerance share one id)
+node_index = nd.NodeIndex()
+nd.add_node_fields(disch_ptgdb, node_index, "nodep")
+nd.add_node_fields(disch_reachesgdb, node_index, "nodestartr", "nodeendr")
 
-arcpy.CalculateField_management(disch_reachesgdb, "xstartr", "!SHAPE.firstPoint.X!", "PYTHON_9.3", "")
-arcpy.CalculateField_management(disch_reachesgdb, "ystartr", "!SHAPE.firstPoint.Y!", "PYTHON_9.3", "")
-arcpy.CalculateField_management(disch_reachesgdb, "x_ystartr", "str(float(!xstartr!))+\",\"+ str(float(!ystartr!))",  "PYTHON_9.3", "")
-# Join discharge values based on x,y coordinates of discharge points and start x,y of discharge reaches
-arcpy.JoinField_management(disch_reachesgdb, "x_ystartr", disch_ptgdb, "x_yp", ["drainarea_km2", "totalimp_percnt", "Q_m3pers"])
+# Join discharge values based on the node ids of discharge points and start node of discharge reaches
+nd.join_on_node(disch_reachesgdb, "nodestartr", disch_ptgdb, "nodep", ["drainarea_km2", "totalimp_percnt", "Q_m3pers"])
 
 #-------------------------------------------------------------------------------------------------------------------------
 ## Calculate total power and specific stream power
@@ -242,57 +230,9 @@ arcpy.CalculateField_management(disch_reachesgdb, "SPower_Wperm", str(expression
 ## Stream Power Gradient
 
 if gradient == "true":
-	# add field to get coordinates
-	arcpy.AddField_management(disch_reachesgdb,"xendr_gr", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-	arcpy.AddField_management(disch_reachesgdb,"yendr_gr","DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-	arcpy.AddField_management(disch_reachesgdb,"x_yendr_gr", "TEXT")
-	arcpy.CalculateField_management(disch_reachesgdb, "xendr_gr", "!SHAPE.lastPoint.X!", "PYTHON_9.3", "")
-	arcpy.CalculateField_management(disch_reachesgdb, "yendr_gr", "!SHAPE.lastPoint.Y!", "PYTHON_9.3", "")
-	arcpy.CalculateField_management(disch_reachesgdb, "x_yendr_gr", "str(float(!xendr_gr!))+\",\"+ str(float(!yendr_gr!))",  "PYTHON_9.3", "")
-
-	arcpy.AddField_management(disch_reachesgdb,"xstartr_gr", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-	arcpy.AddField_management(disch_reachesgdb,"ystartr_gr","DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-	arcpy.AddField_management(disch_reachesgdb,"x_ystartr_gr", "TEXT")
-	arcpy.CalculateField_management(disch_reachesgdb, "xstartr_gr", "!SHAPE.firstPoint.X!", "PYTHON_9.3", "")
-	arcpy.CalculateField_management(disch_reachesgdb, "ystartr_gr", "!SHAPE.firstPoint.Y!", "PYTHON_9.3", "")
-	arcpy.CalculateField_management(disch_reachesgdb, "x_ystartr_gr", "str(float(!xstartr_gr!))+\",\"+ str(float(!ystartr_gr!))",  "PYTHON_9.3", "")
-
-	# Add field to calculate total and specific stream power gradient by using added coordinates from slopergdb 
+	# Add field to calculate total and specific stream power gradient by using the node ids of the reaches
 	arcpy.AddField_management(disch_reachesgdb,"PowerGr_Wperm", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
 	arcpy.AddField_management(disch_reachesgdb,"SPowerGr_Wperm", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
 
-	# obtain subsequent reaches start points coordinates and their total stream power
-	startrxy_set =set()
-	cursorgr=arcpy.SearchCursor(disch_reachesgdb)
-	for row in cursorgr:
-		startr_v = row.getValue("x_ystartr_gr")
-		startr_pow = row.getValue("Power_Wperm")
-		startr_spow = row.getValue("SPower_Wperm")
-		startr_val = (startr_v,startr_pow,startr_spow)
-		startrxy_set.add(startr_val)
-	del row,cursorgr
-
-	# match subsequent reaches start coordinates with ending coordinates of parent reaches and subtract their total stream power
-	for sxy, spow, sspow in startrxy_set:
-		ucursorgr = arcpy.UpdateCursor(disch_reachesgdb)
-		for row in ucursorgr:
-			exy = row.getValue("x_yendr_gr")
-			epow = row.getValue("Power_Wperm")
-			espow =row.getValue("SPower_Wperm")
-			if sxy == exy:
-				if spow is None or sspow is None or epow is None or espow is None:
-					gradtp = None
-					gradsp = None
-					row.setValue("PowerGr_Wperm", gradtp)
-					row.setValue("SPowerGr_Wperm", gradsp)
-					ucursorgr.updateRow(row)
-					#print sxy, exy, spow, epow, gradtp, gradsp
-				else:
-					gradtp = spow-epow
-					gradsp = sspow-espow
-					row.setValue("PowerGr_Wperm", gradtp)
-					row.setValue("SPowerGr_Wperm", gradsp)
-					ucursorgr.updateRow(row)
-					#print sxy, exy, spow, epow, gradtp, gradsp
-		del row, ucursorgr
-
+	# match the start node of subsequent reaches with the end node of parent reaches and subtract their total and specific stream power
+	nd.downstream_difference(disch_reachesgdb, "nodestartr", "nodeendr", ["Power_Wperm", "SPower_Wperm"], ["PowerGr_Wperm", "SPowerGr_Wperm"])
@@ -11,6 +11,11 @@ import arcinfo
 import os
 import sys
 import math
+import numpy as np
+import SPIN_Nodes as nd
+import SPIN_Network as sn
+import SPIN_Reach_Store as rs
+import SPIN_Power as pw
 
 
 #Allow overwrite of results
@@ -24,172 +29,120 @@ seg_gdb = GetParameterAsText(1)
 ptgdb = GetParameterAsText(2)
 
 #-----------------------------------------------------------------------------------------------------------
-#Process: Delete geodatabase with same name and create new file geodatabase 
-gdb_name=str(workspace_folder)+ "\\Rural_scenario.gdb"
-arcpy.Delete_management(gdb_name)
-arcpy.CreateFileGDB_management(str(workspace_folder), "Rural_scenario.gdb")
-
-#Save shapefile to file geodatabase
-strmpowergdb = gdb_name + "\\R_Power"
-arcpy.CopyFeatures_management(seg_gdb, strmpowergdb)
-
-#----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
-# Calculate discharge
-#Import coefficient c and x in Q= cA^x.
-coeff_c = GetParameterAsText(3)
-coeff_x = GetParameterAsText(4)
-
-# Add Field to calculate discharge using Q=cA^x where c and x are coefficcients and A is the drainage area
-arcpy.AddField_management(ptgdb,"totalimp_percnt", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-arcpy.CalculateField_management(ptgdb, "totalimp_percnt", "0" , "VB", "")
-
-arcpy.AddField_management(ptgdb,"c", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-arcpy.CalculateField_management(ptgdb, "c", "0.248" , "VB", "")
-
-arcpy.AddField_management(ptgdb,"x", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-arcpy.CalculateField_management(ptgdb, "x", "0.91" , "VB", "")
-
-arcpy.AddField_management(ptgdb,"Q_m3pers", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-expressionq= "!c!*(!drainarea_km2!**!x!)"
-arcpy.CalculateField_management(ptgdb, "Q_m3pers", str(expressionq), "PYTHON_9.3", "")
-
-# Add field to discharge points to obtain the x,y coordinates of the points.
-arcpy.AddField_management(ptgdb,"xp", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-arcpy.AddField_management(ptgdb,"yp","DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-arcpy.AddField_management(ptgdb,"x_yp", "TEXT")
-arcpy.CalculateField_management(ptgdb, "xp", "!SHAPE.CENTROID.X!", "PYTHON_9.3", "")
-arcpy.CalculateField_management(ptgdb, "yp", "!SHAPE.CENTROID.Y!", "PYTHON_9.3", "")
-arcpy.CalculateField_management(ptgdb, "x_yp", "str(float(!xp!))+\",\"+ str(float(!yp!))",  "PYTHON_9.3", "")
-
-# Add Fields to discharge_reaches to obtain the first x,y coordinates.
-arcpy.AddField_management(strmpowergdb,"xstartr", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-arcpy.AddField_management(strmpowergdb,"ystartr","DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-arcpy.AddField_management(strmpowergdb,"x_ystartr", "TEXT")
-arcpy.CalculateField_management(strmpowergdb, "xstartr", "!SHAPE.firstPoint.X!", "PYTHON_9.3", "")
-arcpy.CalculateField_management(strmpowergdb, "ystartr", "!SHAPE.firstPoint.Y!", "PYTHON_9.3", "")
-arcpy.CalculateField_management(strmpowergdb, "x_ystartr", "str(float(!xstartr!))+\",\"+ str(float(!ystartr!))",  "PYTHON_9.3", "")
-
-# Join discharge values based on x,y coordinates of discharge points and start x,y of discharge reaches
-arcpy.JoinField_management(strmpowergdb, "x_ystartr", ptgdb, "x_yp", ["drainarea_km2", "totalimp_percnt", "Q_m3pers"])
-AddMessage("The calculated rural discharge is saved in R_Power.")
-
-#-----------------------------------------------------------------------------------------------
-##Total Stream Power
-# Add Field with specific weight of water(9810 N) and strmpower
-arcpy.AddField_management(strmpowergdb,"Wg_Nperm3", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-arcpy.CalculateField_management(strmpowergdb, "Wg_Nperm3", "9810" , "VB", "")
-
-arcpy.AddField_management(strmpowergdb,"Power_Wperm", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-expressionpow="!S_mperm_SAVG!*!Q_m3pers!*!Wg_Nperm3!"
-arcpy.CalculateField_management(strmpowergdb, "Power_Wperm", str(expressionpow), "PYTHON_9.3", "")
-expressionabs = "!Power_Wperm!*-1"
-arcpy.CalculateField_management(strmpowergdb, "Power_Wperm", str(expressionabs), "PYTHON_9.3", "")
-
-AddMessage("The calculated total stream power is saved in R_Power.")
-
-
-#-------------------------------------------------------------------------------------------------------
-##Specific Stream Power
-
-# Add Field with width and specific stream power
-coeff_a=GetParameterAsText(5)
-coeff_b=GetParameterAsText(6)
-
-arcpy.AddField_management(strmpowergdb,"a", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-arcpy.CalculateField_management(strmpowergdb, "a", str(coeff_a) , "VB", "") 
-arcpy.AddField_management(strmpowergdb,"b", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-arcpy.CalculateField_management(strmpowergdb, "b", str(coeff_b) , "VB", "")
-arcpy.AddField_management(strmpowergdb,"Width_m", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-expressionwidth="!a!*(!drainarea_km2!**!b!)"
-arcpy.CalculateField_management(strmpowergdb, "width_m", str(expressionwidth), "PYTHON_9.3", "")
-
-arcpy.AddField_management(strmpowergdb,"SPower_Wperm", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-expressionspow="!Power_Wperm!/!width_m!"
-arcpy.CalculateField_management(strmpowergdb, "SPower_Wperm", str(expressionspow), "PYTHON_9.3", "")
-
-AddMessage("The calculated rural specific stream power is saved in R_Power.")
-
-#-----------------------------------------------------------------------------------------------------------------------------------------
-## D84 Prediction
-##Calculate d84 based on Ferguson (2005) particle mobility model. Model fitting uses Annable (1996) data.
-
-#Add field for d84 prediction
-arcpy.AddField_management(strmpowergdb,"D84_mm", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-		
-#Equation 16 from Ferguson (2005) Assumption: Di = Db
-#constants for d84 prediction
-gamma = 9790 # N/m3
-kappa = 0.41 # constant from Ferguson 2005 - works for D in mm, power in W/m2
-R = 1.65 # submerged specific gravity
-rho = 1000 # density of water
-theta_cb = 0.045 # shear stress threshold
-m =2.80 # roughness multiplier for D84 from Lopez and Barrangan e.g. Hey 1979
-gee = 9.81 #acceleration by gravity
-
-#C = log10(30*theta_cb*R/(e*m*!S_mperm!))"
-#expressionDb = "((kappa*!SPower_Wperm!/(2.30*rho*log10(30*theta_cb*R/(exp*m*!S_mperm!))))**(2/3))/(theta_cb*R*gee)"
-
-expressionlogC= "math.log10(30*0.045*1.65/(math.exp(1)*2.80*(abs(!S_mperm!))))"
-expressionDb = "((((0.41*abs(!SPower_Wperm!))/(2.30*1000*" + str(expressionlogC) + "))**(2.0/3))/(0.045*1.65*9.81))*1000"
-arcpy.CalculateField_management(strmpowergdb, "D84_mm", str(expressionDb), "PYTHON_9.3", "")
-
-#----------------------------------------------------------------------------------------------------------
-## Stream Power Gradient
-gradient =GetParameterAsText(7)
-
-if gradient == "true":
-
-	# add field to get coordinates
-	arcpy.AddField_management(strmpowergdb,"xendr_gr", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-	arcpy.AddField_management(strmpowergdb,"yendr_gr","DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-	arcpy.AddField_management(strmpowergdb,"x_yendr_gr", "TEXT")
-	arcpy.CalculateField_management(strmpowergdb, "xendr_gr", "!SHAPE.lastPoint.X!", "PYTHON_9.3", "")
-	arcpy.CalculateField_management(strmpowergdb, "yendr_gr", "!SHAPE.lastPoint.Y!", "PYTHON_9.3", "")
-	arcpy.CalculateField_management(strmpowergdb, "x_yendr_gr", "str(float(!xendr_gr!))+\",\"+ str(float(!yendr_gr!))",  "PYTHON_9.3", "")
-
-	arcpy.AddField_management(strmpowergdb,"xstartr_gr", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-	arcpy.AddField_management(strmpowergdb,"ystartr_gr","DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-	arcpy.AddField_management(strmpowergdb,"x_ystartr_gr", "TEXT")
-	arcpy.CalculateField_management(strmpowergdb, "xstartr_gr", "!SHAPE.firstPoint.X!", "PYTHON_9.3", "")
-	arcpy.CalculateField_management(strmpowergdb, "ystartr_gr", "!SHAPE.firstPoint.Y!", "PYTHON_9.3", "")
-	arcpy.CalculateField_management(strmpowergdb, "x_ystartr_gr", "str(float(!xstartr_gr!))+\",\"+ str(float(!ystartr_gr!))",  "PYTHON_9.3", "")
-
-	# Add field to calculate total and specific stream power gradient by using added coordinates from slopergdb 
-	arcpy.AddField_management(strmpowergdb,"PowerGr_Wperm", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-	arcpy.AddField_management(strmpowergdb,"SPowerGr_Wperm", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-
-	# obtain subsequent reaches start points coordinates and their total stream power
-	startrxy_set =set()
-	cursorgr=arcpy.SearchCursor(strmpowergdb)
-	for row in cursorgr:
-		startr_v = row.getValue("x_ystartr_gr")
-		startr_pow = row.getValue("Power_Wperm")
-		startr_spow = row.getValue("SPower_Wperm")
-		startr_val = (startr_v,startr_pow,startr_spow)
-		startrxy_set.add(startr_val)
-	del row,cursorgr
-
-	# match subsequent reaches start coordinates with ending coordinates of parent reaches and subtract their total stream power
-	for sxy, spow, sspow in startrxy_set:
-		ucursorgr = arcpy.UpdateCursor(strmpowergdb)
-		for row in ucursorgr:
-			exy = row.getValue("x_yendr_gr")
-			epow = row.getValue("Power_Wperm")
-			espow =row.getValue("SPower_Wperm")
-			if sxy == exy:
-				if spow is None or sspow is None or epow is None or espow is None:
-					gradtp = None
-					gradsp = None
-					row.setValue("PowerGr_Wperm", gradtp)
-					row.setValue("SPowerGr_Wperm", gradsp)
-					ucursorgr.updateRow(row)
-					print sxy, exy, spow, epow, gradtp, gradsp
-				else:
-					gradtp = spow-epow
-					gradsp = sspow-espow
-					row.setValue("PowerGr_Wperm", gradtp)
-					row.setValue("SPowerGr_Wperm", gradsp)
-					ucursorgr.updateRow(row)
-					print sxy, exy, spow, epow, gradtp, gradsp
-		del row, ucursorgr
-
+# Reach store of the segments (segments.reaches): the discharge, stream power, width, D84 and stream power gradient are calculated on the columns of the store (SPIN_Power.py)
+# and saved in the scenario store Rural_scenario.reaches, which reads the segments from segments.reaches instead of copying them. R_Power is only saved when export is checked.
+if rs.is_store(seg_gdb):
+    seg_store = rs.ReachStore(seg_gdb)
+    scenario_store = rs.ReachStore.create_scenario(str(workspace_folder) + "\\Rural_scenario.reaches", seg_store)
+    da_arr = np.asarray(seg_store.column("drainarea_km2"), dtype=np.float64)
+    coeff_a = float(GetParameterAsText(5))
+    coeff_b = float(GetParameterAsText(6))
+
+    q_arr = pw.discharge(da_arr)
+    power_fields = pw.rural_power(da_arr, q_arr, seg_store.column("S_mperm"), seg_store.column("S_mperm_SAVG"), coeff_a, coeff_b)
+    rural_columns = [("totalimp_percnt", np.zeros(seg_store.n_rows)), ("Q_m3pers", np.where(np.isfinite(q_arr), q_arr, np.nan))] + power_fields
+
+    # stream power gradient: the reach which starts at the end node of each reach minus the reach
+    if GetParameterAsText(7) == "true":
+        power_arr = dict(power_fields)
+        down_arr = sn.downstream_rows(seg_store.column("nodestartr"), seg_store.column("nodeendr"))
+        rural_columns.append(("PowerGr_Wperm", sn.downstream_difference(down_arr, power_arr["Power_Wperm"])))
+        rural_columns.append(("SPowerGr_Wperm", sn.downstream_difference(down_arr, power_arr["SPower_Wperm"])))
+
+    for name, values in rural_columns:
+        scenario_store.append_column(name, values)
+    AddMessage("The calculated rural discharge, stream power and D84 are saved in Rural_scenario.reaches.")
+
+    if GetParameterAsText(8) == "true":
+        gdb_name=str(workspace_folder)+ "\\Rural_scenario.gdb"
+        arcpy.Delete_management(gdb_name)
+        arcpy.CreateFileGDB_management(str(workspace_folder), "Rural_scenario.gdb")
+        rs.to_feature_class(scenario_store, gdb_name + "\\R_Power")
+        AddMessage("The rural scenario is saved in R_Power.")
+
+else:
+    #-----------------------------------------------------------------------------------------------------------
+    #Process: Delete geodatabase with same name and create new file geodatabase 
+    gdb_name=str(workspace_folder)+ "\\Rural_scenario.gdb"
+    arcpy.Delete_management(gdb_name)
+    arcpy.CreateFileGDB_management(str(workspace_folder), "Rural_scenario.gdb")
+
+    #Save shapefile to file geodatabase
+    strmpowergdb = gdb_name + "\\R_Power"
+    arcpy.CopyFeatures_management(seg_gdb, strmpowergdb)
+
+    #----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+    # Calculate discharge
+    #Import coefficient c and x in Q= cA^x.
+    coeff_c = GetParameterAsText(3)
+    coeff_x = GetParameterAsText(4)
+
+    # Add Field to calculate discharge using Q=cA^x where c and x are coefficcients and A is the drainage area
+    arcpy.AddField_management(ptgdb,"totalimp_percnt", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
+    arcpy.CalculateField_management(ptgdb, "totalimp_percnt", "0" , "VB", "")
+
+    arcpy.AddField_management(ptgdb,"c", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
+    arcpy.CalculateField_management(ptgdb, "c", str(pw.RURAL_C) , "VB", "")
+
+    arcpy.AddField_management(ptgdb,"x", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
+    arcpy.CalculateField_management(ptgdb, "x", str(pw.RURAL_X) , "VB", "")
+
+    # discharge of every point with the equation of SPIN_Power.py, in one pass
+    arcpy.AddField_management(ptgdb,"Q_m3pers", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
+    with arcpy.da.UpdateCursor(ptgdb, ["drainarea_km2", "Q_m3pers"]) as cursor:
+        for row in cursor:
+            if row[0] is not None:
+                row[1] = float(pw.discharge(row[0]))
+                cursor.updateRow(row)
+
+    # Add integer node ids of the discharge points and of the first and last point of the reaches (points within the tolerance share one id)
+    node_index = nd.NodeIndex()
+    nd.add_node_fields(ptgdb, node_index, "nodep")
+    nd.add_node_fields(strmpowergdb, node_index, "nodestartr", "nodeendr")
+
+    # Join discharge values based on the node ids of discharge points and start node of discharge reaches
+    nd.join_on_node(strmpowergdb, "nodestartr", ptgdb, "nodep", ["drainarea_km2", "totalimp_percnt", "Q_m3pers"])
+    AddMessage("The calculated rural discharge is saved in R_Power.")
+
+    #-----------------------------------------------------------------------------------------------
+    ##Total Stream Power, Specific Stream Power and D84 Prediction
+    # specific weight of water(9810 N), total stream power, width (a*A^b), specific stream power and d84 based on Ferguson (2005) particle mobility model (SPIN_Power.py)
+    coeff_a=GetParameterAsText(5)
+    coeff_b=GetParameterAsText(6)
+
+    # read the drainage area, discharge, slope and smoothed slope of all reaches in one pass
+    oid_list = []
+    reach_values = []
+    with arcpy.da.SearchCursor(strmpowergdb, ["OID@", "drainarea_km2", "Q_m3pers", "S_mperm", "S_mperm_SAVG"]) as cursor:
+        for row in cursor:
+            oid_list.append(row[0])
+            reach_values.append([np.nan if v is None else v for v in row[1:]])
+    reach_arr = np.array(reach_values, dtype=np.float64).reshape(len(oid_list), 4)
+    power_fields = pw.rural_power(reach_arr[:, 0], reach_arr[:, 1], reach_arr[:, 2], reach_arr[:, 3], float(coeff_a), float(coeff_b))
+
+    # add the fields and write the results in one pass
+    power_names = [name for name, values in power_fields]
+    for name in power_names:
+        arcpy.AddField_management(strmpowergdb, name, "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
+    power_values = {}
+    for i in range(len(oid_list)):
+        power_values[oid_list[i]] = [None if np.isnan(values[i]) else float(values[i]) for name, values in power_fields]
+    with arcpy.da.UpdateCursor(strmpowergdb, ["OID@"] + power_names) as cursor:
+        for row in cursor:
+            cursor.updateRow([row[0]] + power_values[row[0]])
+
+    AddMessage("The calculated total stream power is saved in R_Power.")
+    AddMessage("The calculated rural specific stream power is saved in R_Power.")
+
+    #----------------------------------------------------------------------------------------------------------
+    ## Stream Power Gradient
+    gradient =GetParameterAsText(7)
+
+    if gradient == "true":
+
+        # Add field to calculate total and specific stream power gradient by using the node ids of the reaches
+        arcpy.AddField_management(strmpowergdb,"PowerGr_Wperm", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
+        arcpy.AddField_management(strmpowergdb,"SPowerGr_Wperm", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
+
+        # match the start node of subsequent reaches with the end node of parent reaches and subtract their total and specific stream power
+        nd.downstream_difference(strmpowergdb, "nodestartr", "nodeendr", ["Power_Wperm", "SPower_Wperm"], ["PowerGr_Wperm", "SPowerGr_Wperm"])
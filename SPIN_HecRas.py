@@ -0,0 +1,403 @@
+## Python script: This script holds the functions which read HEC-RAS results for the HecRas tools (HecRas_Connect_Data_To_Segments.py).
+## The HEC-RAS export (.csv) has two header rows (field names and units), blank separator rows and description rows (e.g. bridges) without a profile. It is read in chunks:
+## the header is normalized once and the rows of each chunk are summed by river station and profile, so that the memory holds one chunk and one row per station and profile.
+## The result is the wide table of the old pivot, one row per river station and one column per field and profile (e.g. Q_Channel_m3pers_2yr_Fut).
+## The results can also be read from the HEC-RAS plan results file (.hdf, with h5py) into the same table, without exporting a csv.
+## Parsed tables are cached (one .npy file per column, as the reach store) under a hash of the content of the input file and the parser version, so that a file linked to
+## several versions of the stream network is parsed once. The least recently used tables are deleted when the cache is larger than its maximum size.
+## Last edited: Oct 18, 2026
+#-----------------------------------------------------------------------------------------------#
+
+import os
+import csv
+import json
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+
+STATION_FIELD = "River_Sta"
+PROFILE_FIELD = "Profile"
+DESCRIPTION_FIELD = "Description"
+
+# rows of the csv read at once
+CHUNK_SIZE = 100000
+
+# version of the parsed tables: change it when the parsers change, so that tables cached by an older version are not used
+PARSER_VERSION = "2"
+
+# maximum size (bytes) of the cache of parsed tables
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+CACHE_SCHEMA_FILE = "schema.json"
+
+# replacements of the characters of field names (e.g. "Q Channel(m3/s)" becomes "Q_Channel_m3pers")
+NAME_REPLACEMENTS = [(" ", "_"), ("(", "_"), (")", ""), ("/", "per"), (".", "_")]
+
+
+#-----------------------------------------------------------------------------------------------
+# Field names
+
+def field_name(name, units=""):
+    # field name of a column from its two header rows
+    name = str(name) + str(units)
+    for old, new in NAME_REPLACEMENTS:
+        name = name.replace(old, new)
+    return name
+
+
+def read_header(path):
+    # field names of a HEC-RAS csv from its two header rows
+    with open(path) as f:
+        reader = csv.reader(f)
+        names = next(reader)
+        units = next(reader, [])
+    units = units + [""] * (len(names) - len(units))
+    return [field_name(n, u) for n, u in zip(names, units)]
+
+
+#-----------------------------------------------------------------------------------------------
+# Profile table
+
+def _station_index(stations):
+    # river stations as numbers when they all are numbers, otherwise as text
+    numbers = pd.to_numeric(pd.Series(stations), errors="coerce")
+    if not numbers.isnull().any():
+        return pd.Index(numbers.values, name=STATION_FIELD)
+    return pd.Index(stations, name=STATION_FIELD)
+
+
+def read_profile_table(path, drop_fields=(), chunk_size=CHUNK_SIZE):
+    # Read a HEC-RAS csv in chunks into a table with one row per river station (sorted) and one column per field and profile (<field>_<profile>, sorted by field and profile).
+    # Rows without a profile (blank rows and bridge description rows) are skipped, spaces in river stations and profiles become "_", values are floats and values of
+    # the same station and profile are averaged (as pivot_table). drop_fields are not read; columns without any value are dropped.
+    names = read_header(path)
+    fields = [n for n in names if n not in (STATION_FIELD, PROFILE_FIELD, DESCRIPTION_FIELD) and n not in drop_fields]
+    dtypes = dict((n, str) for n in (STATION_FIELD, PROFILE_FIELD))
+    totals = None
+    chunks = pd.read_csv(path, header=None, names=names, skiprows=2, usecols=[STATION_FIELD, PROFILE_FIELD] + fields, dtype=dtypes,
+                         skip_blank_lines=True, chunksize=chunk_size)
+    for chunk in chunks:
+        chunk = chunk[chunk[PROFILE_FIELD].notnull() & chunk[STATION_FIELD].notnull()]
+        if len(chunk) == 0:
+            continue
+        keys = [chunk[STATION_FIELD].str.replace(" ", "_"), chunk[PROFILE_FIELD].str.replace(" ", "_")]
+        values = chunk[fields].apply(pd.to_numeric, errors="coerce")
+        grouped = values.groupby(keys)
+        part = pd.concat([grouped.sum(), grouped.count()], axis=1, keys=["sum", "count"])
+        # sums and counts of the chunk are added to those of the previous chunks (one row per station and profile)
+        totals = part if totals is None else totals.add(part, fill_value=0)
+
+    if totals is None:
+        return pd.DataFrame(index=pd.Index([], name=STATION_FIELD))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = totals["sum"] / totals["count"].where(totals["count"] > 0)
+    table = means.unstack(level=1).sort_index(axis=1).dropna(axis=1, how="all")
+    table.columns = [f + "_" + p for f, p in table.columns]
+    table.index = _station_index(list(table.index))
+    return table.sort_index()
+
+
+#-----------------------------------------------------------------------------------------------
+# HEC-RAS results file (HDF5)
+
+# paths of the steady results and of the attributes (river station in the field RS) of the cross sections and structures in the plan results file
+HDF_STEADY_OUTPUT = "Results/Steady/Output/Output Blocks/Base Output/Steady Profiles"
+HDF_PROFILE_NAMES = HDF_STEADY_OUTPUT + "/Profile Names"
+HDF_CROSS_SECTIONS = "Cross Sections"
+HDF_STRUCTURES = "Structures"
+HDF_ATTRIBUTES = {HDF_CROSS_SECTIONS: "Geometry/Cross Sections/Attributes", HDF_STRUCTURES: "Geometry/Structures/Attributes"}
+HDF_STATION_FIELD = "RS"
+
+# variables read from the results file: header of the csv export (name, units), level of the results (one value per cross section, or per structure at the station of the
+# structure) and names of the datasets which can hold them (the first found is read). A variable of both levels (Q Total) is read where it is found.
+HDF_VARIABLES = [("Q Channel", "(m3/s)", HDF_CROSS_SECTIONS, ["Q Channel", "Flow Channel"]),
+                 ("Top W Chnl", "(m)", HDF_CROSS_SECTIONS, ["Top W Chnl", "Top Width Channel"]),
+                 ("Q Total", "(m3/s)", HDF_CROSS_SECTIONS, ["Q Total", "Flow"]),
+                 ("Q Total", "(m3/s)", HDF_STRUCTURES, ["Q Total", "Flow"]),
+                 ("Q Bridge", "(m3/s)", HDF_STRUCTURES, ["Q Bridge", "Flow Bridge"]),
+                 ("Deck Width", "(m)", HDF_STRUCTURES, ["Deck Width"])]
+
+# variables of the flood and of the bridge export
+HDF_FLOOD_VARIABLES = ("Top W Chnl", "Q Channel")
+HDF_BRIDGE_VARIABLES = ("Q Channel", "Top W Chnl", "Q Total", "Q Bridge", "Deck Width")
+
+HDF_EXTENSIONS = (".hdf", ".h5", ".hdf5")
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", "replace")
+    return str(value).strip()
+
+
+def _hdf_paths(level, name):
+    # the results of a level are in <steady output>/<level>, or in its Additional Variables group for the variables chosen in the output options
+    base = HDF_STEADY_OUTPUT + "/" + level
+    return [base + "/" + name, base + "/Additional Variables/" + name]
+
+
+def _hdf_stations(hdf, level, path):
+    if HDF_ATTRIBUTES[level] not in hdf or HDF_STATION_FIELD not in (hdf[HDF_ATTRIBUTES[level]].dtype.names or ()):
+        raise ValueError("No " + HDF_STATION_FIELD + " field in " + HDF_ATTRIBUTES[level] + " of the HEC-RAS results file " + str(path))
+    return [_text(rs).replace(" ", "_") for rs in hdf[HDF_ATTRIBUTES[level]][HDF_STATION_FIELD]]
+
+
+def read_hdf_profile_table(path, variables=HDF_FLOOD_VARIABLES):
+    # Read the variables (headers of HDF_VARIABLES) of every river station and profile of a HEC-RAS plan results file (.hdf) into the table of read_profile_table (same field
+    # names and order). A variable is read from a dataset with one row per profile and one column per cross section or structure, one profile (row) at a time, or from a dataset
+    # with one value per structure (e.g. the deck width of the geometry) which is the same for all profiles. The values of a structure are given to the station of the structure.
+    # With structure variables the table holds the stations of the structures and the cross section sorted just before each, the pairs of the bridge export (see bridge_ratios).
+    # A variable which is not in the file (at any of its levels) raises a ValueError.
+    import h5py
+    unknown = [v for v in variables if v not in [h for h, u, l, n in HDF_VARIABLES]]
+    if unknown:
+        raise ValueError("Unknown HEC-RAS variables " + ", ".join(unknown))
+    with h5py.File(path, "r") as hdf:
+        if HDF_PROFILE_NAMES not in hdf:
+            raise ValueError("No dataset " + HDF_PROFILE_NAMES + " in the HEC-RAS results file " + str(path))
+        profile_list = [_text(p).replace(" ", "_") for p in hdf[HDF_PROFILE_NAMES][()]]
+
+        stations = {}
+        levels = {}
+        found = set()
+        for header, units, level, names in HDF_VARIABLES:
+            if header not in variables:
+                continue
+            if level not in stations:
+                stations[level] = _hdf_stations(hdf, level, path)
+            item = None
+            for name in names:
+                for candidate in _hdf_paths(level, name):
+                    if candidate in hdf and isinstance(hdf[candidate], h5py.Dataset):
+                        item = hdf[candidate]
+                        break
+                if item is not None:
+                    break
+            if item is None:
+                continue
+            found.add(header)
+            n = len(stations[level])
+            if item.shape not in ((len(profile_list), n), (n,)):
+                raise ValueError("The dataset " + item.name + " of the HEC-RAS results file " + str(path) + " has the shape " + str(item.shape) + " instead of "
+                                 + str((len(profile_list), n)))
+            field = field_name(header, units)
+            columns = levels.setdefault(level, {})
+            for k, profile in enumerate(profile_list):
+                columns[(field, profile)] = (item[k, :] if len(item.shape) == 2 else item[()]).astype(np.float64)
+        missing = [v for v in variables if v not in found]
+        if missing:
+            raise ValueError("No dataset of " + ", ".join(missing) + " in the HEC-RAS results file " + str(path) + " (looked up in " + HDF_STEADY_OUTPUT
+                             + " and its Additional Variables groups)")
+
+    # stations in several reaches are averaged (as read_profile_table)
+    table = pd.DataFrame()
+    for level in stations:
+        table = table.combine_first(pd.DataFrame(levels.get(level, {}), index=stations[level]).groupby(level=0).mean())
+    if HDF_STRUCTURES in stations and HDF_CROSS_SECTIONS in stations:
+        # keep the structures and the cross section sorted just before each
+        index = _station_index(list(table.index))
+        order = np.argsort(np.asarray(index), kind="mergesort")
+        structure = np.asarray(table.index.isin(stations[HDF_STRUCTURES]))[order]
+        keep = structure | np.r_[structure[1:] & ~structure[:-1], False]
+        table = table.iloc[np.sort(order[keep])]
+    table = table.sort_index(axis=1).dropna(axis=1, how="all")
+    table.columns = [f + "_" + p for f, p in table.columns]
+    table.index = _station_index(list(table.index))
+    return table.sort_index()
+
+
+def read_results(path, drop_first=False, variables=HDF_FLOOD_VARIABLES):
+    # table of read_profile_table from a csv export, or from a HEC-RAS results file (.hdf, the variables are read). drop_first: do not read the first column (reach) of the csv.
+    if str(path).lower().endswith(HDF_EXTENSIONS):
+        return read_hdf_profile_table(path, variables)
+    return read_profile_table(path, read_header(path)[:1] if drop_first else ())
+
+
+#-----------------------------------------------------------------------------------------------
+# Cache of parsed tables
+
+def file_hash(path, block_size=1024 * 1024):
+    # sha1 of the content of a file, read in blocks
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        block = f.read(block_size)
+        while block:
+            h.update(block)
+            block = f.read(block_size)
+    return h.hexdigest()
+
+
+def _save_table(table, folder):
+    # save a table as one .npy file per column and the index; written to a temporary folder first so that a cache entry is always complete
+    tmp = folder + ".tmp"
+    if os.path.isdir(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    index = np.asarray(table.index)
+    np.save(os.path.join(tmp, "index.npy"), index.astype(np.str_) if index.dtype.kind == "O" else index)
+    for k, column in enumerate(table.columns):
+        np.save(os.path.join(tmp, "c%d.npy" % k), table[column].values.astype(np.float64))
+    schema = {"parser_version": PARSER_VERSION, "index_name": table.index.name, "columns": [str(c) for c in table.columns]}
+    with open(os.path.join(tmp, CACHE_SCHEMA_FILE), "w") as f:
+        json.dump(schema, f, indent=1)
+    if os.path.isdir(folder):
+        shutil.rmtree(folder)
+    os.rename(tmp, folder)
+
+
+def _load_table(folder):
+    with open(os.path.join(folder, CACHE_SCHEMA_FILE)) as f:
+        schema = json.load(f)
+    columns = [(c, np.load(os.path.join(folder, "c%d.npy" % k))) for k, c in enumerate(schema["columns"])]
+    index = pd.Index(np.load(os.path.join(folder, "index.npy")), name=schema["index_name"])
+    table = pd.DataFrame(dict(columns), index=index)
+    return table[[c for c, v in columns]]
+
+
+def _folder_size(folder):
+    return sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder))
+
+
+def evict_cache(cache_folder, max_bytes=CACHE_MAX_BYTES, keep=None):
+    # delete the least recently used tables (oldest modification time of the entry) until the cache is not larger than max_bytes; keep is never deleted
+    entries = []
+    for name in os.listdir(cache_folder):
+        folder = os.path.join(cache_folder, name)
+        if os.path.isfile(os.path.join(folder, CACHE_SCHEMA_FILE)):
+            entries.append((os.path.getmtime(folder), name, _folder_size(folder)))
+    total = sum(e[2] for e in entries)
+    for mtime, name, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if name == keep:
+            continue
+        shutil.rmtree(os.path.join(cache_folder, name))
+        total = total - size
+
+
+def results_key(path, drop_first=False, variables=HDF_FLOOD_VARIABLES):
+    # key of the parsed table of a file: hash of the content of the file, the parser version and the options of read_results
+    return hashlib.sha1((file_hash(path) + "|" + PARSER_VERSION + "|" + str(bool(drop_first)) + "|" + ",".join(variables)).encode("utf-8")).hexdigest()
+
+
+def cached_results(path, cache_folder, drop_first=False, max_bytes=CACHE_MAX_BYTES, variables=HDF_FLOOD_VARIABLES, key=None):
+    # Table of read_results, from the cache when the same file (same content) was parsed before by the same parser version. A parsed table is added to the cache and
+    # the least recently used tables are deleted when the cache is larger than max_bytes. key: results_key of the file when it is already known (the file is not hashed again).
+    if key is None:
+        key = results_key(path, drop_first, variables)
+    folder = os.path.join(str(cache_folder), key)
+    if os.path.isfile(os.path.join(folder, CACHE_SCHEMA_FILE)):
+        # a used entry becomes the most recently used
+        os.utime(folder, None)
+        return _load_table(folder)
+
+    table = read_results(path, drop_first, variables)
+    if not os.path.isdir(str(cache_folder)):
+        os.makedirs(str(cache_folder))
+    _save_table(table, folder)
+    evict_cache(str(cache_folder), max_bytes, key)
+    return table
+
+
+#-----------------------------------------------------------------------------------------------
+# Outputs
+
+def write_csv(table, out_csv, key):
+    # Write a table to a csv, unless the csv was already written from the same parsed table: the key (results_key) is saved next to the csv (<csv>.key) and the csv is
+    # only rewritten when the key changes. Returns True when the csv was written.
+    key_file = str(out_csv) + ".key"
+    if os.path.isfile(str(out_csv)) and os.path.isfile(key_file):
+        with open(key_file) as f:
+            if f.read().strip() == key:
+                return False
+    table.to_csv(str(out_csv))
+    with open(key_file, "w") as f:
+        f.write(key)
+    return True
+
+
+def to_gdb_table(table, out_table):
+    # Write a table (one row per river station, River_Sta field from the index) to a geodatabase table in one pass with arcpy.da.NumPyArrayToTable, without a csv.
+    # The field names are validated for the workspace of the table.
+    import arcpy
+    workspace = os.path.dirname(str(out_table))
+    names = [arcpy.ValidateFieldName(str(c), workspace) for c in table.columns]
+    index = np.asarray(table.index)
+    if index.dtype.kind == "O":
+        index = index.astype(np.str_)
+    array = np.empty(len(table), dtype=[(STATION_FIELD, index.dtype)] + [(name, np.float64) for name in names])
+    array[STATION_FIELD] = index
+    for name, column in zip(names, table.columns):
+        array[name] = table[column].values.astype(np.float64)
+    if arcpy.Exists(str(out_table)):
+        arcpy.Delete_management(str(out_table))
+    arcpy.da.NumPyArrayToTable(array, str(out_table))
+    return str(out_table)
+
+
+#-----------------------------------------------------------------------------------------------
+# Bridges
+
+# fields of the bridge results (prefixes of the <field>_<profile> columns)
+BRIDGE_Q_FIELD = "Q_Bridge_m3pers"
+BRIDGE_WIDTH_FIELD = "Deck_Width_m"
+TOTAL_Q_FIELD = "Q_Total_m3pers"
+CHANNEL_Q_FIELD = "Q_Channel_m3pers"
+CHANNEL_WIDTH_FIELD = "Top_W_Chnl_m"
+
+SCOUR_FIELD = "Scour_Ratio"
+OVERTOP_FIELD = "Overtop_Ratio"
+
+
+def profiles(table, field):
+    # profiles with a <field>_<profile> column in the table, in the order of the columns
+    prefix = field + "_"
+    return [c[len(prefix):] for c in table.columns if c.startswith(prefix)]
+
+
+def _profile_values(table, field, profile_list):
+    # matrix of the values of field for every station (rows) and profile (columns), NaN when the column does not exist
+    return np.column_stack([table[field + "_" + p].values.astype(np.float64) if field + "_" + p in table.columns else np.full(len(table), np.nan)
+                            for p in profile_list]) if profile_list else np.zeros((len(table), 0))
+
+
+def bridge_ratios(table):
+    # Add the bridge scour ratio, (Qb / Qup)^0.857 * (Wup / Wb)^0.59, and the overtopping ratio, Qtotal / Qb, of every profile of the bridge results (Scour_Ratio_<profile> and
+    # Overtop_Ratio_<profile>) to a table with one row per river station. The stations at bridges are those with a bridge discharge or deck width; each is joined to the
+    # station upstream of it, the station without bridge values sorted just before it, and gets the ratios. A bridge without such a station raises a ValueError.
+    # When a discharge or width of any profile of the pair is missing, all ratios of the bridge are null. Returns the names of the new columns.
+    profile_list = profiles(table, BRIDGE_Q_FIELD)
+    order = np.argsort(np.asarray(table.index), kind="mergesort")
+    values = np.hstack((_profile_values(table, BRIDGE_Q_FIELD, profile_list), _profile_values(table, BRIDGE_WIDTH_FIELD, profile_list)))[order]
+    at_bridge = ~np.isnan(values).all(axis=1)
+    bridge = order[at_bridge]
+    stations = order[~at_bridge]
+
+    # sorted join: the last station without bridge values before each bridge (positions in the sorted order)
+    position = np.arange(len(order))
+    k = np.searchsorted(position[~at_bridge], position[at_bridge]) - 1
+    if (k < 0).any():
+        raise ValueError("No river station upstream of the bridge stations " + ", ".join(str(rs) for rs in np.asarray(table.index)[bridge[k < 0]]))
+    up = stations[k]
+
+    q_up = _profile_values(table, CHANNEL_Q_FIELD, profile_list)[up]
+    w_up = _profile_values(table, CHANNEL_WIDTH_FIELD, profile_list)[up]
+    q_b = _profile_values(table, BRIDGE_Q_FIELD, profile_list)[bridge]
+    w_b = _profile_values(table, BRIDGE_WIDTH_FIELD, profile_list)[bridge]
+    q_t = _profile_values(table, TOTAL_Q_FIELD, profile_list)[bridge]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        scour = ((q_b / q_up) ** 0.857) * ((w_up / w_b) ** 0.59)
+        overtop = q_t / q_b
+    missing = np.isnan(np.hstack((q_up, w_up, q_b, w_b))).any(axis=1)
+    scour[missing] = np.nan
+    overtop[missing] = np.nan
+
+    new_fields = []
+    for field, ratios in ((SCOUR_FIELD, scour), (OVERTOP_FIELD, overtop)):
+        for k, p in enumerate(profile_list):
+            column = np.full(len(table), np.nan)
+            column[bridge] = ratios[:, k]
+            table[field + "_" + p] = column
+            new_fields.append(field + "_" + p)
+    return new_fields
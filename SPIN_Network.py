@@ -0,0 +1,279 @@
+## Python script: This script holds the network topology functions shared by the SPIN tools. The connections of the branches or reaches are read once into index arrays
+## (e.g. the row of the branch which starts at each node), so that the network can be traced in linear time instead of scanning the whole table for every branch.
+## Last edited: Oct 18, 2026
+#-----------------------------------------------------------------------------------------------#
+
+import numpy as np
+
+
+#-----------------------------------------------------------------------------------------------
+# Topology index
+
+def node_index(nodes):
+    # map each node id to the first row where it appears (hash index)
+    index = {}
+    for i, node in enumerate(nodes):
+        if node not in index:
+            index[node] = i
+    return index
+
+
+def downstream_rows(from_node, to_node):
+    # row of the branch downstream of each branch (the branch whose FROM_NODE is its TO_NODE), -1 at the outlet
+    by_from = node_index(from_node)
+    return np.array([by_from.get(node, -1) for node in to_node], dtype=np.int64)
+
+
+#-----------------------------------------------------------------------------------------------
+# Branch ids
+
+def assign_wid(arc_id, from_node, to_node):
+    # Start from the branch with the lowest ARCID which has no WID yet, give it the next WID and trace downstream (TO_NODE -> FROM_NODE) giving the same WID
+    # to every branch without one. Every branch is visited once.
+    down = downstream_rows(from_node, to_node)
+    wid = np.zeros(len(arc_id), dtype=np.int64)
+    netid = 0
+    for i in np.argsort(np.asarray(arc_id), kind="mergesort"):
+        if wid[i] != 0:
+            continue
+        netid = netid + 1
+        wid[i] = netid
+        j = down[i]
+        while j >= 0 and wid[j] == 0:
+            wid[j] = netid
+            j = down[j]
+    return wid
+
+
+def assign_connect_id(wid, from_node, to_node):
+    # ConnectID of a branch is the WID of the branch with another WID which flows into its FROM_NODE (0 when no other branch joins it)
+    by_to = {}
+    for i, node in enumerate(to_node):
+        by_to.setdefault(node, []).append(i)
+    connect_id = np.zeros(len(wid), dtype=np.int64)
+    for i, node in enumerate(from_node):
+        for j in by_to.get(node, []):
+            if wid[j] != wid[i]:
+                connect_id[i] = wid[j]
+                break
+    return connect_id
+
+
+def total_length_by_id(ids, lengths):
+    # sum of the lengths of the branches with the same id, returned for every branch
+    ids = np.asarray(ids)
+    unique_ids, inverse = np.unique(ids, return_inverse=True)
+    totals = np.bincount(inverse, weights=np.asarray(lengths, dtype=np.float64))
+    return totals[inverse]
+
+
+#-----------------------------------------------------------------------------------------------
+# Path lengths
+
+def topological_levels(down):
+    # Levels of a network given the downstream row of every reach (-1 at an outlet): the first level holds the sources and every reach is in a later level than all reaches flowing into it.
+    # Reaches on a loop (bad topology) are left out.
+    n = len(down)
+    has_down = down >= 0
+    indeg = np.bincount(down[has_down], minlength=n)
+    frontier = np.flatnonzero(indeg == 0)
+    levels = []
+    while frontier.size:
+        levels.append(frontier)
+        d = down[frontier]
+        d = d[d >= 0]
+        np.subtract.at(indeg, d, 1)
+        d = np.unique(d)
+        frontier = d[indeg[d] == 0]
+    return levels
+
+
+def path_lengths(down, lengths):
+    # Distance of every reach to the outlet (Down_Distance: its own length plus the lengths of all reaches downstream), the longest flow path from a source to its downstream end (Up_Distance)
+    # and the total length of the reaches upstream, itself included (Up_Length). The levels are found once; Up_Distance and Up_Length are summed from the sources downstream
+    # and Down_Distance in the reverse order. Reaches on a loop are NaN.
+    down = np.asarray(down, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.float64)
+    levels = topological_levels(down)
+    n = len(down)
+
+    up_distance = np.zeros(n)
+    up_length = np.zeros(n)
+    for level in levels:
+        up_distance[level] += lengths[level]
+        up_length[level] += lengths[level]
+        level = level[down[level] >= 0]
+        np.maximum.at(up_distance, down[level], up_distance[level])
+        np.add.at(up_length, down[level], up_length[level])
+
+    down_distance = np.full(n, np.nan)
+    for level in reversed(levels):
+        d = down[level]
+        down_distance[level] = lengths[level] + np.where(d >= 0, down_distance[np.where(d >= 0, d, 0)], 0.0)
+
+    done = np.zeros(n, dtype=bool)
+    if levels:
+        done[np.concatenate(levels)] = True
+    up_distance[~done] = np.nan
+    up_length[~done] = np.nan
+    return down_distance, up_distance, up_length
+
+
+def downstream_difference(down, values):
+    # value of the downstream reach minus the value of each reach (e.g. stream power gradient), NaN at an outlet
+    values = np.asarray(values, dtype=np.float64)
+    has_down = down >= 0
+    return np.where(has_down, values[np.where(has_down, down, 0)] - values, np.nan)
+
+
+#-----------------------------------------------------------------------------------------------
+# Gap interpolation
+
+def gap_owners(down, known, levels=None):
+    # Station (row of a reach with a known value) whose walk downstream claims each reach without a value (gap). A walk starts at the reach downstream of a station and
+    # claims gaps until it reaches a reach with a value, an outlet or a gap claimed by an earlier station. Stations walk in the order of the rows, so the owner of a gap is the
+    # first station from which the gap is reached through gaps only. The owner of a station is itself; reaches without an owner (or on a loop) are -1.
+    # known can be a mask matrix with one column per field: the owners of all fields are found in one pass over the levels.
+    down = np.asarray(down, dtype=np.int64)
+    known = np.asarray(known, dtype=bool)
+    n = len(down)
+    known2 = known.reshape(n, -1)
+    k = known2.shape[1]
+    none = n
+    owner = np.where(known2, np.arange(n)[:, None], none)
+    if levels is None:
+        levels = topological_levels(down)
+    for level in levels:
+        level = level[down[level] >= 0]
+        d = down[level]
+        # (reach, field) pairs which pass their owner to the downstream reach: owned reaches flowing into a gap
+        move = (owner[level] < none) & ~known2[d]
+        rows, cols = np.nonzero(move)
+        np.minimum.at(owner.reshape(-1), d[rows] * k + cols, owner[level[rows], cols])
+    owner = np.where(owner < none, owner, -1)
+    return owner.reshape(known.shape)
+
+
+def interpolate_gaps(down, lengths, values):
+    # Fill the reaches without a value by linear interpolation along the stream between the station whose walk claims them (gap_owners) and the first reach with a value
+    # downstream of the walk (anchor), with the distance between the downstream ends of the reaches. Gaps of walks which end at an outlet or at a gap of another station stay NaN.
+    # Returns the values, the walk id of every reach (stations numbered from 1 in the order of the rows, 0 without an owner) and the distance from the downstream end
+    # of the station (INTP_ID and INTP_LENGTH), NaN without an owner. All gaps are filled at once.
+    # values can be a matrix with one column per field (each with its own gaps): the levels and distances of the network are found once and every result has one column per field.
+    down = np.asarray(down, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.float64)
+    lengths = np.where(np.isnan(lengths), 0.0, lengths)
+    values = np.asarray(values, dtype=np.float64)
+    n = len(down)
+    v = values.reshape(n, -1)
+    k = v.shape[1]
+    known = ~np.isnan(v)
+    levels = topological_levels(down)
+    owner = gap_owners(down, known, levels)
+
+    # distance of the downstream end of every reach to the outlet
+    down_distance = np.full(n, np.nan)
+    for level in reversed(levels):
+        d = down[level]
+        down_distance[level] = lengths[level] + np.where(d >= 0, down_distance[np.where(d >= 0, d, 0)], 0.0)
+    end_distance = down_distance - lengths
+
+    # gaps as (reach, field) pairs, with the station which claims them
+    g, f = np.nonzero((owner >= 0) & ~known)
+    s = owner[g, f]
+
+    # the last gap of each walk gives its anchor, when the reach after it has a value
+    d = down[g]
+    d_safe = np.where(d >= 0, d, 0)
+    last = (d < 0) | known[d_safe, f] | (owner[d_safe, f] != s)
+    anchor = np.full((n, k), -1, dtype=np.int64)
+    ends = last & (d >= 0) & known[d_safe, f]
+    anchor[s[ends], f[ends]] = d[ends]
+
+    station_id = np.cumsum(known, axis=0)
+    cols = np.arange(k)[None, :]
+    intp_id = np.where(owner >= 0, station_id[np.where(owner >= 0, owner, 0), cols], 0)
+    intp_length = np.where(known, 0.0, np.nan)
+    intp_length[g, f] = end_distance[s] - end_distance[g]
+
+    filled = v.copy()
+    a = anchor[s, f]
+    has_anchor = a >= 0
+    a_safe = np.where(has_anchor, a, 0)
+    span = end_distance[s] - end_distance[a_safe]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fraction = np.clip(np.where(span > 0, intp_length[g, f] / span, 1.0), 0.0, 1.0)
+    filled[g, f] = np.where(has_anchor, v[s, f] + fraction * (v[a_safe, f] - v[s, f]), np.nan)
+    return filled.reshape(values.shape), intp_id.reshape(values.shape), intp_length.reshape(values.shape)
+
+
+#-----------------------------------------------------------------------------------------------
+# Reach slope
+
+def upstream_rows(down, valid=None):
+    # Row of the reach upstream of each reach on the trace of the first reach (in the order of the rows) upstream of it, -1 at sources. Traces start at every reach
+    # not reached yet, in the order of the rows, and run down to the outlet, so a reach is first reached from the upstream reach whose upstream reaches hold the first row.
+    # With valid (e.g. reaches with an elevation), the first valid upstream reach in that order is returned.
+    down = np.asarray(down, dtype=np.int64)
+    n = len(down)
+    first_row = np.arange(n)
+    for level in topological_levels(down):
+        level = level[down[level] >= 0]
+        np.minimum.at(first_row, down[level], first_row[level])
+    u = np.flatnonzero(down >= 0)
+    if valid is not None:
+        u = u[np.asarray(valid, dtype=bool)[u]]
+    up = np.full(n, -1, dtype=np.int64)
+    order = np.lexsort((-first_row[u], down[u]))
+    # the last of each reach in this order has the smallest first row
+    up[down[u][order]] = u[order]
+    return up
+
+
+def reach_slope(down, elevation, lengths):
+    # Slope of every reach from the elevation of the reach upstream of it (upstream_rows, first one with an elevation): (elev - elev[up]) / length. NaN at sources and
+    # when an elevation or the length is missing or zero.
+    elevation = np.asarray(elevation, dtype=np.float64)
+    lengths = np.asarray(lengths, dtype=np.float64)
+    up = upstream_rows(down, ~np.isnan(elevation))
+    has_up = up >= 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope = (elevation - elevation[np.where(has_up, up, 0)]) / lengths
+    return np.where(has_up & (lengths > 0), slope, np.nan)
+
+
+def least_squares_slope(down, elevation, lengths, n_neighbours):
+    # Least-squares slope of the elevation against the distance downstream over every reach and n_neighbours reaches upstream (upstream_rows) and downstream of it.
+    # Reaches are at the downstream end of their length; NaN elevations are skipped and a slope needs 2 reaches at different distances. Same sign as reach_slope.
+    down = np.asarray(down, dtype=np.int64)
+    elevation = np.asarray(elevation, dtype=np.float64)
+    lengths = np.asarray(lengths, dtype=np.float64)
+    lengths = np.where(np.isnan(lengths), 0.0, lengths)
+    n = len(down)
+    up = upstream_rows(down)
+    # distance downstream of the end of every reach (0 at the outlet, decreasing upstream); NaN on loops
+    x = -(path_lengths(down, lengths)[0] - lengths)
+
+    count = np.zeros(n)
+    sx = np.zeros(n)
+    sy = np.zeros(n)
+    sxx = np.zeros(n)
+    sxy = np.zeros(n)
+    # the reach and n_neighbours reaches upstream, then n_neighbours reaches downstream; the distances are taken from the reach itself
+    for step, idx, n_steps in ((up, np.arange(n), int(n_neighbours) + 1), (down, down.copy(), int(n_neighbours))):
+        for k in range(n_steps):
+            found = idx >= 0
+            i = np.where(found, idx, 0)
+            ok = found & ~np.isnan(elevation[i]) & ~np.isnan(x[i] - x)
+            xi = np.where(ok, x[i] - x, 0.0)
+            yi = np.where(ok, elevation[i], 0.0)
+            count += ok
+            sx += xi
+            sy += yi
+            sxx += xi * xi
+            sxy += xi * yi
+            idx = np.where(found, step[i], -1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        var = sxx - sx * sx / count
+        slope = (sxy - sx * sy / count) / var
+    return np.where((count >= 2) & (var > 0), slope, np.nan)
@@ -0,0 +1,123 @@
+## Python script: This script gives integer node ids to the start and end points of reaches and to points (e.g. elevation or discharge points), so that the SPIN tools join tables on integer keys
+## instead of "x,y" text fields. The coordinates are snapped to a grid of cells of the size of the tolerance and a point gets the id of a known node within the tolerance
+## (found in the 3 x 3 cells around it), so that two points which differ by floating-point noise share one id. Joins read the source table once into a dict (hash join).
+## Last edited: Oct 18, 2026
+#-----------------------------------------------------------------------------------------------#
+
+import math
+
+# distance (map units) within which two points are the same node
+DEFAULT_TOLERANCE = 0.001
+
+# AddField type of each ListFields type, to copy fields in joins
+FIELD_TYPES = {"Double": "DOUBLE", "Single": "FLOAT", "Integer": "LONG", "SmallInteger": "SHORT", "String": "TEXT", "Date": "DATE"}
+
+
+#-----------------------------------------------------------------------------------------------
+# Node ids
+
+class NodeIndex(object):
+    # Integer ids of points, starting at 1. Nodes are kept in a dict of grid cells (spatial hash) of the size of the tolerance.
+
+    def __init__(self, tolerance=DEFAULT_TOLERANCE):
+        self.tolerance = float(tolerance)
+        self.cells = {}
+        self.n_nodes = 0
+
+    def _cell(self, x, y):
+        return int(math.floor(x / self.tolerance)), int(math.floor(y / self.tolerance))
+
+    def find(self, x, y):
+        # id of the nearest node within the tolerance, or None
+        cx, cy = self._cell(x, y)
+        best = None
+        best_d = self.tolerance * self.tolerance
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for node, nx, ny in self.cells.get((cx + dx, cy + dy), ()):
+                    d = (nx - x) * (nx - x) + (ny - y) * (ny - y)
+                    if d <= best_d:
+                        best = node
+                        best_d = d
+        return best
+
+    def node_id(self, x, y):
+        # id of the point, a new id when no node is within the tolerance
+        node = self.find(x, y)
+        if node is None:
+            self.n_nodes = self.n_nodes + 1
+            node = self.n_nodes
+            self.cells.setdefault(self._cell(x, y), []).append((node, x, y))
+        return node
+
+
+#-----------------------------------------------------------------------------------------------
+# Node fields and joins (ArcGIS)
+
+def replace_field(table, field, field_type):
+    import arcpy
+    if field in [f.name for f in arcpy.ListFields(table)]:
+        arcpy.DeleteField_management(table, field)
+    arcpy.AddField_management(table, field, field_type)
+
+
+def add_node_fields(table, index, start_field, end_field=None):
+    # Add LONG fields with the node id of the first point (start_field) and the last point (end_field) of every feature, filled in one pass. For point features both are the point.
+    import arcpy
+    fields = [f for f in (start_field, end_field) if f]
+    for field in fields:
+        replace_field(table, field, "LONG")
+    with arcpy.da.UpdateCursor(table, ["SHAPE@"] + fields) as cursor:
+        for row in cursor:
+            shape = row[0]
+            if shape is None:
+                continue
+            row[1] = index.node_id(shape.firstPoint.X, shape.firstPoint.Y)
+            if end_field:
+                row[2] = index.node_id(shape.lastPoint.X, shape.lastPoint.Y)
+            cursor.updateRow(row)
+
+
+def read_by_node(table, node_field, fields):
+    # values of fields of the first row of each node id
+    import arcpy
+    values = {}
+    with arcpy.da.SearchCursor(table, [node_field] + list(fields)) as cursor:
+        for row in cursor:
+            if row[0] is not None and row[0] not in values:
+                values[row[0]] = list(row[1:])
+    return values
+
+
+def join_on_node(target, target_node_field, source, source_node_field, fields, out_fields=None):
+    # Copy fields of source to the rows of target with the same node id (replaces JoinField on the x,y text fields). out_fields renames the copied fields.
+    import arcpy
+    if isinstance(fields, str):
+        fields = [fields]
+    out_fields = list(fields) if out_fields is None else list(out_fields)
+    source_fields = dict((f.name, f) for f in arcpy.ListFields(source))
+    for field, out_field in zip(fields, out_fields):
+        replace_field(target, out_field, FIELD_TYPES.get(source_fields[field].type, "DOUBLE"))
+
+    values = read_by_node(source, source_node_field, fields)
+    empty = [None] * len(fields)
+    with arcpy.da.UpdateCursor(target, [target_node_field] + out_fields) as cursor:
+        for row in cursor:
+            cursor.updateRow([row[0]] + values.get(row[0], empty))
+
+
+def downstream_difference(table, start_field, end_field, fields, out_fields):
+    # For every reach, the value of fields of the reach which starts at its end node minus its own value (e.g. stream power gradient). The result is null when a value is missing;
+    # reaches without a downstream reach are not changed.
+    import arcpy
+    down_values = read_by_node(table, start_field, fields)
+    n = len(fields)
+    with arcpy.da.UpdateCursor(table, [end_field] + list(fields) + list(out_fields)) as cursor:
+        for row in cursor:
+            if row[0] not in down_values:
+                continue
+            down = down_values[row[0]]
+            missing = None in down or None in row[1:1 + n]
+            for i in range(n):
+                row[1 + n + i] = None if missing else down[i] - row[1 + i]
+            cursor.updateRow(row)
@@ -0,0 +1,48 @@
+## Python script: This script holds the equations of the rural stream power tool (Rural_Power_Analysis.py): discharge, total and specific stream power, width and D84.
+## They work on arrays, so the same equations are used on the columns of a reach store and on the fields read from a feature class.
+## Last edited: Oct 18, 2026
+#-----------------------------------------------------------------------------------------------#
+
+import math
+import numpy as np
+
+# coefficients of the rural discharge Q = c * A^x (A: drainage area in km2)
+RURAL_C = 0.248
+RURAL_X = 0.91
+
+# specific weight of water (N/m3)
+WATER_WEIGHT = 9810.0
+
+# D84 from Ferguson (2005) particle mobility model, equation 16 (assumption: Di = Db), fitted with Annable (1996) data
+KAPPA = 0.41 # constant from Ferguson 2005 - works for D in mm, power in W/m2
+R = 1.65 # submerged specific gravity
+RHO = 1000 # density of water
+THETA_CB = 0.045 # shear stress threshold
+M = 2.80 # roughness multiplier for D84 from Lopez and Barrangan e.g. Hey 1979
+GEE = 9.81 # acceleration by gravity
+
+
+def discharge(drainage_area, c=RURAL_C, x=RURAL_X):
+    # Q = c * A^x
+    with np.errstate(all="ignore"):
+        return c * np.asarray(drainage_area, dtype=np.float64) ** x
+
+
+def rural_power(drainage_area, q, slope, slope_avg, coeff_a, coeff_b):
+    # Fields of the rural stream power of every reach as a list of (field name, array): specific weight of water, total stream power (-S_avg * Q * 9810), width coefficients,
+    # width (a * A^b), specific stream power (power / width) and D84 (mm) from the specific stream power and the slope. Results which are not finite (e.g. a zero slope) are NaN.
+    da = np.asarray(drainage_area, dtype=np.float64)
+    q = np.asarray(q, dtype=np.float64)
+    slope = np.asarray(slope, dtype=np.float64)
+    slope_avg = np.asarray(slope_avg, dtype=np.float64)
+    n = da.size
+    with np.errstate(all="ignore"):
+        power = -(slope_avg * q * WATER_WEIGHT)
+        width = coeff_a * da ** coeff_b
+        spower = power / width
+        # C = log10(30*theta_cb*R/(e*m*S))
+        logc = np.log10(30 * THETA_CB * R / (math.exp(1) * M * np.abs(slope)))
+        d84 = ((((KAPPA * np.abs(spower)) / (2.30 * RHO * logc)) ** (2.0 / 3)) / (THETA_CB * R * GEE)) * 1000
+    fields = [("Wg_Nperm3", np.full(n, WATER_WEIGHT)), ("Power_Wperm", power), ("a", np.full(n, float(coeff_a))), ("b", np.full(n, float(coeff_b))),
+              ("Width_m", width), ("SPower_Wperm", spower), ("D84_mm", d84)]
+    return [(name, np.where(np.isfinite(values), values, np.nan)) for name, values in fields]
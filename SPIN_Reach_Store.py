@@ -0,0 +1,192 @@
+## Python script: This script keeps the reaches of the stream network in a columnar store (a folder ending in .reaches) instead of file geodatabase feature classes, for the intermediate stages.
+## Each attribute is one .npy file (read with memory mapping), the geometry is one array of x,y coordinates with the offsets of the vertices of every reach, and schema.json lists the columns.
+## A scenario store (e.g. Rural_scenario.reaches) points to the store it is based on and only saves the columns it adds, so the reaches are not copied for every scenario.
+## Nulls are NaN in float columns. Feature classes are only written when a stage needs one (to_feature_class).
+## Last edited: Oct 18, 2026
+#-----------------------------------------------------------------------------------------------#
+
+import os
+import json
+import numpy as np
+
+SCHEMA_FILE = "schema.json"
+COORDS_FILE = "coords.npy"
+OFFSETS_FILE = "offsets.npy"
+
+# AddField type of each column dtype kind, to write feature classes
+FIELD_TYPES = {"f": "DOUBLE", "i": "LONG", "u": "LONG", "b": "SHORT", "U": "TEXT"}
+
+
+def is_store(path):
+    return os.path.isfile(os.path.join(str(path), SCHEMA_FILE))
+
+
+def _clear_columns(path):
+    # delete the column files of the store saved in path (only the columns of its schema), before a new store is saved in the same folder
+    if not is_store(path):
+        return
+    with open(os.path.join(path, SCHEMA_FILE)) as f:
+        schema = json.load(f)
+    for name in schema.get("columns", []):
+        if os.path.isfile(os.path.join(path, name + ".npy")):
+            os.remove(os.path.join(path, name + ".npy"))
+
+
+#-----------------------------------------------------------------------------------------------
+# Reach store
+
+class ReachStore(object):
+    # Columns and geometry of a reach store. The vertices of reach i are coords[offsets[i]:offsets[i+1]].
+
+    def __init__(self, path):
+        self.path = str(path)
+        with open(os.path.join(self.path, SCHEMA_FILE)) as f:
+            self.schema = json.load(f)
+        self.base = None
+        if self.schema.get("base"):
+            self.base = ReachStore(os.path.normpath(os.path.join(self.path, self.schema["base"])))
+
+    @classmethod
+    def create(cls, path, coords, offsets, columns, geometry_type="POLYLINE", spatial_reference=""):
+        # Save a new store. columns is a list of (name, array with one value per reach).
+        path = str(path)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        _clear_columns(path)
+        np.save(os.path.join(path, COORDS_FILE), np.asarray(coords, dtype=np.float64).reshape(-1, 2))
+        np.save(os.path.join(path, OFFSETS_FILE), np.asarray(offsets, dtype=np.int64))
+        schema = {"n_rows": int(len(offsets) - 1), "geometry_type": geometry_type, "spatial_reference": spatial_reference, "columns": []}
+        with open(os.path.join(path, SCHEMA_FILE), "w") as f:
+            json.dump(schema, f, indent=1)
+        store = cls(path)
+        for name, values in columns:
+            store.append_column(name, values)
+        return store
+
+    @classmethod
+    def create_scenario(cls, path, base):
+        # Save a new store which reads the geometry and columns of base and saves only the columns added to it. A scenario store already saved in path is replaced
+        # (only its columns are deleted); path cannot be base, a store base is based on, or a store with its own geometry.
+        path = str(path)
+        store = base
+        while store is not None:
+            if os.path.abspath(path) == os.path.abspath(store.path):
+                raise ValueError("The scenario store " + path + " would replace the reach store it is based on.")
+            store = store.base
+        if is_store(path) and not cls(path).schema.get("base"):
+            raise ValueError("The reach store " + path + " is not a scenario store and is not replaced.")
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        _clear_columns(path)
+        schema = {"n_rows": base.n_rows, "geometry_type": base.schema["geometry_type"], "spatial_reference": base.schema["spatial_reference"],
+                  "columns": [], "base": os.path.relpath(base.path, path)}
+        with open(os.path.join(path, SCHEMA_FILE), "w") as f:
+            json.dump(schema, f, indent=1)
+        return cls(path)
+
+    @property
+    def n_rows(self):
+        return self.schema["n_rows"]
+
+    @property
+    def columns(self):
+        # names of all columns, those of the base store first
+        names = list(self.base.columns) if self.base is not None else []
+        return names + [c for c in self.schema["columns"] if c not in names]
+
+    def column(self, name):
+        # column as a read-only memory-mapped array
+        if name in self.schema["columns"]:
+            return np.load(os.path.join(self.path, name + ".npy"), mmap_mode="r")
+        if self.base is not None:
+            return self.base.column(name)
+        raise KeyError("Column " + name + " is not in the reach store " + self.path)
+
+    def geometry(self):
+        # coordinates of all vertices and the offsets of every reach
+        if self.base is not None:
+            return self.base.geometry()
+        return (np.load(os.path.join(self.path, COORDS_FILE), mmap_mode="r"),
+                np.load(os.path.join(self.path, OFFSETS_FILE), mmap_mode="r"))
+
+    def append_column(self, name, values):
+        # save a column (replacing a column of the same name in this store)
+        values = np.asarray(values)
+        if values.shape != (self.n_rows,):
+            raise ValueError("Column " + name + " has " + str(values.size) + " values for " + str(self.n_rows) + " reaches.")
+        np.save(os.path.join(self.path, name + ".npy"), values)
+        if name not in self.schema["columns"]:
+            self.schema["columns"].append(name)
+            with open(os.path.join(self.path, SCHEMA_FILE), "w") as f:
+                json.dump(self.schema, f, indent=1)
+
+
+#-----------------------------------------------------------------------------------------------
+# Feature classes (ArcGIS)
+
+def _column_values(values):
+    # column of cursor values: numbers as floats with NaN for nulls, text as unicode
+    if any(hasattr(v, "encode") for v in values):
+        return np.array([u"" if v is None else v for v in values])
+    return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+
+def table_columns(table, fields):
+    # read fields of a table in one pass, in the order of the object ids
+    import arcpy
+    rows = [row for row in arcpy.da.SearchCursor(table, list(fields), sql_clause=(None, "ORDER BY OBJECTID"))]
+    return [(field, _column_values([row[i] for row in rows])) for i, field in enumerate(fields)]
+
+
+def from_feature_class(fc, path, fields=None):
+    # Save a feature class (e.g. final_segments) as a reach store, one row per feature in the order of the object ids. All fields except the geometry and object id are saved by default.
+    import arcpy
+    desc = arcpy.Describe(fc)
+    if fields is None:
+        fields = [f.name for f in arcpy.ListFields(fc) if f.type not in ("OID", "Geometry", "Blob", "Raster", "GUID")]
+    coords = []
+    offsets = [0]
+    with arcpy.da.SearchCursor(fc, ["SHAPE@"], sql_clause=(None, "ORDER BY OBJECTID")) as cursor:
+        for row in cursor:
+            if row[0] is not None:
+                for part in row[0]:
+                    for point in part:
+                        if point is not None:
+                            coords.append((point.X, point.Y))
+            offsets.append(len(coords))
+    return ReachStore.create(path, coords, offsets, table_columns(fc, fields), desc.shapeType.upper(), desc.spatialReference.exportToString())
+
+
+def append_from_table(store, table, fields):
+    # add fields of a table with one row per reach (in the order of the object ids) as columns of the store
+    for name, values in table_columns(table, fields):
+        store.append_column(name, values)
+
+
+def to_feature_class(store, out_fc, fields=None):
+    # Save a reach store as a feature class with the given columns (default: all columns)
+    import arcpy
+    fields = store.columns if fields is None else list(fields)
+    sr = arcpy.SpatialReference()
+    sr.loadFromString(store.schema["spatial_reference"])
+    arcpy.Delete_management(out_fc)
+    folder, name = os.path.split(out_fc)
+    shape_type = store.schema["geometry_type"]
+    arcpy.CreateFeatureclass_management(folder, name, shape_type, "", "DISABLED", "DISABLED", sr)
+    columns = [store.column(f) for f in fields]
+    for field, values in zip(fields, columns):
+        arcpy.AddField_management(out_fc, field, FIELD_TYPES.get(values.dtype.kind, "DOUBLE"))
+
+    coords, offsets = store.geometry()
+    with arcpy.da.InsertCursor(out_fc, ["SHAPE@"] + fields) as cursor:
+        for i in range(store.n_rows):
+            points = [arcpy.Point(x, y) for x, y in coords[offsets[i]:offsets[i + 1]]]
+            if shape_type == "POINT":
+                shape = arcpy.PointGeometry(points[0], sr)
+            else:
+                shape = arcpy.Polyline(arcpy.Array(points), sr)
+            values = []
+            for c in columns:
+                v = c[i].item()
+                values.append(None if isinstance(v, float) and v != v else v)
+            cursor.insertRow([shape] + values)
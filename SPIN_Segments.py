@@ -0,0 +1,302 @@
+## Python script: This script holds the array functions of the segment and smoothing tools (DEM_Slope_Smoothe_Algorithm.py and Smoothing_Average.py).
+## Segments group reaches while tracing downstream from the reach with the highest elevation until the difference ratio in drainage area is >= 0.1.
+## The reaches are read once into arrays and each reach points to its downstream reach, so that the tools do not scan the table for every reach.
+## Last edited: Oct 18, 2026
+#-----------------------------------------------------------------------------------------------#
+
+import numpy as np
+
+# difference ratio in drainage area which ends a segment
+MAX_DELTA_DA = 0.1
+
+# weights of the distance smoothing window
+KERNELS = ("boxcar", "triangular", "gaussian")
+
+# statistics of the smoothing window: mean, or robust to spikes (e.g. DEM artefacts at culverts and bridges)
+STATISTICS = ("mean", "median", "trimmed mean")
+
+# proportion of the values cut from each end of the sorted window by the trimmed mean
+DEFAULT_TRIM = 0.1
+
+# memory (bytes) of the window matrix sorted at once by the robust statistics; the number of reaches of a chunk is taken from the width of its widest window
+CHUNK_BYTES = 64 * 1024 * 1024
+
+
+#-----------------------------------------------------------------------------------------------
+# Segments
+
+def seed_order(down_elev, ids):
+    # order in which the reaches start segments: elevation at the ending node from highest to lowest, then by id (reaches without elevation are last)
+    down_elev = np.asarray(down_elev, dtype=np.float64)
+    return np.lexsort((np.asarray(ids), np.where(np.isnan(down_elev), np.inf, -down_elev)))
+
+
+def build_segments(down, order, drainage_area, max_delta=MAX_DELTA_DA):
+    # Assign every reach a segment id (starting at 1) and its position in the segment (0 at the first reach). Reaches are taken in order; a reach without a segment starts a new one
+    # and the segment is traced downstream while the downstream reach has no segment and its difference ratio in drainage area to the first reach, (da - start_da) / da, is < max_delta.
+    # A missing or zero drainage area gives a ratio of 0. Returns the segment ids, positions and ratios (NaN at the first reach of each segment). Every reach is visited once.
+    down = np.asarray(down, dtype=np.int64)
+    da = np.asarray(drainage_area, dtype=np.float64)
+    da = np.where(np.isnan(da), 0.0, da)
+    n = down.size
+    seg_id = np.zeros(n, dtype=np.int64)
+    position = np.zeros(n, dtype=np.int64)
+    delta = np.full(n, np.nan)
+
+    seg = 0
+    for i in order:
+        if seg_id[i] != 0:
+            continue
+        seg = seg + 1
+        seg_id[i] = seg
+        start_da = da[i]
+        pos = 0
+        j = down[i]
+        while j >= 0 and seg_id[j] == 0:
+            delta_j = (da[j] - start_da) / da[j] if da[j] != 0 else 0.0
+            if not delta_j < max_delta:
+                break
+            pos = pos + 1
+            seg_id[j] = seg
+            position[j] = pos
+            delta[j] = delta_j
+            j = down[j]
+    return seg_id, position, delta
+
+
+#-----------------------------------------------------------------------------------------------
+# Smoothing
+
+def segment_bounds(seg_id, position):
+    # Order of the reaches by segment and position, and the start and end (exclusive) in that order of the segment of every sorted reach
+    order = np.lexsort((position, seg_id))
+    s = np.asarray(seg_id)[order]
+    n = s.size
+    new_seg = np.ones(n, dtype=bool)
+    new_seg[1:] = s[1:] != s[:-1]
+    starts = np.flatnonzero(new_seg)
+    ends = np.append(starts[1:], n)
+    group = np.cumsum(new_seg) - 1
+    return order, starts[group], ends[group]
+
+
+def window_bounds(seg_id, position, window):
+    # Order of the reaches by segment and position, and the first and last (exclusive) reach in that order of the centered window of window reaches of every sorted reach,
+    # cut at the ends of its segment. Both bounds never decrease along the sorted reaches.
+    order, seg_start, seg_end = segment_bounds(seg_id, position)
+    i = np.arange(order.size)
+    lo = np.maximum(i - window // 2, seg_start)
+    hi = np.minimum(i + (window - 1) // 2 + 1, seg_end)
+    return order, lo, hi
+
+
+def rolling_mean(seg_id, position, values, window, min_periods=1):
+    # Centered rolling mean of values over window reaches within every segment at once (as pandas rolling(window, min_periods, center=True) over the reaches of each segment
+    # ordered by position). The sums come from one cumulative sum over the sorted reaches, so each reach costs the same whatever the window. NaN values are skipped and a mean
+    # needs min_periods values, otherwise it is NaN. values can be a matrix with one column per field: all fields are averaged from the same sort and window bounds.
+    values = np.asarray(values, dtype=np.float64)
+    order, lo, hi = window_bounds(seg_id, position, window)
+    n = order.size
+    v = values[order].reshape(n, -1)
+    valid = ~np.isnan(v)
+    zero = np.zeros((1, v.shape[1]))
+    csum = np.concatenate((zero, np.cumsum(np.where(valid, v, 0.0), axis=0)))
+    ccount = np.concatenate((zero.astype(np.int64), np.cumsum(valid, axis=0)))
+
+    count = ccount[hi] - ccount[lo]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(count >= max(min_periods, 1), (csum[hi] - csum[lo]) / count, np.nan)
+    out = np.empty(v.shape)
+    out[order] = mean
+    return out.reshape(values.shape)
+
+
+def along_stream(seg_id, position, lengths):
+    # Order of the reaches by segment and position and the distance along the stream of the middle of every sorted reach from the start of its segment.
+    # The distances are returned on one increasing axis for all segments (each segment starts after the end of the previous one plus gap), so windows never cross segments.
+    order, seg_start, seg_end = segment_bounds(seg_id, position)
+    length = np.asarray(lengths, dtype=np.float64)[order]
+    length = np.where(np.isnan(length), 0.0, length)
+    csum = np.concatenate(([0.0], np.cumsum(length)))
+    middle = csum[1:] - length / 2.0 - csum[seg_start]
+    seg_length = csum[seg_end] - csum[seg_start]
+    first = seg_start == np.arange(length.size)
+    return order, middle, seg_length, first
+
+
+def _distance_bounds(middle, seg_length, first, distance):
+    # one increasing axis for all segments with a gap larger than the window between segments, and the first and last (exclusive) reach of the window of every sorted reach
+    # (two sorted pointers over the axis); reaches at exactly distance are in the window
+    span = seg_length + 2.0 * distance + 1.0
+    axis = middle + np.cumsum(np.where(first, span, 0.0)) - span
+    tol = 1e-9 * (np.abs(axis).max() + 1.0) if axis.size else 0.0
+    lo = np.searchsorted(axis, axis - distance - tol, side="left")
+    hi = np.searchsorted(axis, axis + distance + tol, side="right")
+    return axis, lo, hi
+
+
+def distance_mean(seg_id, position, values, lengths, distances, kernel="boxcar", min_periods=1):
+    # Centered mean of values over the reaches whose middle is within distance (m, along the stream, from the cumulative reach lengths) of the middle of each reach, within its segment.
+    # kernel: "boxcar" (equal weights), "triangular" (weight 1 - d / distance) or "gaussian" (standard deviation distance / 2). The reaches are sorted once and every distance reuses the
+    # same axis, so several windows can be compared in one run. Returns one array per distance. NaN values are skipped and a mean needs min_periods values.
+    if kernel not in KERNELS:
+        raise ValueError("Unknown smoothing kernel " + str(kernel) + ", use one of " + ", ".join(KERNELS))
+    values = np.asarray(values, dtype=np.float64)
+    order, middle, seg_length, first = along_stream(seg_id, position, lengths)
+    v = values[order]
+    valid = ~np.isnan(v)
+    v = np.where(valid, v, 0.0)
+    n = v.size
+    i = np.arange(n)
+    csum = np.concatenate(([0.0], np.cumsum(v)))
+    ccount = np.concatenate(([0], np.cumsum(valid)))
+
+    results = []
+    for distance in distances:
+        distance = float(distance)
+        axis, lo, hi = _distance_bounds(middle, seg_length, first, distance)
+
+        if kernel == "boxcar":
+            total = csum[hi] - csum[lo]
+            weight = (ccount[hi] - ccount[lo]).astype(np.float64)
+        else:
+            total = np.zeros(n)
+            weight = np.zeros(n)
+            for k in range(int((lo - i).min()) if n else 0, int((hi - i).max()) if n else 0):
+                j = i + k
+                inside = (j >= lo) & (j < hi)
+                j = np.where(inside, j, i)
+                d = np.abs(axis[j] - axis)
+                if kernel == "triangular":
+                    w = np.maximum(1.0 - d / distance, 0.0) if distance > 0 else np.ones(n)
+                else:
+                    w = np.exp(-0.5 * (d / (distance / 2.0)) ** 2) if distance > 0 else np.ones(n)
+                w = np.where(inside & valid[j], w, 0.0)
+                total += w * v[j]
+                weight += w
+        count = ccount[hi] - ccount[lo]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where((count >= max(min_periods, 1)) & (weight > 0), total / weight, np.nan)
+        out = np.empty(n)
+        out[order] = mean
+        results.append(out)
+    return results
+
+
+def _window_statistic(order, lo, hi, values, statistic, trim=DEFAULT_TRIM, min_periods=1):
+    # Median or trimmed mean of the values of the sorted reaches lo to hi (exclusive) of every sorted reach, returned in the order of the input.
+    # The windows are gathered in a matrix (NaN past hi) and sorted row by row; NaN values sort last and are skipped. The reaches are taken from the widest window down,
+    # in chunks of CHUNK_BYTES / (8 * width) reaches, so the matrix stays within CHUNK_BYTES however wide the windows are (at least one reach per chunk).
+    # The trimmed mean cuts int(trim * count) values from each end of the sorted window (as scipy.stats.trim_mean).
+    if statistic not in STATISTICS:
+        raise ValueError("Unknown smoothing statistic " + str(statistic) + ", use one of " + ", ".join(STATISTICS))
+    v = np.asarray(values, dtype=np.float64)[order]
+    n = v.size
+    out_sorted = np.full(n, np.nan)
+    length = hi - lo
+    by_length = np.argsort(-length, kind="mergesort")
+    start = 0
+    while start < n:
+        width = max(int(length[by_length[start]]), 1)
+        stop = min(start + max(1, CHUNK_BYTES // (8 * width)), n)
+        chunk = by_length[start:stop]
+        idx = lo[chunk, None] + np.arange(width)
+        window = np.where(idx < hi[chunk, None], v[np.minimum(idx, n - 1)], np.nan)
+        del idx
+        window.sort(axis=1)
+        count = (~np.isnan(window)).sum(axis=1)
+        rows = np.arange(chunk.size)
+        if statistic == "median":
+            upper = window[rows, np.maximum(count // 2, 0)]
+            lower = window[rows, np.maximum((count - 1) // 2, 0)]
+            result = (upper + lower) / 2.0
+        elif statistic == "trimmed mean":
+            cut = (trim * count).astype(np.int64)
+            csum = np.concatenate((np.zeros((chunk.size, 1)), np.cumsum(np.where(np.isnan(window), 0.0, window), axis=1)), axis=1)
+            kept = count - 2 * cut
+            with np.errstate(invalid="ignore", divide="ignore"):
+                result = (csum[rows, count - cut] - csum[rows, cut]) / kept
+        else:
+            csum = np.nansum(window, axis=1)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                result = csum / count
+        out_sorted[chunk] = np.where(count >= max(min_periods, 1), result, np.nan)
+        start = stop
+    out = np.empty(n)
+    out[order] = out_sorted
+    return out
+
+
+def rolling_median(seg_id, position, values, window, min_periods=1):
+    # Centered rolling median of values over window reaches within every segment at once (same windows as rolling_mean). NaN values are skipped.
+    order, lo, hi = window_bounds(seg_id, position, window)
+    return _window_statistic(order, lo, hi, values, "median", min_periods=min_periods)
+
+
+def rolling_trimmed_mean(seg_id, position, values, window, trim=DEFAULT_TRIM, min_periods=1):
+    # Centered rolling mean of values over window reaches within every segment at once, without the trim proportion of the lowest and highest values of each window.
+    order, lo, hi = window_bounds(seg_id, position, window)
+    return _window_statistic(order, lo, hi, values, "trimmed mean", trim, min_periods)
+
+
+def rolling_statistic(seg_id, position, values, window, statistic="mean", trim=DEFAULT_TRIM, min_periods=1):
+    # rolling mean, median or trimmed mean (see STATISTICS) of values, a vector or a matrix with one column per field
+    if statistic == "mean":
+        return rolling_mean(seg_id, position, values, window, min_periods)
+    values = np.asarray(values, dtype=np.float64)
+    order, lo, hi = window_bounds(seg_id, position, window)
+    if values.ndim == 1:
+        return _window_statistic(order, lo, hi, values, statistic, trim, min_periods)
+    return np.column_stack([_window_statistic(order, lo, hi, values[:, k], statistic, trim, min_periods) for k in range(values.shape[1])])
+
+
+def distance_statistic(seg_id, position, values, lengths, distances, statistic="median", trim=DEFAULT_TRIM, min_periods=1):
+    # Median or trimmed mean of values over the same windows in m along the stream as distance_mean, one array per distance
+    order, middle, seg_length, first = along_stream(seg_id, position, lengths)
+    results = []
+    for distance in distances:
+        axis, lo, hi = _distance_bounds(middle, seg_length, first, float(distance))
+        results.append(_window_statistic(order, lo, hi, values, statistic, trim, min_periods))
+    return results
+
+
+#-----------------------------------------------------------------------------------------------
+# Tables (ArcGIS)
+
+def read_segments(table, seg_field, pos_field, fields):
+    # Read the object id, segment id, position and fields of all reaches of a table with a segment id and position in one pass. Nulls are NaN.
+    import arcpy
+    rows = [row for row in arcpy.da.SearchCursor(table, ["OID@", seg_field, pos_field] + list(fields))]
+    rows = [row for row in rows if row[1] is not None and row[2] is not None]
+    oid_arr = np.array([row[0] for row in rows], dtype=np.int64)
+    seg_arr = np.array([row[1] for row in rows], dtype=np.float64)
+    pos_arr = np.array([row[2] for row in rows], dtype=np.float64)
+    columns = {}
+    for k, field in enumerate(fields):
+        columns[field] = np.array([np.nan if row[3 + k] is None else row[3 + k] for row in rows], dtype=np.float64)
+    return oid_arr, seg_arr, pos_arr, columns
+
+
+def write_columns(table, oids, out_fields, columns):
+    # Write arrays (one value per object id in oids) to out_fields in one pass. Rows which are not in oids and NaN values are set to null.
+    import arcpy
+    values = {}
+    for i in range(len(oids)):
+        values[int(oids[i])] = [None if np.isnan(c[i]) else float(c[i]) for c in columns]
+    empty = [None] * len(out_fields)
+    with arcpy.da.UpdateCursor(table, ["OID@"] + list(out_fields)) as cursor:
+        for row in cursor:
+            cursor.updateRow([row[0]] + values.get(row[0], empty))
+
+
+def smooth_table(table, seg_field, pos_field, value_fields, out_fields, window, min_periods=1, statistic="mean", trim=DEFAULT_TRIM):
+    # Read the segment id, position and values of all reaches of a table in one pass, smooth all segments and fields at once over window reaches and write the results in one pass.
+    # value_fields and out_fields are a field name or lists of field names. statistic is one of STATISTICS. Reaches without a segment id or position are left null.
+    if isinstance(value_fields, str):
+        value_fields = [value_fields]
+    if isinstance(out_fields, str):
+        out_fields = [out_fields]
+    oid_arr, seg_arr, pos_arr, columns = read_segments(table, seg_field, pos_field, value_fields)
+    values = np.column_stack([columns[f] for f in value_fields]) if len(oid_arr) else np.zeros((0, len(value_fields)))
+    means = rolling_statistic(seg_arr, pos_arr, values, window, statistic, trim, min_periods)
+    write_columns(table, oid_arr, out_fields, [means[:, k] for k in range(len(out_fields))])
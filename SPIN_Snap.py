@@ -0,0 +1,165 @@
+## Python script: This script snaps points (e.g. HEC-RAS river stations) to the nearest stream reach within a tolerance (45 m in the HecRas tools) instead of Snap_edit and SpatialJoin.
+## The straight segments between the vertices of the reaches are kept in a grid index of cells of the size of the tolerance: a segment is listed in every cell its bounding box
+## (grown by the tolerance) covers, so a point only has to be compared with the segments listed in its own cell. All points are snapped at once with array operations.
+## Points without a reach within the tolerance are reported instead of being dropped.
+## Last edited: Oct 18, 2026
+#-----------------------------------------------------------------------------------------------#
+
+import numpy as np
+import SPIN_Nodes as nd
+
+# distance (map units, m) within which a point is snapped to a reach
+DEFAULT_TOLERANCE = 45.0
+
+# fields of the snapped points: row (object id) of the nearest reach, distance to it and position along it from its start
+REACH_FIELD = "SnapReach"
+DISTANCE_FIELD = "SnapDist"
+POSITION_FIELD = "SnapPos"
+
+
+#-----------------------------------------------------------------------------------------------
+# Segment index
+
+class SegmentIndex(object):
+    # Grid index of the segments of polylines. The vertices of polyline i are coords[offsets[i]:offsets[i+1]] (as in the reach store).
+
+    def __init__(self, coords, offsets, tolerance=DEFAULT_TOLERANCE):
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        self.tolerance = float(tolerance)
+
+        # segments between consecutive vertices of the same polyline
+        line = np.repeat(np.arange(offsets.size - 1), np.diff(offsets))
+        first = np.flatnonzero(line[1:] == line[:-1])
+        self.line = line[first]
+        self.x0, self.y0 = coords[first, 0], coords[first, 1]
+        self.x1, self.y1 = coords[first + 1, 0], coords[first + 1, 1]
+        self.length = np.hypot(self.x1 - self.x0, self.y1 - self.y0)
+        # distance along the polyline of the start of every segment
+        csum = np.cumsum(self.length)
+        line_start = np.searchsorted(self.line, self.line, side="left")
+        self.start = csum - self.length - (csum[line_start] - self.length[line_start]) if self.length.size else csum
+
+        # cells covered by the bounding box of every segment grown by the tolerance
+        size = self.tolerance if self.tolerance > 0 else 1.0
+        self.size = size
+        kx0 = np.floor((np.minimum(self.x0, self.x1) - self.tolerance) / size).astype(np.int64)
+        kx1 = np.floor((np.maximum(self.x0, self.x1) + self.tolerance) / size).astype(np.int64)
+        ky0 = np.floor((np.minimum(self.y0, self.y1) - self.tolerance) / size).astype(np.int64)
+        ky1 = np.floor((np.maximum(self.y0, self.y1) + self.tolerance) / size).astype(np.int64)
+        nx = kx1 - kx0 + 1
+        ny = ky1 - ky0 + 1
+        count = nx * ny
+        seg = np.repeat(np.arange(self.line.size), count)
+        local = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+        kx = kx0[seg] + local // ny[seg]
+        ky = ky0[seg] + local % ny[seg]
+        keys = self._key(kx, ky)
+        order = np.argsort(keys, kind="mergesort")
+        self.keys = keys[order]
+        self.cell_segments = seg[order]
+
+    @staticmethod
+    def _key(kx, ky):
+        # one integer per cell
+        return kx * np.int64(2 ** 31) + ky
+
+    def query(self, x, y):
+        # Nearest polyline of every point within the tolerance. Returns the polyline (-1 when none is within the tolerance), the distance, the position along the polyline
+        # from its first vertex and the coordinates of the snapped point (NaN when none).
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        n = x.size
+        line = np.full(n, -1, dtype=np.int64)
+        distance = np.full(n, np.nan)
+        position = np.full(n, np.nan)
+        snap_x = np.full(n, np.nan)
+        snap_y = np.full(n, np.nan)
+
+        # candidate segments: those listed in the cell of every point
+        valid = ~(np.isnan(x) | np.isnan(y))
+        keys = self._key(np.floor(np.where(valid, x, 0.0) / self.size).astype(np.int64), np.floor(np.where(valid, y, 0.0) / self.size).astype(np.int64))
+        lo = np.searchsorted(self.keys, keys, side="left")
+        hi = np.where(valid, np.searchsorted(self.keys, keys, side="right"), lo)
+        count = hi - lo
+        point = np.repeat(np.arange(n), count)
+        seg = self.cell_segments[np.repeat(lo - (np.cumsum(count) - count), count) + np.arange(count.sum())]
+        if seg.size == 0:
+            return line, distance, position, snap_x, snap_y
+
+        # nearest point of every candidate segment
+        dx = self.x1[seg] - self.x0[seg]
+        dy = self.y1[seg] - self.y0[seg]
+        len2 = dx * dx + dy * dy
+        with np.errstate(invalid="ignore", divide="ignore"):
+            t = np.where(len2 > 0, ((x[point] - self.x0[seg]) * dx + (y[point] - self.y0[seg]) * dy) / len2, 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        px = self.x0[seg] + t * dx
+        py = self.y0[seg] + t * dy
+        d = np.hypot(x[point] - px, y[point] - py)
+
+        # the nearest candidate of every point (the first segment on ties), kept when it is within the tolerance
+        order = np.lexsort((seg, d, point))
+        first = order[np.flatnonzero(np.r_[True, point[order][1:] != point[order][:-1]])]
+        first = first[d[first] <= self.tolerance]
+        p = point[first]
+        s = seg[first]
+        line[p] = self.line[s]
+        distance[p] = d[first]
+        position[p] = self.start[s] + t[first] * self.length[s]
+        snap_x[p] = px[first]
+        snap_y[p] = py[first]
+        return line, distance, position, snap_x, snap_y
+
+
+#-----------------------------------------------------------------------------------------------
+# Feature classes (ArcGIS)
+
+def read_polylines(fc):
+    # object ids, coordinates of all vertices and offsets of the vertices of every polyline of a feature class, in one pass
+    import arcpy
+    oids = []
+    coords = []
+    offsets = [0]
+    with arcpy.da.SearchCursor(fc, ["OID@", "SHAPE@"]) as cursor:
+        for row in cursor:
+            oids.append(row[0])
+            if row[1] is not None:
+                for part in row[1]:
+                    for point in part:
+                        if point is not None:
+                            coords.append((point.X, point.Y))
+            offsets.append(len(coords))
+    return np.array(oids, dtype=np.int64), np.array(coords, dtype=np.float64).reshape(-1, 2), np.array(offsets, dtype=np.int64)
+
+
+def snap_points(points_fc, reach_fc, tolerance=DEFAULT_TOLERANCE, label_field=None):
+    # Add the object id of the nearest reach of reach_fc within the tolerance (REACH_FIELD), the distance (DISTANCE_FIELD) and the position along the reach (POSITION_FIELD)
+    # to every point of points_fc, so that reach fields can be joined on the reach id. The fields are null for points outside the tolerance. Returns the labels
+    # (label_field, default object id) of the points outside the tolerance.
+    import arcpy
+    reach_oids, coords, offsets = read_polylines(reach_fc)
+    index = SegmentIndex(coords, offsets, tolerance)
+
+    fields = ["OID@", "SHAPE@XY"] + ([label_field] if label_field else [])
+    rows = [row for row in arcpy.da.SearchCursor(points_fc, fields)]
+    x = np.array([np.nan if row[1] is None else row[1][0] for row in rows], dtype=np.float64)
+    y = np.array([np.nan if row[1] is None else row[1][1] for row in rows], dtype=np.float64)
+    line, distance, position, snap_x, snap_y = index.query(x, y)
+
+    values = {}
+    outside = []
+    for i, row in enumerate(rows):
+        if line[i] < 0:
+            values[row[0]] = [None, None, None]
+            outside.append(row[2] if label_field else row[0])
+        else:
+            values[row[0]] = [int(reach_oids[line[i]]), float(distance[i]), float(position[i])]
+
+    nd.replace_field(points_fc, REACH_FIELD, "LONG")
+    nd.replace_field(points_fc, DISTANCE_FIELD, "DOUBLE")
+    nd.replace_field(points_fc, POSITION_FIELD, "DOUBLE")
+    with arcpy.da.UpdateCursor(points_fc, ["OID@", REACH_FIELD, DISTANCE_FIELD, POSITION_FIELD]) as cursor:
+        for row in cursor:
+            cursor.updateRow([row[0]] + values[row[0]])
+    return outside